@@ -0,0 +1,389 @@
+"""
+基于asyncio的nacos客户端，所有后台任务共用一个事件循环.
+
+依赖aiohttp，需要单独安装：pip install aiohttp
+"""
+import asyncio
+import json
+import time
+import typing as t
+
+import balancer
+from beat_reactor import CODE_RESOURCE_NOT_FOUND
+from config_listener import ConfigSubscription, content_md5, parse_changed_keys
+from constants import BEAT_TIME, TIME_OUT
+from nacos import DEFAULTS
+from util import HostPool, get_host_ip, logger
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+# 计为host故障的异常，记录到HostPool的熔断器
+HOST_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if aiohttp is not None else ()
+# aiohttp连接池的最大连接数，所有协程共用
+POOL_SIZE = 100
+
+
+class AsyncNacos:
+    """
+    异步nacos客户端，接口与nacos.Nacos保持一致
+
+    Examples:
+      client = AsyncNacos(host="127.0.0.1:8848", username="nacos", password="nacos")
+      await client.login()
+      await client.register_service("10.0.0.1", "my-service", 8080)
+      await client.config("my-service-dev.yaml", callback=on_change)
+      url = await client.get_server_instance("dipper-gateway")
+      await client.close()
+    """
+
+    def __init__(self, host="127.0.0.1:8848", username="", password="",
+                 pool_size=POOL_SIZE):
+        if aiohttp is None:
+            raise ImportError("AsyncNacos 依赖 aiohttp，请先安装：pip install aiohttp")
+        self.host = host
+        self.host_pool = HostPool(host)
+        self.username = username
+        self.password = password
+        self.pool_size = pool_size
+        self.access_token = ""
+        self.access_token_invalid_time = -1
+        self._session: t.Optional["aiohttp.ClientSession"] = None
+        self._token_lock = asyncio.Lock()
+        self._tasks: t.List[asyncio.Task] = []
+        self._subscriptions: t.Dict[tuple, ConfigSubscription] = {}
+        self._config_callbacks: t.Dict[tuple, t.List[t.Callable]] = {}
+        self._listener_task: t.Optional[asyncio.Task] = None
+        # (service, group, cluster) -> (过期时间, 实例列表)
+        self._instance_dict: t.Dict[tuple, tuple] = {}
+        self._selector_dict: t.Dict[tuple, list] = {}
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @staticmethod
+    def _url(client, uri: str) -> str:
+        return "http://" + client.host + "/nacos/v1" + uri
+
+    async def login(self) -> str:
+        """
+        登录并刷新token，并发调用时只会发起一次登录请求
+
+        Returns:
+          accessToken
+        """
+        invalid_time = self.access_token_invalid_time
+        async with self._token_lock:
+            # 等锁期间其他协程已经完成刷新
+            if self.access_token and self.access_token_invalid_time != invalid_time:
+                return self.access_token
+            client = self.host_pool.borrow()
+            with client.track(failures=HOST_ERRORS):
+                async with self._get_session().post(
+                        self._url(client, "/auth/login"),
+                        data={"username": self.username, "password": self.password},
+                        timeout=aiohttp.ClientTimeout(total=DEFAULTS["TIMEOUT"])) as resp:
+                    if resp.status != 200:
+                        raise PermissionError("nacos认证失败，请检查账号密码是否正确")
+                    login_data = await resp.json(content_type=None)
+            self.access_token = login_data["accessToken"]
+            # 设置10秒偏移量
+            self.access_token_invalid_time = int(time.time()) + login_data["tokenTtl"] - 10
+            return self.access_token
+
+    async def get_token(self) -> str:
+        if not (self.username and self.password):
+            return ""
+        if self.access_token and time.time() < self.access_token_invalid_time:
+            return self.access_token
+        return await self.login()
+
+    async def _request(self, method: str, uri: str, params=None, data=None, headers=None,
+                       timeout=DEFAULTS["TIMEOUT"], record_latency=True) -> t.Tuple[int, str]:
+        """
+        发起请求，403时刷新token重试一次，请求结果记录到host的熔断器
+
+        Args:
+          record_latency: 是否记录host延迟，长轮询不记录
+
+        Returns:
+          (状态码, 响应内容)
+        """
+        for _ in range(2):
+            query = dict(params or {})
+            token = await self.get_token()
+            if token:
+                query["accessToken"] = token
+            client = self.host_pool.borrow()
+            with client.track(record_latency=record_latency, failures=HOST_ERRORS):
+                async with self._get_session().request(
+                        method, self._url(client, uri), params=query, data=data, headers=headers,
+                        timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    text = await resp.text()
+            if resp.status == 403 and token:
+                self.access_token_invalid_time = -1
+                continue
+            return resp.status, text
+        return 403, ""
+
+    async def register_service(self, service_ip, service_name, service_port=80,
+                               namespace_id="dipper", group_name="DEFAULT_GROUP",
+                               cluster_name="DEFAULT", ephemeral=True, metadata=None,
+                               weight=1, enabled=True) -> bool:
+        """
+        注册服务并启动心跳任务，参数同nacos.Nacos.register_service
+
+        Returns:
+          是否注册成功
+        """
+        service_ip = service_ip or get_host_ip()
+        params = {
+            "ip": service_ip,
+            "port": service_port,
+            "serviceName": service_name,
+            "namespaceId": namespace_id,
+            "groupName": group_name,
+            "clusterName": cluster_name,
+            "ephemeral": str(ephemeral).lower(),
+            "metadata": json.dumps(metadata or {}),
+            "weight": weight,
+            "enabled": str(enabled).lower()
+        }
+        if not await self._register_instance(params):
+            return False
+        beat_json = {
+            "ip": service_ip,
+            "port": service_port,
+            "serviceName": service_name,
+            "cluster": cluster_name,
+            "metadata": metadata or {},
+            "weight": weight
+        }
+        beat_params = {
+            "serviceName": service_name,
+            "groupName": group_name,
+            "namespaceId": namespace_id,
+            "beat": json.dumps(beat_json)
+        }
+        self._spawn(self._beat_loop(params, beat_params))
+        return True
+
+    async def _register_instance(self, params) -> bool:
+        """
+        注册实例，首次注册和心跳返回实例不存在时调用
+
+        Returns:
+          是否注册成功
+        """
+        status, text = await self._request("POST", "/ns/instance", params=params)
+        if status != 200 or text != "ok":
+            logger.error("[Nacos] 服务注册失败 %s", text)
+            return False
+        logger.info("[Nacos] 服务注册成功: %s", params["serviceName"])
+        return True
+
+    async def beat(self, params) -> t.Optional[dict]:
+        """
+        发送一次心跳
+
+        Returns:
+          心跳返回结果，失败时返回None
+        """
+        status, text = await self._request("PUT", "/ns/instance/beat", params=params)
+        if status != 200:
+            logger.warning("[Nacos] 心跳请求失败: %s", text)
+            return None
+        return json.loads(text)
+
+    async def _beat_loop(self, register_params, beat_params):
+        interval = BEAT_TIME
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.beat(beat_params)
+                if result and result.get("code") == CODE_RESOURCE_NOT_FOUND:
+                    # 服务端已剔除实例（如nacos重启），重新注册
+                    logger.warning("[Nacos] 实例不存在，重新注册: %s", register_params["serviceName"])
+                    await self._register_instance(register_params)
+                if result and result.get("clientBeatInterval"):
+                    interval = result["clientBeatInterval"] / 1000.0
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("[Nacos] 服务心跳维持失败！", exc_info=True)
+
+    async def get_config(self, data_id, group="DEFAULT_GROUP", tenant="") -> t.Optional[str]:
+        """
+        获取配置内容
+
+        Returns:
+          配置内容，不存在时返回None
+        """
+        sub = ConfigSubscription(data_id, group, tenant)
+        status, text = await self._request("GET", "/cs/configs", params=sub.query_params())
+        if status != 200:
+            logger.warning("[Nacos] 配置获取失败：dataId=%s; group=%s; tenant=%s",
+                           data_id, group, tenant)
+            return None
+        return text
+
+    async def config(self, data_id, group="DEFAULT_GROUP", tenant="",
+                     callback: t.Callable = None) -> t.Optional[str]:
+        """
+        获取配置并加入监听，所有订阅共用一个长轮询任务
+
+        Args:
+          callback: 配置变更回调，参数为(data_id, group, tenant, 新内容)，可以是协程函数
+
+        Returns:
+          当前配置内容
+        """
+        content = await self.get_config(data_id, group, tenant)
+        sub = ConfigSubscription(data_id, group, tenant, md5=content_md5(content or ""),
+                                 content=content)
+        self._subscriptions[sub.key] = sub
+        if callback is not None:
+            self._config_callbacks.setdefault(sub.key, []).append(callback)
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = self._spawn(self._listen_loop())
+        return content
+
+    async def _listen_loop(self):
+        batch_size = DEFAULTS["PULLING_CONFIG_SIZE"]
+        pulling_timeout = DEFAULTS["PULLING_TIMEOUT"]
+        header = {"Long-Pulling-Timeout": str(pulling_timeout * 1000)}
+        while True:
+            subs = list(self._subscriptions.values())
+            batches = [subs[i:i + batch_size] for i in range(0, len(subs), batch_size)]
+            try:
+                results = await asyncio.gather(*[
+                    self._request("POST", "/cs/configs/listener", headers=header,
+                                  data={"Listening-Configs": "".join(
+                                      s.listening_line() for s in batch)},
+                                  timeout=pulling_timeout + 20, record_latency=False)
+                    for batch in batches])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("[Nacos] 配置监听请求失败", exc_info=True)
+                await asyncio.sleep(TIME_OUT)
+                continue
+            changed = []
+            for status, text in results:
+                if status == 200:
+                    changed.extend(parse_changed_keys(text))
+                else:
+                    logger.warning("[Nacos] 监听配置失败,status_code-%s, message-%s",
+                                   status, text)
+            await asyncio.gather(*[self._refresh_config(key) for key in changed])
+            if any(status != 200 for status, _ in results):
+                await asyncio.sleep(TIME_OUT)
+
+    async def _refresh_config(self, key):
+        data_id, group, tenant = key
+        sub = self._subscriptions.get(key) or self._subscriptions.get(
+            (data_id, group, "public"))
+        if sub is None:
+            return
+        try:
+            status, content = await self._request("GET", "/cs/configs", params=sub.query_params())
+            if status == 404:
+                # 配置被删除
+                content = ""
+            elif status != 200:
+                logger.warning("[Nacos] 配置拉取失败：dataId=%s; group=%s; tenant=%s; status_code=%s",
+                               sub.data_id, sub.group, sub.tenant, status)
+                return
+            sub.md5 = content_md5(content)
+            sub.content = content
+            logger.info("[Nacos] 配置信息更新成功: dataId=%s; group=%s; tenant=%s",
+                        sub.data_id, sub.group, sub.tenant)
+            for callback in self._config_callbacks.get(sub.key, []):
+                ret = callback(sub.data_id, sub.group, sub.tenant, content)
+                if asyncio.iscoroutine(ret):
+                    await ret
+        except Exception:
+            logger.exception("[Nacos] 配置信息更新失败：dataId=%s; group=%s; tenant=%s",
+                             sub.data_id, sub.group, sub.tenant, exc_info=True)
+
+    async def _load_instances(self, key) -> t.List[dict]:
+        """
+        获取服务的全部实例，按INSTANCE_CACHE_TTL缓存，查询失败时返回旧数据
+        """
+        service_name, group_name, cluster_name = key
+        expire, hosts = self._instance_dict.get(key, (0, None))
+        if hosts is not None and time.time() <= expire:
+            return hosts
+        params = {
+            "serviceName": service_name,
+            "groupName": group_name,
+            "clusters": cluster_name,
+            "healthyOnly": "false"
+        }
+        try:
+            status, text = await self._request("GET", "/ns/instance/list", params=params)
+            if status == 200:
+                hosts = json.loads(text).get("hosts") or []
+                self._instance_dict[key] = (
+                    time.time() + DEFAULTS["INSTANCE_CACHE_TTL"], hosts)
+            else:
+                logger.warning("[Nacos] 获取服务实例失败：%s, status_code=%s", key, status)
+        except Exception as e:
+            logger.warning("[Nacos] 获取服务实例失败, 使用缓存数据: %s, %s", key, str(e))
+        return hosts or []
+
+    async def get_server_instances(self, service_name, cluster_name='DEFAULT',
+                                   group_name='DEFAULT_GROUP', healthy_only=True) -> t.List[dict]:
+        """
+        获取服务实例列表
+
+        Args:
+          healthy_only: 是否只返回健康且启用的实例
+        """
+        hosts = await self._load_instances((service_name, group_name, cluster_name))
+        return balancer.available_hosts(hosts) if healthy_only else hosts
+
+    async def get_server_instance(self, service_name, cluster_name='DEFAULT',
+                                  group_name='DEFAULT_GROUP',
+                                  strategy=balancer.WEIGHTED_RANDOM, key=None):
+        """
+        按负载均衡策略获取一个健康实例地址
+
+        Returns:
+          形如 http://ip:port 的地址，没有健康实例时返回None
+        """
+        hosts = await self._load_instances((service_name, group_name, cluster_name))
+        selector_key = (service_name, group_name, cluster_name, strategy)
+        entry = self._selector_dict.get(selector_key)
+        if entry is None:
+            entry = [hosts, balancer.create_selector(strategy, hosts)]
+            self._selector_dict[selector_key] = entry
+        elif entry[0] is not hosts:
+            # 实例列表重新拉取后重建选择器
+            entry[1].update(hosts)
+            entry[0] = hosts
+        host = entry[1].pick(key)
+        if host is None:
+            return None
+        return "http://" + str(host['ip']) + ":" + str(host['port'])
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.append(task)
+        return task
+
+    async def close(self):
+        """
+        取消所有后台任务并关闭连接
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._session is not None:
+            await self._session.close()
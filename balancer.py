@@ -0,0 +1,201 @@
+"""
+服务实例负载均衡，基于实例列表选择一个健康实例.
+"""
+import bisect
+import hashlib
+import heapq
+import random
+import threading
+import typing as t
+from contextlib import contextmanager
+
+WEIGHTED_RANDOM = "weighted_random"
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+CONSISTENT_HASH = "consistent_hash"
+
+
+def instance_id(host: dict) -> str:
+    return "{}:{}".format(host.get("ip"), host.get("port"))
+
+
+def available_hosts(hosts: t.List[dict]) -> t.List[dict]:
+    """
+    过滤掉不健康、未启用以及权重为0的实例
+    """
+    return [h for h in hosts
+            if h.get("healthy", True) and h.get("enabled", True)
+            and float(h.get("weight", 1) or 0) > 0]
+
+
+class Selector:
+    """
+    实例选择器基类，子类实现_rebuild和pick
+    """
+
+    def __init__(self, hosts: t.List[dict] = None):
+        self._lock = threading.Lock()
+        self.hosts: t.List[dict] = []
+        self.update(hosts or [])
+
+    def update(self, hosts: t.List[dict]):
+        """
+        实例列表变化后重建选择器
+        """
+        hosts = available_hosts(hosts)
+        with self._lock:
+            self.hosts = hosts
+            self._rebuild()
+
+    def _rebuild(self):
+        pass
+
+    def pick(self, key=None) -> t.Optional[dict]:
+        raise NotImplementedError
+
+
+class WeightedRandomSelector(Selector):
+    """
+    按注册权重随机，累计权重二分查找，O(log n)
+    """
+
+    def _rebuild(self):
+        cum_weights = []
+        total = 0.0
+        for h in self.hosts:
+            total += float(h.get("weight", 1))
+            cum_weights.append(total)
+        # 整体替换，pick无需加锁
+        self._table = (self.hosts, cum_weights, total)
+
+    def pick(self, key=None) -> t.Optional[dict]:
+        hosts, cum_weights, total = self._table
+        if not hosts:
+            return None
+        i = bisect.bisect_right(cum_weights, random.random() * total)
+        return hosts[min(i, len(hosts) - 1)]
+
+
+class SmoothWeightedRoundRobinSelector(Selector):
+    """
+    平滑加权轮询，使用最早截止时间优先(EDF)实现：
+    每个实例的下次截止时间为 当前截止时间 + 1/weight，每次取截止时间最小的实例，O(log n)
+    """
+
+    def _rebuild(self):
+        self._heap = []
+        for i, h in enumerate(self.hosts):
+            step = 1.0 / float(h.get("weight", 1))
+            # 初始截止时间错开，避免权重相同的实例按列表顺序成批返回
+            self._heap.append((step * random.random(), i, step))
+        heapq.heapify(self._heap)
+
+    def pick(self, key=None) -> t.Optional[dict]:
+        with self._lock:
+            if not self._heap:
+                return None
+            deadline, i, step = self._heap[0]
+            heapq.heapreplace(self._heap, (deadline + step, i, step))
+            return self.hosts[i]
+
+
+class LeastOutstandingSelector(Selector):
+    """
+    最少未完成请求，随机取两个实例比较 未完成数/权重，O(1)
+
+    调用方需要通过track或acquire/release记录请求的开始和结束
+    """
+
+    def __init__(self, hosts: t.List[dict] = None):
+        self._outstanding: t.Dict[str, int] = {}
+        super().__init__(hosts)
+
+    def _rebuild(self):
+        ids = {instance_id(h) for h in self.hosts}
+        self._outstanding = {k: self._outstanding.get(k, 0) for k in ids}
+
+    def _load(self, host):
+        return self._outstanding.get(instance_id(host), 0) / float(host.get("weight", 1))
+
+    def pick(self, key=None) -> t.Optional[dict]:
+        hosts = self.hosts
+        if not hosts:
+            return None
+        if len(hosts) == 1:
+            return hosts[0]
+        a, b = random.sample(hosts, 2)
+        return a if self._load(a) <= self._load(b) else b
+
+    def acquire(self, host: dict):
+        with self._lock:
+            k = instance_id(host)
+            self._outstanding[k] = self._outstanding.get(k, 0) + 1
+
+    def release(self, host: dict):
+        with self._lock:
+            k = instance_id(host)
+            if self._outstanding.get(k, 0) > 0:
+                self._outstanding[k] -= 1
+
+    @contextmanager
+    def track(self, key=None):
+        """
+        选择实例并在with块内记录未完成请求
+
+        Examples:
+          with selector.track() as host:
+              requests.get("http://%s:%s/xx" % (host["ip"], host["port"]))
+        """
+        host = self.pick(key)
+        if host is None:
+            yield None
+            return
+        self.acquire(host)
+        try:
+            yield host
+        finally:
+            self.release(host)
+
+
+class ConsistentHashSelector(Selector):
+    """
+    一致性哈希，按key选择实例，虚拟节点数与权重成正比，O(log n)
+    """
+    replicas = 100
+
+    def _rebuild(self):
+        ring = []
+        for h in self.hosts:
+            vnodes = max(1, int(self.replicas * float(h.get("weight", 1))))
+            node = instance_id(h)
+            for i in range(vnodes):
+                ring.append((self._hash("{}#{}".format(node, i)), h))
+        ring.sort(key=lambda x: x[0])
+        self._ring = ([x[0] for x in ring], [x[1] for x in ring])
+
+    @staticmethod
+    def _hash(value) -> int:
+        return int(hashlib.md5(str(value).encode("UTF-8")).hexdigest()[:16], 16)
+
+    def pick(self, key=None) -> t.Optional[dict]:
+        ring_keys, ring_hosts = self._ring
+        if not ring_keys:
+            return None
+        if key is None:
+            return random.choice(ring_hosts)
+        i = bisect.bisect(ring_keys, self._hash(key)) % len(ring_keys)
+        return ring_hosts[i]
+
+
+STRATEGIES = {
+    WEIGHTED_RANDOM: WeightedRandomSelector,
+    ROUND_ROBIN: SmoothWeightedRoundRobinSelector,
+    LEAST_OUTSTANDING: LeastOutstandingSelector,
+    CONSISTENT_HASH: ConsistentHashSelector,
+}
+
+
+def create_selector(strategy: str, hosts: t.List[dict] = None) -> Selector:
+    if strategy not in STRATEGIES:
+        raise ValueError("不支持的负载均衡策略：%s" % strategy)
+    return STRATEGIES[strategy](hosts)
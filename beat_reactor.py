@@ -0,0 +1,173 @@
+"""
+心跳调度模块，一个线程驱动时间轮，到期的心跳由小线程池并发发送.
+"""
+import itertools
+import math
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import BEAT_TIME
+from util import logger
+
+# 心跳返回码：成功、实例不存在需要重新注册
+CODE_OK = 10200
+CODE_RESOURCE_NOT_FOUND = 20404
+
+
+def instance_key(namespace_id, group_name, service_name, ip, port) -> tuple:
+    return namespace_id, group_name, service_name, ip, int(port)
+
+
+class BeatInfo:
+    """
+    一个注册实例的心跳信息
+    """
+
+    def __init__(self, key, register_params: dict, beat_params: dict, interval=BEAT_TIME):
+        self.key = key
+        # 注册参数，实例丢失时用于重新注册
+        self.register_params = register_params
+        # 心跳参数
+        self.beat_params = beat_params
+        # 心跳间隔，单位秒，会按服务端返回的clientBeatInterval调整
+        self.interval = interval
+        # 最近一次心跳成功的时间
+        self.last_beat = int(time.time())
+        # 每次加入时重新分配，用于丢弃时间轮中过期的任务
+        self.generation = 0
+
+
+class BeatReactor:
+    """
+    心跳调度器
+
+    时间轮每tick秒前进一格，到期的实例交给线程池发送心跳，完成后按最新间隔重新放入时间轮；
+    实例数量再多也只占用一个调度线程和max_workers个发送线程，单个host卡住不会推迟其他实例的心跳
+    """
+
+    def __init__(self, beat_fn, register_fn, tick=0.5, wheel_size=128, max_workers=4):
+        """
+        Args:
+          beat_fn: 发送心跳的方法，参数为BeatInfo，返回心跳结果字典，失败时返回None
+          register_fn: 重新注册的方法，参数为BeatInfo，返回是否成功
+          tick: 时间轮每格的时长，单位秒
+          wheel_size: 时间轮格数
+          max_workers: 并发发送心跳的线程数
+        """
+        self._beat_fn = beat_fn
+        self._register_fn = register_fn
+        self.tick = tick
+        self.max_workers = max_workers
+        self._executor: t.Optional[ThreadPoolExecutor] = None
+        self._wheel: t.List[t.List[list]] = [[] for _ in range(wheel_size)]
+        self._cursor = 0
+        self._entries: t.Dict[tuple, BeatInfo] = {}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        # 最近一次时间轮前进的时间，用于健康检查
+        self.healthy = int(time.time())
+
+    def add(self, info: BeatInfo):
+        """
+        添加或替换一个实例的心跳，第一次心跳在interval秒后发送
+        """
+        with self._lock:
+            info.generation = next(self._generations)
+            self._entries[info.key] = info
+            self._schedule(info, info.interval)
+        self.start()
+
+    def remove(self, key) -> t.Optional[BeatInfo]:
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def get(self, key) -> t.Optional[BeatInfo]:
+        return self._entries.get(key)
+
+    def entries(self) -> t.List[BeatInfo]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def _schedule(self, info: BeatInfo, delay):
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        size = len(self._wheel)
+        slot = (self._cursor + ticks) % size
+        rounds = (ticks - 1) // size
+        self._wheel[slot].append([rounds, info.key, info.generation])
+
+    def start(self):
+        if self._running and self.is_alive():
+            return
+        self._running = True
+        self.healthy = int(time.time())
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="nacos-beat")
+        self._thread = threading.Thread(target=self._run, name="nacos-beat-reactor",
+                                        daemon=True)
+        self._thread.start()
+        logger.info("[Nacos] 心跳调度线程已启动")
+
+    def stop(self):
+        self._running = False
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self._running:
+            next_tick += self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.healthy = int(time.time())
+            for info in self._advance():
+                # 发送中的实例不在时间轮里，完成后才重新放入，不会重复提交
+                self._executor.submit(self._beat, info)
+
+    def _advance(self) -> t.List[BeatInfo]:
+        """
+        时间轮前进一格，返回到期的实例
+        """
+        due = []
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            slot = self._wheel[self._cursor]
+            remain = []
+            for item in slot:
+                rounds, key, generation = item
+                info = self._entries.get(key)
+                if info is None or info.generation != generation:
+                    continue
+                if rounds > 0:
+                    item[0] = rounds - 1
+                    remain.append(item)
+                else:
+                    due.append(info)
+            self._wheel[self._cursor] = remain
+        return due
+
+    def _beat(self, info: BeatInfo):
+        generation = info.generation
+        try:
+            result = self._beat_fn(info)
+            if result is not None:
+                if result.get("code") == CODE_RESOURCE_NOT_FOUND:
+                    logger.warning("[Nacos] 实例不存在，重新注册: %s", info.key)
+                    self._register_fn(info)
+                else:
+                    info.last_beat = int(time.time())
+                interval = result.get("clientBeatInterval")
+                if interval:
+                    info.interval = interval / 1000.0
+        except Exception:
+            logger.exception("[Nacos] 服务心跳维持失败！%s", info.key, exc_info=True)
+        finally:
+            with self._lock:
+                if self._entries.get(info.key) is info and info.generation == generation:
+                    self._schedule(info, info.interval)
@@ -0,0 +1,400 @@
+"""
+性能基准测试，客户端连接进程内的FakeNacosServer，预测数据为合成的小区流量CSV，结果保存为JSON用于回归对比.
+
+测试项:
+  nacos: 心跳吞吐(beats/sec)、服务实例查询吞吐、配置变更从发布到回调的延迟
+  train: /train 提交到训练任务结束的耗时
+  predict: /predict 多步预测和 /predict/rows 的吞吐与延迟
+
+所有文件(模型、结果、日志、配置快照)写在工作目录中，默认是临时目录，不影响仓库内的文件.
+
+Examples:
+  python benchmark.py --rows 20000 --output baseline.json
+  python benchmark.py --rows 20000 --output current.json --baseline baseline.json
+  python benchmark.py --only nacos --requests 5000 --threads 8
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SECTIONS = ("nacos", "train", "predict")
+SERVICE_NAME = "naas-ai-benchmark"
+GATEWAY_SERVICE_NAME = "dipper-gateway"
+
+
+def make_traffic_csv(path, rows, months=8, seed=0) -> str:
+    """
+    生成合成的小区月流量数据，第一列为cgi，之后每列为一个月的流量
+
+    流量为对数正态的基数乘以各小区不同的增长趋势、年周期和噪声，最后一列可作为训练标签
+
+    Args:
+      path: 文件路径
+      rows: 小区数
+      months: 月数
+      seed: 随机数种子，相同参数生成的文件相同
+
+    Returns:
+      文件路径
+    """
+    rng = np.random.default_rng(seed)
+    month = np.arange(months)
+    base = rng.lognormal(mean=8, sigma=1, size=(rows, 1))
+    trend = 1 + rng.normal(0.02, 0.01, size=(rows, 1)) * month
+    phase = rng.uniform(0, 12, size=(rows, 1))
+    season = 1 + 0.1 * np.sin(2 * np.pi * (month + phase) / 12)
+    noise = rng.normal(1, 0.05, size=(rows, months))
+    traffic = (base * trend * season * noise).round(2)
+    columns = [str(p) for p in pd.period_range("2023-01", periods=months, freq="M")]
+    data = pd.DataFrame(traffic, columns=columns)
+    data.insert(0, "cgi", ["460-00-%d-%d" % (10000 + i // 3, i % 3 + 1) for i in range(rows)])
+    data.to_csv(path, index=False, encoding="utf-8")
+    return path
+
+
+def summarize(latencies: t.Sequence[float], seconds: float, **extra) -> dict:
+    """
+    汇总一组请求耗时
+
+    Args:
+      latencies: 每个请求的耗时，单位秒
+      seconds: 总耗时，单位秒
+      extra: 其他需要记录的信息
+
+    Returns:
+      统计结果字典，耗时单位为毫秒
+    """
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    result = {
+        "count": len(ms),
+        "seconds": round(seconds, 4),
+        "perSecond": round(len(ms) / seconds, 2) if seconds > 0 else None,
+        "meanMs": round(float(ms.mean()), 3) if len(ms) else None,
+        "p50Ms": round(float(np.percentile(ms, 50)), 3) if len(ms) else None,
+        "p95Ms": round(float(np.percentile(ms, 95)), 3) if len(ms) else None,
+        "p99Ms": round(float(np.percentile(ms, 99)), 3) if len(ms) else None,
+        "maxMs": round(float(ms.max()), 3) if len(ms) else None,
+    }
+    result.update(extra)
+    return result
+
+
+def run_timed(fn, count, threads=1, **extra) -> dict:
+    """
+    调用fn count次并统计耗时，threads大于1时并发调用
+    """
+    latencies = [0.0] * count
+
+    def call(i):
+        start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(call, range(count)))
+    else:
+        for i in range(count):
+            call(i)
+    return summarize(latencies, time.perf_counter() - start, threads=threads, **extra)
+
+
+def bench_beats(client, count, threads) -> dict:
+    """
+    心跳吞吐，直接调用心跳接口，不经过心跳调度器的时间轮
+    """
+    client.register_service("127.0.0.1", SERVICE_NAME, 8080)
+    info = [i for i in client.beat_reactor.entries() if SERVICE_NAME in i.key][0]
+
+    def beat():
+        resp = client.host_pool.borrow().beat(access_token=client.access_token,
+                                              params=info.beat_params)
+        if resp is None or resp.status_code != 200:
+            raise RuntimeError("心跳失败: %s" % (resp.text if resp is not None else None))
+
+    return run_timed(beat, count, threads)
+
+
+def bench_instance_lookups(client, fake, count, threads, instances=10) -> dict:
+    """
+    服务实例查询吞吐，第一次查询后走本地缓存和负载均衡
+    """
+    fake.set_instances(GATEWAY_SERVICE_NAME, [{"ip": "10.0.0.%d" % (i + 1), "port": 80}
+                                              for i in range(instances)])
+    if client.get_server_instance(GATEWAY_SERVICE_NAME) is None:
+        raise RuntimeError("服务实例查询失败")
+
+    def lookup():
+        client.get_server_instance(GATEWAY_SERVICE_NAME)
+
+    return run_timed(lookup, count, threads, instances=instances)
+
+
+def bench_config_changes(client, fake, count, timeout=10) -> dict:
+    """
+    配置变更延迟，从服务端发布配置到客户端回调执行完成
+    """
+    data_id = SERVICE_NAME + ".yaml"
+    fake.publish_config(data_id, "version: 0\n", tenant="dipper")
+    app_config = {}
+    client.config(app_config, file_type="yaml")
+    if app_config.get("version") != 0:
+        raise RuntimeError("配置获取失败: %s" % app_config)
+    changed = threading.Event()
+    on_change = client.config_listener.on_change
+
+    def notify(sub, content):
+        on_change(sub, content)
+        changed.set()
+
+    client.config_listener.on_change = notify
+    # 等待长轮询挂起后再发布
+    time.sleep(0.2)
+    latencies = []
+    start = time.perf_counter()
+    try:
+        for i in range(1, count + 1):
+            changed.clear()
+            published = time.perf_counter()
+            fake.publish_config(data_id, "version: %d\n" % i, tenant="dipper")
+            if not changed.wait(timeout):
+                raise RuntimeError("%s 秒内未收到配置变更" % timeout)
+            latencies.append(time.perf_counter() - published)
+            if app_config.get("version") != i:
+                raise RuntimeError("配置未更新: %s" % app_config)
+    finally:
+        client.config_listener.on_change = on_change
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_training(app, csv_path, data_index, model_name, timeout=3600) -> t.Tuple[dict, str]:
+    """
+    训练耗时，/train 提交后轮询任务状态直到结束
+
+    Returns:
+      (统计结果, 模型文件名)
+    """
+    client = app.test_client()
+    start = time.perf_counter()
+    with open(csv_path, "rb") as f:
+        resp = client.post("/train", data={"dataIndex": str(data_index), "modelName": model_name,
+                                           "projectId": "benchmark", "file": (f, os.path.basename(csv_path))})
+    data = resp.get_json()
+    if data.get("code") != 200:
+        raise RuntimeError("训练提交失败: %s" % data)
+    job_id = data["jobId"]
+    while True:
+        job = client.get("/jobs/" + job_id).get_json()["data"]
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            break
+        if time.perf_counter() - start > timeout:
+            client.delete("/jobs/" + job_id)
+            raise RuntimeError("训练超时: %s" % job)
+        time.sleep(0.2)
+    seconds = time.perf_counter() - start
+    if job["status"] != "succeeded":
+        raise RuntimeError("训练失败: %s" % job)
+    rows = len(pd.read_csv(csv_path, usecols=[0]))
+    result = {"seconds": round(seconds, 3), "rows": rows, "rowsPerSecond": round(rows / seconds, 2),
+              "model": os.path.basename(job["result"])}
+    return result, os.path.basename(job["result"])
+
+
+def bench_predict(app, csv_path, data_index, model_path, num_future_points, count,
+                  output_format="csv") -> dict:
+    """
+    /predict 上传CSV进行多步预测，读取完整的流式响应
+    """
+    client = app.test_client()
+    with open(csv_path, "rb") as f:
+        body = f.read()
+    rows = body.count(b"\n") - 1
+
+    def predict():
+        resp = client.post("/predict", data={
+            "dataIndex": str(data_index), "modelPath": model_path,
+            "numFuturePoints": str(num_future_points), "outputFormat": output_format,
+            "file": (io.BytesIO(body), os.path.basename(csv_path))})
+        if resp.status_code != 200 or not resp.data:
+            raise RuntimeError("预测失败: %s" % resp.data[:200])
+
+    result = run_timed(predict, count, rows=rows, numFuturePoints=num_future_points,
+                       outputFormat=output_format)
+    result["rowsPerSecond"] = round(rows * count / result["seconds"], 2)
+    return result
+
+
+def bench_predict_rows(app, csv_path, data_index, model_path, num_future_points, count,
+                       batch_rows=64, threads=1) -> dict:
+    """
+    /predict/rows 以JSON提交少量特征行的在线预测
+    """
+    client = app.test_client()
+    feature = pd.read_csv(csv_path, nrows=batch_rows).iloc[:, 1:data_index].to_numpy().tolist()
+    payload = {"modelPath": model_path, "numFuturePoints": num_future_points, "rows": feature}
+
+    def predict():
+        resp = client.post("/predict/rows", json=payload)
+        if resp.status_code != 200:
+            raise RuntimeError("预测失败: %s" % resp.data[:200])
+
+    result = run_timed(predict, count, threads, rows=len(feature), numFuturePoints=num_future_points)
+    result["rowsPerSecond"] = round(len(feature) * count / result["seconds"], 2)
+    return result
+
+
+def compare(current: dict, baseline: dict, threshold=0.1) -> t.List[str]:
+    """
+    对比两次结果，吞吐下降或延迟上升超过threshold时标记为回退
+
+    Returns:
+      对比结果的文本行
+    """
+    # 指标名 -> 是否越大越好
+    keys = {"perSecond": True, "rowsPerSecond": True, "p50Ms": False, "p95Ms": False,
+            "p99Ms": False, "seconds": False}
+    lines = []
+    for name, result in current.get("results", {}).items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for key, higher_better in keys.items():
+            new, old = result.get(key), base.get(key)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            regressed = change < -threshold if higher_better else change > threshold
+            lines.append("%-18s %-14s %12s -> %12s %+7.1f%%%s" % (
+                name, key, old, new, change * 100, "  回退" if regressed else ""))
+    return lines
+
+
+def run(args) -> dict:
+    """
+    在工作目录中执行选中的测试项
+
+    Returns:
+      {"meta": 运行环境和参数, "results": 测试项 -> 统计结果}
+    """
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    for d in ("dic/data", "dic/models", "dic/results"):
+        os.makedirs(d, exist_ok=True)
+    # 上次运行留下的实例和配置快照会在客户端启动时加载，使结果依赖于之前的运行
+    shutil.rmtree("nacos-data", ignore_errors=True)
+    # 以下模块导入时会在当前目录创建日志文件，因此在切换到工作目录后导入
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import fake_nacos
+    import nacos
+    import nacos_config
+    import prediction_code
+    import server
+    logging.getLogger("server.log").setLevel(logging.WARNING)
+
+    sections = args.only or SECTIONS
+    results = {}
+    fake = fake_nacos.FakeNacosServer().start()
+    try:
+        if "nacos" in sections:
+            client = nacos.Nacos(host=fake.address, username="nacos", password="nacos")
+            results["beat"] = bench_beats(client, args.requests, args.threads)
+            results["instanceLookup"] = bench_instance_lookups(client, fake, args.requests, args.threads)
+            results["configChange"] = bench_config_changes(client, fake, args.config_changes)
+            client.config_listener.stop()
+            client.beat_reactor.stop()
+            client.service_cache.stop()
+
+        if "train" in sections or "predict" in sections:
+            nacos_config.train_candidates = args.candidates
+            server.nass_ai_server = "http://" + fake.address
+            # 特征为第1列到第months列，训练数据的第months+1列为标签
+            data_index = args.months + 1
+            train_csv = make_traffic_csv("dic/data/train.csv", args.rows, args.months + 1, args.seed)
+            predict_csv = make_traffic_csv("dic/data/predict.csv", args.rows, args.months, args.seed + 1)
+            model_path = None
+            if "train" in sections:
+                results["train"], model_path = bench_training(server.app, train_csv, data_index, "benchmark")
+            if "predict" in sections:
+                if model_path is None:
+                    data = pd.read_csv(train_csv)
+                    model_path = os.path.basename(prediction_code.model_training(
+                        data.iloc[:, 1:data_index].to_numpy(np.float32),
+                        data.iloc[:, [data_index]].to_numpy(np.float32),
+                        prediction_code.model_dir + "benchmark", server.nass_ai_server, "benchmark",
+                        n_jobs=os.cpu_count() or 1, candidates=args.candidates))
+                for fmt in args.formats:
+                    results["predict_" + fmt] = bench_predict(
+                        server.app, predict_csv, data_index, model_path, args.future_points,
+                        args.predict_requests, fmt)
+                results["predictRows"] = bench_predict_rows(
+                    server.app, predict_csv, data_index, model_path, args.future_points,
+                    args.requests, threads=args.threads)
+            server.train_queue.shutdown()
+    finally:
+        fake.stop()
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "workdir")},
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="nacos客户端和预测服务的性能基准测试")
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, help="只执行指定的测试项")
+    parser.add_argument("--rows", type=int, default=20000, help="合成数据的小区数")
+    parser.add_argument("--months", type=int, default=7, help="特征月数，训练数据多一个月作为标签")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--requests", type=int, default=1000, help="心跳、实例查询和/predict/rows的请求数")
+    parser.add_argument("--config-changes", type=int, default=20, help="配置变更次数")
+    parser.add_argument("--predict-requests", type=int, default=5, help="/predict的请求数")
+    parser.add_argument("--future-points", type=int, default=3, help="多步预测的时间点数")
+    parser.add_argument("--formats", nargs="+", default=["csv"], help="/predict的输出格式")
+    parser.add_argument("--candidates", type=int, default=3, help="训练时的候选模型数")
+    parser.add_argument("--threads", type=int, default=1, help="心跳、实例查询和/predict/rows的并发数")
+    parser.add_argument("--workdir", default=None, help="工作目录，默认为临时目录")
+    parser.add_argument("--output", default=None, help="结果JSON文件，默认为 benchmark-时间.json")
+    parser.add_argument("--baseline", default=None, help="对比的基准结果JSON文件")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output or time.strftime("benchmark-%Y%m%d-%H%M%S.json"))
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="naas-benchmark-"))
+    report = run(args)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, result in report["results"].items():
+        print(name, json.dumps(result, ensure_ascii=False))
+    print("结果已保存:", output)
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            lines = compare(report, json.load(f))
+        print("\n".join(lines))
+        if any(line.endswith("回退") for line in lines):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,10 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import threading
+import time
 from logging import handlers
 
 """
@@ -14,6 +20,9 @@ from logging import handlers
           - midnight 每天凌晨<br>
     :param backupCount: 备份文件的个数，如果超过这个数量，就会自动删除
     :param fmt: 日志信息格式
+
+    同一个filename只会添加一次输出，重复调用直接返回已有的logger；
+    默认为队列模式，调用线程只把日志放入队列，由后台线程写控制台和文件
 """
 
 
@@ -28,16 +37,184 @@ __level_dict = {
     'debug': logging.DEBUG
 }
 
+# 日志输出设置，通过configure修改
+settings = {
+    # 队列模式，由后台线程写日志
+    'queue': True,
+    # 输出JSON格式
+    'json_format': False,
+    # 单条日志的最大字符数，超过时截断，0表示不限制
+    'max_length': 4096,
+    # 每秒最多输出的WARNING以下的超长日志条数，超过的丢弃，0表示不限制
+    'large_per_second': 5,
+}
+
+# filename -> get_log的输出参数
+__log_params = {}
+# filename -> 已添加到logger上的handler和filter
+__installed = {}
+# filename -> 后台写日志的QueueListener
+__listeners = {}
+__lock = threading.RLock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    JSON格式日志，每行一个对象
+    """
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.pathname,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class PayloadLimitFilter(logging.Filter):
+    """
+    超长日志截断为max_length个字符；WARNING以下的超长日志每秒最多输出large_per_second条，
+    超出的丢弃并在下一条中注明，WARNING及以上的日志截断后总是输出
+    """
+
+    def __init__(self, max_length=4096, large_per_second=5):
+        super().__init__()
+        self.max_length = max_length
+        self.large_per_second = large_per_second
+        self.dropped = 0
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.max_length:
+            return True
+        message = record.getMessage()
+        if len(message) <= self.max_length:
+            return True
+        with self._lock:
+            # WARNING及以上不限流，也不占用限流名额
+            if record.levelno < logging.WARNING and self.large_per_second:
+                now = int(time.monotonic())
+                if now != self._window:
+                    self._window, self._count = now, 0
+                self._count += 1
+                if self._count > self.large_per_second:
+                    self.dropped += 1
+                    return False
+            dropped, self.dropped = self.dropped, 0
+        record.msg = '%s...(共%s字符，已截断)' % (message[:self.max_length], len(message))
+        if dropped:
+            record.msg += '(此前丢弃%s条超长日志)' % dropped
+        record.args = None
+        return True
+
+
+class _QueueHandler(handlers.QueueHandler):
+    """
+    入队前合并日志参数，异常栈放在exc_text中，便于JSON输出
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _install(filename, logger, maxBytes, backupCount, fmt):
+    with __lock:
+        _uninstall(filename, logger)
+        format_str = JsonFormatter() if settings['json_format'] else logging.Formatter(fmt)  # 设置日志格式
+        console_handler = logging.StreamHandler()  # 控制台输出
+        console_handler.setFormatter(format_str)  # 控制台输出的格式
+        file_handler = handlers.RotatingFileHandler(filename=filename, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8')  # 文件输出
+        file_handler.setFormatter(format_str)  # 文件输出格式
+        payload_filter = PayloadLimitFilter(settings['max_length'], settings['large_per_second'])
+        logger.addFilter(payload_filter)
+        if settings['queue']:
+            log_queue = queue.SimpleQueue()
+            queue_handler = _QueueHandler(log_queue)
+            listener = handlers.QueueListener(log_queue, console_handler, file_handler)
+            listener.start()
+            __listeners[filename] = listener
+            added = [queue_handler]
+        else:
+            added = [console_handler, file_handler]
+        for handler in added:
+            logger.addHandler(handler)  # 日志输出
+        __installed[filename] = (added, [console_handler, file_handler], payload_filter)
+
+
+def _uninstall(filename, logger):
+    listener = __listeners.pop(filename, None)
+    if listener is not None:
+        listener.stop()
+    installed = __installed.pop(filename, None)
+    if installed is None:
+        return
+    added, outputs, payload_filter = installed
+    for handler in added:
+        logger.removeHandler(handler)
+    for handler in outputs:
+        handler.close()
+    logger.removeFilter(payload_filter)
+
+
 # 封装日志方法
 def get_log(filename, level, when='MIDNIGHT', backupCount=3, maxBytes=10000000, fmt='%(asctime)s - %(pathname)s[line:%(lineno)d] - %(levelname)s: %(message)s'):
     level = __level_dict.get(level.lower(), None)
     logger = logging.getLogger(filename)  # 设置日志名称
-    format_str = logging.Formatter(fmt)  # 设置日志格式
     logger.setLevel(level)  # 设置日志级别
-    console_handler = logging.StreamHandler()  # 控制台输出
-    console_handler.setFormatter(format_str)  # 控制台输出的格式
-    logger.addHandler(console_handler)  # 控制台输出
-    file_handler = handlers.RotatingFileHandler(filename=filename, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8')  # 文件输出
-    file_handler.setFormatter(format_str) # 文件输出格式
-    logger.addHandler(file_handler) # 日志输出
+    with __lock:
+        if filename not in __log_params:
+            __log_params[filename] = dict(maxBytes=maxBytes, backupCount=backupCount, fmt=fmt)
+            _install(filename, logger, **__log_params[filename])
     return logger
+
+
+def configure(**kwargs):
+    """
+    修改日志输出设置，已创建的logger立即生效
+
+    Args:
+      queue: 是否使用队列模式
+      json_format: 是否输出JSON格式
+      max_length: 单条日志的最大字符数
+      large_per_second: 每秒最多输出的WARNING以下的超长日志条数
+    """
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise ValueError('未知的日志设置: %s' % ', '.join(sorted(unknown)))
+    with __lock:
+        if all(settings[k] == v for k, v in kwargs.items()):
+            return
+        settings.update(kwargs)
+        for filename, params in __log_params.items():
+            _install(filename, logging.getLogger(filename), **params)
+
+
+def shutdown():
+    """
+    停止后台写日志线程，队列中剩余的日志写完后返回
+    """
+    with __lock:
+        for listener in list(__listeners.values()):
+            listener.stop()
+        __listeners.clear()
+
+
+atexit.register(shutdown)
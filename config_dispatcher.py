@@ -0,0 +1,174 @@
+"""
+配置变更回调分发，回调在有限大小的线程池中执行，慢的回调不会阻塞配置长轮询.
+"""
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from util import logger
+
+# 未设置的待分发配置
+_EMPTY = object()
+
+
+def flatten_config(config, prefix="") -> dict:
+    """
+    把嵌套字典展开为以点分隔的key，非字典的配置整体作为一个值，key为prefix
+    """
+    if not isinstance(config, dict):
+        return {prefix: config} if config is not None else {}
+    items = {}
+    for key, value in config.items():
+        name = "{}.{}".format(prefix, key) if prefix else str(key)
+        if isinstance(value, dict) and value:
+            items.update(flatten_config(value, name))
+        else:
+            items[name] = value
+    return items
+
+
+def diff_config(previous, config) -> t.Tuple[dict, dict, dict]:
+    """
+    比较两份配置
+
+    Returns:
+      (新增的 {key: 值}, 删除的 {key: 原值}, 修改的 {key: (原值, 新值)})，key为展开后的key
+    """
+    old, new = flatten_config(previous), flatten_config(config)
+    added = {k: v for k, v in new.items() if k not in old}
+    removed = {k: v for k, v in old.items() if k not in new}
+    modified = {k: (old[k], v) for k, v in new.items() if k in old and old[k] != v}
+    return added, removed, modified
+
+
+class ConfigChange:
+    """
+    一次配置变更，传给订阅回调
+    """
+
+    def __init__(self, key: tuple, config, previous):
+        self.data_id, self.group, self.tenant = key
+        # 解析后的新配置，配置被删除时为{}
+        self.config = config
+        # 上一次通知给该回调的配置，首次通知时为{}
+        self.previous = previous
+        self.added, self.removed, self.modified = diff_config(previous, config)
+
+    @property
+    def changed_keys(self) -> t.Set[str]:
+        return set(self.added) | set(self.removed) | set(self.modified)
+
+    def __repr__(self):
+        return "ConfigChange(dataId=%s, group=%s, tenant=%s, added=%s, removed=%s, modified=%s)" % (
+            self.data_id, self.group, self.tenant, sorted(self.added), sorted(self.removed),
+            sorted(self.modified))
+
+
+class _Slot:
+    """
+    一个配置的一个回调的分发状态
+    """
+    __slots__ = ("key", "callback", "delivered", "pending", "scheduled")
+
+    def __init__(self, key, callback):
+        self.key = key
+        self.callback = callback
+        # 已通知给回调的配置
+        self.delivered = {}
+        # 等待通知的最新配置
+        self.pending = _EMPTY
+        self.scheduled = False
+
+
+class ConfigDispatcher:
+    """
+    配置变更分发器
+
+    同一配置的同一回调按顺序执行，不会并发；回调还没执行完时又发生的多次变更合并为一次，
+    差异相对于上一次通知的配置计算，因此排队的任务数不超过回调数
+    """
+
+    def __init__(self, max_workers=10):
+        """
+        Args:
+          max_workers: 执行回调的线程数
+        """
+        self.max_workers = max_workers
+        # 配置key -> 回调分发状态列表
+        self._slots: t.Dict[tuple, t.List[_Slot]] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _submit(self, slot: _Slot):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="nacos-config-callback")
+        self._executor.submit(self._drain, slot)
+
+    def add(self, key: tuple, callback, current=_EMPTY):
+        """
+        注册回调，传入current时立即以该配置通知一次
+
+        Args:
+          key: (dataId, group, tenant)
+          callback: 回调方法，参数为ConfigChange
+          current: 当前配置
+        """
+        slot = _Slot(key, callback)
+        with self._lock:
+            self._slots.setdefault(key, []).append(slot)
+            if current is not _EMPTY:
+                slot.pending = current
+                slot.scheduled = True
+                self._submit(slot)
+
+    def remove(self, key: tuple, callback=None) -> int:
+        """
+        注销回调，callback为空时注销该配置的全部回调
+
+        Returns:
+          注销的回调数
+        """
+        with self._lock:
+            slots = self._slots.get(key, [])
+            keep = [s for s in slots if callback is not None and s.callback != callback]
+            if keep:
+                self._slots[key] = keep
+            else:
+                self._slots.pop(key, None)
+            return len(slots) - len(keep)
+
+    def has_callbacks(self, key: tuple) -> bool:
+        return bool(self._slots.get(key))
+
+    def dispatch(self, key: tuple, config):
+        """
+        通知配置变更，只放入线程池，不等待回调执行
+        """
+        with self._lock:
+            for slot in self._slots.get(key, []):
+                slot.pending = config
+                if not slot.scheduled:
+                    slot.scheduled = True
+                    self._submit(slot)
+
+    def _drain(self, slot: _Slot):
+        while True:
+            with self._lock:
+                config, slot.pending = slot.pending, _EMPTY
+                if config is _EMPTY:
+                    slot.scheduled = False
+                    return
+            change = ConfigChange(slot.key, config, slot.delivered)
+            slot.delivered = config
+            if not change.changed_keys:
+                continue
+            try:
+                slot.callback(change)
+            except Exception:
+                logger.exception("[Nacos] 配置变更回调执行失败: %s", change, exc_info=True)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
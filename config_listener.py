@@ -0,0 +1,294 @@
+"""
+配置监听模块，将所有订阅的配置合并到同一个长轮询请求中.
+"""
+import hashlib
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import metrics
+import util
+from constants import TIME_OUT
+from util import logger
+
+# Listening-Configs 字段分隔符
+WORD_SEPARATOR = "\x02"
+LINE_SEPARATOR = "\x01"
+
+# 长轮询最长挂起PULLING_TIMEOUT秒，桶的上限放宽到60秒
+POLL_SECONDS = metrics.histogram(
+    "nacos_config_poll_duration_seconds", "配置长轮询请求耗时",
+    buckets=(0.05, 0.1, 0.5, 1, 5, 10, 20, 30, 45, 60))
+POLL_FAILURES = metrics.counter(
+    "nacos_config_poll_failures_total", "配置长轮询失败次数")
+CONFIG_CHANGES = metrics.counter(
+    "nacos_config_changes_total", "配置变更次数", ["data_id", "group"])
+
+
+def content_md5(content: str) -> str:
+    """
+    计算配置内容的md5，与nacos服务端的计算方式保持一致
+    """
+    if not content:
+        return ""
+    md5 = hashlib.md5()
+    md5.update(content.encode("UTF-8"))
+    return md5.hexdigest()
+
+
+class ConfigSubscription:
+    """
+    单个配置的订阅信息
+    """
+
+    def __init__(self, data_id, group, tenant, md5="", content=None,
+                 file_type="yaml", app_config=None):
+        self.data_id = data_id
+        self.group = group
+        self.tenant = tenant
+        self.md5 = md5
+        self.content = content
+        self.file_type = file_type
+        # 应用配置字典，配置变更后会将新配置写入
+        self.app_config = app_config
+
+    @property
+    def key(self):
+        return self.data_id, self.group, self.tenant
+
+    def has_tenant(self):
+        return bool(self.tenant) and self.tenant != "public"
+
+    def listening_line(self) -> str:
+        """
+        生成Listening-Configs中的一行
+        """
+        words = [self.data_id, self.group, self.md5 or ""]
+        if self.has_tenant():
+            words.append(self.tenant)
+        return WORD_SEPARATOR.join(words) + LINE_SEPARATOR
+
+    def query_params(self) -> dict:
+        params = {"dataId": self.data_id, "group": self.group}
+        if self.has_tenant():
+            params["tenant"] = self.tenant
+        return params
+
+
+def parse_changed_keys(text: str) -> t.List[tuple]:
+    """
+    解析监听接口的返回结果
+
+    Args:
+      text: 接口返回内容，格式为url编码后的 dataId%02group%02tenant%01...
+
+    Returns:
+      变更的(dataId, group, tenant)列表，tenant不存在时为""
+    """
+    keys = []
+    if not text:
+        return keys
+    for line in unquote(text).split(LINE_SEPARATOR):
+        if not line.strip():
+            continue
+        words = line.split(WORD_SEPARATOR)
+        if len(words) < 2:
+            continue
+        keys.append((words[0], words[1], words[2] if len(words) > 2 else ""))
+    return keys
+
+
+class ConfigListener:
+    """
+    配置监听器，一个线程负责所有订阅配置的长轮询
+
+    每次请求最多携带batch_size个配置，超过时按批次并发轮询；
+    服务端返回变更的key后，只拉取有变化的配置
+    """
+
+    def __init__(self, host_getter, url_wrapper, token_refresher, on_change=None,
+                 pulling_timeout=30, batch_size=3000, timeout=3):
+        """
+        Args:
+          host_getter: 获取HostClient的方法
+          url_wrapper: 为url拼接accessToken的方法
+          token_refresher: token失效时调用的刷新方法
+          on_change: 配置变更回调，参数为(ConfigSubscription, 新内容)
+          pulling_timeout: 长轮询挂起时间，单位秒
+          batch_size: 单次监听请求携带的最大配置数
+          timeout: 拉取配置内容的超时时间，单位秒
+        """
+        self._host_getter = host_getter
+        self._url_wrapper = url_wrapper
+        self._token_refresher = token_refresher
+        self.on_change = on_change
+        self.pulling_timeout = pulling_timeout
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._subscriptions: t.Dict[tuple, ConfigSubscription] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+        # 每次启动递增，旧线程发现代数变化后退出
+        self._generation = 0
+        # 最近一次轮询的时间，用于健康检查
+        self.healthy = int(time.time())
+
+    def add(self, data_id, group, tenant, md5="", content=None,
+            file_type="yaml", app_config=None) -> ConfigSubscription:
+        """
+        添加订阅，已存在时更新md5和应用配置字典
+        """
+        sub = ConfigSubscription(data_id, group, tenant, md5=md5, content=content,
+                                 file_type=file_type, app_config=app_config)
+        with self._lock:
+            old = self._subscriptions.get(sub.key)
+            if old is not None:
+                old.md5 = md5 or old.md5
+                old.content = content if content is not None else old.content
+                old.file_type = file_type
+                if app_config is not None:
+                    old.app_config = app_config
+                sub = old
+            else:
+                self._subscriptions[sub.key] = sub
+        self._wakeup.set()
+        return sub
+
+    def remove(self, data_id, group, tenant):
+        with self._lock:
+            self._subscriptions.pop((data_id, group, tenant), None)
+
+    def get(self, data_id, group, tenant) -> t.Optional[ConfigSubscription]:
+        return self._subscriptions.get((data_id, group, tenant))
+
+    def subscriptions(self) -> t.List[ConfigSubscription]:
+        with self._lock:
+            return list(self._subscriptions.values())
+
+    def start(self):
+        if self._running and self.is_alive():
+            return
+        self._running = True
+        self._generation += 1
+        self.healthy = int(time.time())
+        self._thread = threading.Thread(target=self._run, args=(self._generation,),
+                                        name="nacos-config-listener", daemon=True)
+        self._thread.start()
+        logger.info("[Nacos] 配置监听线程已启动")
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _batches(self) -> t.List[t.List[ConfigSubscription]]:
+        subs = self.subscriptions()
+        return [subs[i:i + self.batch_size]
+                for i in range(0, len(subs), self.batch_size)]
+
+    def _run(self, generation):
+        while self._running and generation == self._generation:
+            self.healthy = int(time.time())
+            batches = self._batches()
+            if not batches:
+                self._wakeup.wait(TIME_OUT)
+                self._wakeup.clear()
+                continue
+            try:
+                if len(batches) == 1:
+                    changed = self._poll(batches[0])
+                else:
+                    with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+                        changed = [k for ks in executor.map(self._poll, batches)
+                                   for k in ks]
+            except Exception:
+                logger.exception("[Nacos] 配置监听请求失败", exc_info=True)
+                time.sleep(TIME_OUT)
+                continue
+            for key in changed:
+                sub = self._find(key)
+                if sub is not None:
+                    self._refresh(sub)
+
+    def _find(self, key) -> t.Optional[ConfigSubscription]:
+        data_id, group, tenant = key
+        sub = self._subscriptions.get(key)
+        if sub is None and not tenant:
+            sub = self._subscriptions.get((data_id, group, "public"))
+        return sub
+
+    def _url(self, client, uri) -> str:
+        """
+        拼接客户端host的带认证链接，拼接失败时归还客户端的探测名额
+        """
+        try:
+            return self._url_wrapper("http://" + client.host + uri)
+        except Exception:
+            client.release_probe()
+            raise
+
+    def _poll(self, batch: t.List[ConfigSubscription]) -> t.List[tuple]:
+        """
+        发送一次长轮询请求
+
+        Returns:
+          有变化的配置key列表，请求失败时返回空列表
+        """
+        client = self._host_getter()
+        url = self._url(client, "/nacos/v1/cs/configs/listener")
+        lines = "".join(sub.listening_line() for sub in batch)
+        # 长轮询挂起pulling_timeout秒，读超时留出余量
+        header = {"Long-Pulling-Timeout": str(self.pulling_timeout * 1000)}
+        # 长轮询耗时不代表host延迟，只记录成功失败
+        with client.track(record_latency=False), POLL_SECONDS.time():
+            resp = util.session_for_url(url).post(
+                url, data={"Listening-Configs": lines},
+                timeout=self.pulling_timeout + 20, headers=header)
+        if resp.status_code == 403:
+            POLL_FAILURES.inc()
+            logger.info("[Nacos] 监听配置token失效, 准备重新获取")
+            self._token_refresher()
+            return []
+        if resp.status_code != 200:
+            POLL_FAILURES.inc()
+            logger.warning("[Nacos] 监听配置失败,status_code-%s, message-%s",
+                           resp.status_code, resp.text)
+            time.sleep(TIME_OUT)
+            return []
+        return parse_changed_keys(resp.text)
+
+    def _refresh(self, sub: ConfigSubscription):
+        """
+        拉取单个变更配置的内容
+        """
+        try:
+            client = self._host_getter()
+            url = self._url(client, "/nacos/v1/cs/configs")
+            with client.track():
+                resp = util.session_for_url(url).get(
+                    url, params=sub.query_params(), timeout=self.timeout)
+            if resp.status_code == 404:
+                # 配置被删除
+                content = ""
+            elif resp.status_code != 200:
+                logger.warning("[Nacos] 配置拉取失败：dataId=%s; group=%s; tenant=%s; status_code=%s",
+                               sub.data_id, sub.group, sub.tenant, resp.status_code)
+                return
+            else:
+                content = resp.text
+            sub.md5 = content_md5(content)
+            sub.content = content
+            CONFIG_CHANGES.inc(data_id=sub.data_id, group=sub.group)
+            logger.info("[Nacos] 配置信息更新成功: dataId=%s; group=%s; tenant=%s",
+                        sub.data_id, sub.group, sub.tenant)
+            if self.on_change is not None:
+                self.on_change(sub, content)
+        except Exception:
+            logger.exception("[Nacos] 配置信息更新失败：dataId=%s; group=%s; tenant=%s",
+                             sub.data_id, sub.group, sub.tenant, exc_info=True)
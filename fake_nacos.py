@@ -0,0 +1,398 @@
+"""
+本地进程内的nacos模拟服务，用于联调和验证客户端行为，不依赖真实的nacos集群.
+
+Examples:
+  server = FakeNacosServer().start()
+  server.set_instances("dipper-gateway", [{"ip": "10.0.0.1", "port": 80}])
+  client = nacos.Nacos(host=server.address, username="nacos", password="nacos")
+  client.enable_push(client_ip="127.0.0.1")
+  client.get_server_instance("dipper-gateway")
+  server.set_instances("dipper-gateway", [...], push=True)
+  server.publish_config("naas-ai.yaml", "model: a.ubj", tenant="dipper")
+"""
+import fnmatch
+import hashlib
+import json
+import socket
+import threading
+import time
+import typing as t
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+DEFAULT_GROUP = "DEFAULT_GROUP"
+DEFAULT_CLUSTER = "DEFAULT"
+# Listening-Configs 字段分隔符
+WORD_SEPARATOR = "\x02"
+LINE_SEPARATOR = "\x01"
+
+
+def _md5(content: str) -> str:
+    if not content:
+        return ""
+    return hashlib.md5(content.encode("UTF-8")).hexdigest()
+
+
+def _grouped_name(service_name, group_name):
+    return "{}@@{}".format(group_name or DEFAULT_GROUP, service_name)
+
+
+def _instance(host: dict, service_name, cluster_name) -> dict:
+    instance = {
+        "ip": host["ip"],
+        "port": host["port"],
+        "weight": 1.0,
+        "healthy": True,
+        "enabled": True,
+        "ephemeral": True,
+        "clusterName": cluster_name,
+        "serviceName": service_name,
+        "metadata": {},
+    }
+    instance.update(host)
+    instance.setdefault("instanceId", "{}#{}#{}#{}".format(
+        instance["ip"], instance["port"], cluster_name, service_name))
+    return instance
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeNacosServer"
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，不关闭Nagle时keep-alive连接上每个请求多出约40ms的延迟确认等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _params(self) -> t.Dict[str, str]:
+        parts = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode("UTF-8")
+            params.update({k: v[0] for k, v in parse_qs(body).items()})
+        return params
+
+    def _reply(self, status=200, body="", content_type="application/json"):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        path = urlsplit(self.path).path
+        handler = self.server.routes.get((method, path))
+        if handler is None:
+            self._reply(404, "not found", "text/plain")
+            return
+        self.server.request_count[path] = self.server.request_count.get(path, 0) + 1
+        status, body = handler(self._params(), self.headers)
+        self._reply(status, body, "application/json"
+                    if not isinstance(body, str) else "text/plain")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class FakeNacosServer(ThreadingHTTPServer):
+    """
+    模拟nacos v1接口，默认监听127.0.0.1随机端口
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.address = "{}:{}".format(*self.server_address[:2])
+        self.request_count: t.Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # grouped_name -> cluster -> 实例列表
+        self._services: t.Dict[str, t.Dict[str, t.List[dict]]] = {}
+        # (grouped_name, cluster) -> {(clientIP, udpPort)}
+        self._subscribers: t.Dict[tuple, set] = {}
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.settimeout(1)
+        self._udp_lock = threading.Lock()
+        self.token_ttl = 18000
+        self.routes = {
+            ("POST", "/nacos/v1/auth/login"): self.login,
+            ("GET", "/nacos/v1/ns/instance/list"): self.instance_list,
+            ("POST", "/nacos/v1/ns/instance"): self.register_instance,
+            ("DELETE", "/nacos/v1/ns/instance"): self.deregister_instance,
+            ("PUT", "/nacos/v1/ns/instance/beat"): self.beat,
+            ("GET", "/nacos/v1/ns/catalog/services"): self.catalog_services,
+            ("GET", "/nacos/v1/cs/configs"): self.get_config,
+            ("POST", "/nacos/v1/cs/configs"): self.post_config,
+            ("DELETE", "/nacos/v1/cs/configs"): self.delete_config,
+            ("POST", "/nacos/v1/cs/configs/listener"): self.listener,
+        }
+        # (dataId, group, tenant) -> 配置内容
+        self._configs: t.Dict[tuple, str] = {}
+        # 配置变化时唤醒挂起的长轮询
+        self._config_changed = threading.Condition(self._lock)
+        self._stopped = False
+        # 返回给客户端的心跳间隔，单位毫秒
+        self.client_beat_interval = 5000
+        # (grouped_name, ip, port) -> 最近心跳时间
+        self.beats: t.Dict[tuple, float] = {}
+        self._thread = None
+
+    def start(self) -> "FakeNacosServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-nacos",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._config_changed:
+            self._stopped = True
+            self._config_changed.notify_all()
+        self.shutdown()
+        self.server_close()
+        self._udp.close()
+
+    def set_instances(self, service_name, hosts, group_name=DEFAULT_GROUP,
+                      cluster_name=DEFAULT_CLUSTER, push=False) -> t.List[dict]:
+        """
+        设置服务实例
+
+        Args:
+          hosts: 实例列表，至少包含ip和port
+          push: 是否立即推送给订阅的客户端
+
+        Returns:
+          push为True时返回收到的ack列表
+        """
+        name = _grouped_name(service_name, group_name)
+        with self._lock:
+            self._services.setdefault(name, {})[cluster_name] = [
+                _instance(h, name, cluster_name) for h in hosts]
+        if push:
+            return self.push(service_name, group_name, cluster_name)
+        return []
+
+    def publish_config(self, data_id, content, group=DEFAULT_GROUP, tenant="") -> str:
+        """
+        发布配置，挂起的长轮询立即返回变更
+
+        Returns:
+          配置内容的md5
+        """
+        with self._config_changed:
+            self._configs[(data_id, group or DEFAULT_GROUP, tenant or "")] = content
+            self._config_changed.notify_all()
+        return _md5(content)
+
+    def remove_config(self, data_id, group=DEFAULT_GROUP, tenant="") -> bool:
+        with self._config_changed:
+            removed = self._configs.pop((data_id, group or DEFAULT_GROUP, tenant or ""), None)
+            self._config_changed.notify_all()
+        return removed is not None
+
+    def service_info(self, grouped_name, cluster_name) -> dict:
+        with self._lock:
+            hosts = list(self._services.get(grouped_name, {}).get(cluster_name, []))
+        return {
+            "name": grouped_name,
+            "clusters": cluster_name,
+            "cacheMillis": 10000,
+            "hosts": hosts,
+            "lastRefTime": int(time.time() * 1000),
+            "checksum": "",
+            "allIPs": False,
+        }
+
+    def push(self, service_name, group_name=DEFAULT_GROUP,
+             cluster_name=DEFAULT_CLUSTER, timeout=1) -> t.List[dict]:
+        """
+        向订阅的客户端推送实例列表，并等待ack
+
+        Returns:
+          收到的ack列表
+        """
+        name = _grouped_name(service_name, group_name)
+        info = self.service_info(name, cluster_name)
+        packet = json.dumps({"type": "dom", "data": json.dumps(info),
+                             "lastRefTime": info["lastRefTime"]}).encode("UTF-8")
+        acks = []
+        with self._udp_lock:
+            self._udp.settimeout(timeout)
+            for address in list(self._subscribers.get((name, cluster_name), ())):
+                self._udp.sendto(packet, address)
+                try:
+                    data, _ = self._udp.recvfrom(65536)
+                    acks.append(json.loads(data.decode("UTF-8")))
+                except socket.timeout:
+                    pass
+        return acks
+
+    def login(self, params, headers):
+        return 200, {"accessToken": "fake-token-%d" % int(time.time() * 1000),
+                     "tokenTtl": self.token_ttl, "globalAdmin": True,
+                     "username": params.get("username", "")}
+
+    def register_instance(self, params, headers):
+        name = _grouped_name(params.get("serviceName", ""), params.get("groupName"))
+        cluster_name = params.get("clusterName") or DEFAULT_CLUSTER
+        host = {"ip": params["ip"], "port": int(params["port"]),
+                "weight": float(params.get("weight", 1))}
+        with self._lock:
+            hosts = self._services.setdefault(name, {}).setdefault(cluster_name, [])
+            hosts[:] = [h for h in hosts
+                        if (h["ip"], h["port"]) != (host["ip"], host["port"])]
+            hosts.append(_instance(host, name, cluster_name))
+            self.beats[(name, host["ip"], host["port"])] = time.time()
+        return 200, "ok"
+
+    def deregister_instance(self, params, headers):
+        name = _grouped_name(params.get("serviceName", ""), params.get("groupName"))
+        cluster_name = params.get("clusterName") or DEFAULT_CLUSTER
+        address = (params["ip"], int(params["port"]))
+        with self._lock:
+            hosts = self._services.get(name, {}).get(cluster_name, [])
+            hosts[:] = [h for h in hosts if (h["ip"], h["port"]) != address]
+            self.beats.pop((name,) + address, None)
+        return 200, "ok"
+
+    def beat(self, params, headers):
+        beat = json.loads(params.get("beat") or "{}")
+        name = _grouped_name(params.get("serviceName", ""), params.get("groupName"))
+        key = (name, beat.get("ip"), int(beat.get("port") or 0))
+        with self._lock:
+            if key not in self.beats:
+                return 200, {"code": 20404, "clientBeatInterval": self.client_beat_interval}
+            self.beats[key] = time.time()
+        return 200, {"code": 10200, "clientBeatInterval": self.client_beat_interval,
+                     "lightBeatEnabled": True}
+
+    def instance_list(self, params, headers):
+        name = _grouped_name(params.get("serviceName", ""), params.get("groupName"))
+        cluster_name = params.get("clusters") or DEFAULT_CLUSTER
+        if params.get("udpPort") and params.get("udpPort") != "0":
+            address = (params.get("clientIP") or "127.0.0.1", int(params["udpPort"]))
+            with self._lock:
+                self._subscribers.setdefault((name, cluster_name), set()).add(address)
+        info = self.service_info(name, cluster_name)
+        if params.get("healthyOnly") == "true":
+            info["hosts"] = [h for h in info["hosts"] if h["healthy"]]
+        return 200, info
+
+    def catalog_services(self, params, headers):
+        page_no = int(params.get("pageNo") or 1)
+        page_size = int(params.get("pageSize") or 10)
+        group_name = params.get("groupNameParam") or ""
+        service_name = params.get("serviceNameParam") or ""
+        services = []
+        with self._lock:
+            for name, clusters in sorted(self._services.items()):
+                group, _, service = name.partition("@@")
+                if group_name and group != group_name:
+                    continue
+                if service_name and service_name not in service:
+                    continue
+                hosts = [h for hs in clusters.values() for h in hs]
+                services.append({
+                    "name": service,
+                    "groupName": group,
+                    "clusterCount": len(clusters),
+                    "ipCount": len(hosts),
+                    "healthyInstanceCount": sum(1 for h in hosts if h["healthy"]),
+                    "triggerFlag": "false",
+                })
+        start = (page_no - 1) * page_size
+        return 200, {"count": len(services), "serviceList": services[start:start + page_size]}
+
+    def _config_item(self, key, content) -> dict:
+        return {"id": str(abs(hash(key))), "dataId": key[0], "group": key[1], "tenant": key[2],
+                "content": content, "md5": _md5(content), "type": key[0].rsplit(".", 1)[-1]}
+
+    def get_config(self, params, headers):
+        search = params.get("search")
+        if search:
+            # 配置列表查询，accurate精确匹配，blur支持*通配
+            data_id = params.get("dataId") or ""
+            group = params.get("group") or ""
+            tenant = params.get("tenant") or ""
+            with self._lock:
+                items = [self._config_item(k, v) for k, v in sorted(self._configs.items())
+                         if (fnmatch.fnmatchcase(k[0], data_id) if search == "blur" else k[0] == data_id)
+                         and (not group or k[1] == group) and (not tenant or k[2] == tenant)]
+            page_no = int(params.get("pageNo") or 1)
+            page_size = int(params.get("pageSize") or 10)
+            start = (page_no - 1) * page_size
+            return 200, {"totalCount": len(items), "pageNumber": page_no,
+                         "pagesAvailable": (len(items) + page_size - 1) // page_size,
+                         "pageItems": items[start:start + page_size]}
+        key = (params.get("dataId", ""), params.get("group") or DEFAULT_GROUP, params.get("tenant") or "")
+        with self._lock:
+            content = self._configs.get(key)
+        if content is None:
+            return 404, "config data not exist"
+        return 200, content
+
+    def post_config(self, params, headers):
+        self.publish_config(params.get("dataId", ""), params.get("content", ""),
+                            params.get("group"), params.get("tenant"))
+        return 200, "true"
+
+    def delete_config(self, params, headers):
+        self.remove_config(params.get("dataId", ""), params.get("group"), params.get("tenant"))
+        return 200, "true"
+
+    def _changed_keys(self, listening) -> t.List[tuple]:
+        changed = []
+        for key, md5 in listening:
+            if _md5(self._configs.get(key, "")) != md5:
+                changed.append(key)
+        return changed
+
+    def listener(self, params, headers):
+        listening = []
+        for line in params.get("Listening-Configs", "").split(LINE_SEPARATOR):
+            words = line.split(WORD_SEPARATOR)
+            if len(words) < 3:
+                continue
+            key = (words[0], words[1] or DEFAULT_GROUP, words[3] if len(words) > 3 else "")
+            listening.append((key, words[2]))
+        timeout = int(headers.get("Long-Pulling-Timeout") or 30000) / 1000.0
+        deadline = time.time() + timeout
+        with self._config_changed:
+            changed = self._changed_keys(listening)
+            while not changed and not self._stopped:
+                remain = deadline - time.time()
+                if remain <= 0:
+                    break
+                self._config_changed.wait(remain)
+                changed = self._changed_keys(listening)
+        body = "".join(WORD_SEPARATOR.join(k) + LINE_SEPARATOR for k in changed)
+        return 200, quote(body)
+
+
+if __name__ == '__main__':
+    # 演示：实例变化通过UDP推送到客户端缓存的耗时
+    import nacos
+
+    fake = FakeNacosServer().start()
+    fake.set_instances("dipper-gateway", [{"ip": "10.0.0.1", "port": 80}])
+    client = nacos.Nacos(host=fake.address, username="nacos", password="nacos")
+    client.enable_push(client_ip="127.0.0.1")
+    print("初始实例:", client.get_server_instance("dipper-gateway"))
+    start = time.time()
+    print("ack:", fake.set_instances("dipper-gateway", [{"ip": "10.0.0.2", "port": 80}],
+                                     push=True))
+    print("推送后实例:", client.get_server_instance("dipper-gateway"),
+          "耗时: %.3fms" % ((time.time() - start) * 1000))
+    fake.stop()
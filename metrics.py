@@ -0,0 +1,200 @@
+"""
+进程内指标，计数器/仪表/直方图，按Prometheus文本格式输出.
+"""
+import bisect
+import math
+import threading
+import time
+import typing as t
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    指标基类，values以标签值元组为key
+
+    可以传入fn在输出时取值，适合统计值已经由其他对象维护的情况，
+    fn返回数值，或返回 {标签值元组: 数值}
+    """
+    type = ""
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values: t.Dict[tuple, t.Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError("指标 %s 的标签应为 %s, 实际为 %s"
+                             % (self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> t.Iterator[t.Tuple[str, str, t.Any]]:
+        """
+        Returns:
+          (指标名后缀, 标签字符串, 值) 迭代器
+        """
+        if self.fn is not None:
+            value = self.fn()
+            if isinstance(value, dict):
+                for key, v in value.items():
+                    yield "", _format_labels(self.labelnames, key), v
+            else:
+                yield "", "", value
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.labelnames, key), value
+
+    def render(self) -> t.List[str]:
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.type)]
+        for suffix, labels, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, labels, _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                # [各桶计数, 总和, 总数]
+                data = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        记录代码块的耗时，单位秒
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(data[0]), data[1], data[2])) for key, data in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield "_bucket", _format_labels(self.labelnames, key, ("le", _format_value(bound))), cumulative
+            yield "_sum", _format_labels(self.labelnames, key), total
+            yield "_count", _format_labels(self.labelnames, key), count
+
+
+class Registry:
+    """
+    指标注册表，同名指标只注册一次
+    """
+
+    def __init__(self):
+        self._metrics: t.Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError("指标 %s 已注册为不同的类型或标签" % metric.name)
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # 取值失败的指标不影响其他指标输出
+                lines.append("# %s 输出失败: %s" % (metric.name, _escape(e)))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=(), fn=None) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames, fn))
+
+
+def gauge(name, documentation, labelnames=(), fn=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, fn))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,153 @@
+"""
+模型内存缓存，按 路径+修改时间 缓存已加载的模型，LRU淘汰.
+"""
+import os
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+import common_log
+import metrics
+import model_io
+
+log = common_log.get_log('server.log', 'debug')
+
+LOAD_SECONDS = metrics.histogram("model_load_duration_seconds", "模型文件加载耗时", ["model"])
+
+
+class ModelCache:
+    """
+    模型缓存
+
+    以(绝对路径, 修改时间)为key，文件被覆盖后自动重新加载；
+    缓存个数或模型文件总大小超过上限时淘汰最久未使用的模型；
+    多进程部署时在fork之前调用warmup，子进程以写时复制的方式共享已加载的模型
+    """
+
+    def __init__(self, max_count=8, max_bytes=2 * 1024 ** 3, loader=model_io.load_model):
+        """
+        Args:
+          max_count: 最多缓存的模型数
+          max_bytes: 缓存模型文件的总大小上限，单位字节
+          loader: 模型加载方法，参数为文件路径
+        """
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.loader = loader
+        # (path, mtime) -> (模型, 文件大小)
+        self._models: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 路径 -> [加载锁, 使用中的请求数]，同一模型并发请求只加载一次，没有请求使用时移除
+        self._load_locks: t.Dict[str, list] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path) -> t.Tuple[tuple, int]:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        return (path, st.st_mtime_ns), st.st_size
+
+    def get(self, path):
+        """
+        获取模型，未缓存时加载
+
+        Raises:
+          FileNotFoundError: 模型文件不存在
+        """
+        key, size = self._key(path)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            loading = self._load_locks.get(key[0])
+            if loading is None:
+                loading = self._load_locks[key[0]] = [threading.Lock(), 0]
+            loading[1] += 1
+        try:
+            with loading[0]:
+                with self._lock:
+                    entry = self._models.get(key)
+                    if entry is not None:
+                        self._models.move_to_end(key)
+                        self.hits += 1
+                        return entry[0]
+                start = time.perf_counter()
+                model = self.loader(key[0])
+                seconds = time.perf_counter() - start
+                LOAD_SECONDS.observe(seconds, model=os.path.basename(key[0]))
+                log.info("模型加载完成: %s, 耗时: %.3fs", key[0], seconds)
+                with self._lock:
+                    self.misses += 1
+                    self._drop_path(key[0])
+                    self._models[key] = (model, size)
+                    self._bytes += size
+                    self._evict()
+                return model
+        finally:
+            with self._lock:
+                loading[1] -= 1
+                if loading[1] == 0:
+                    self._load_locks.pop(key[0], None)
+
+    def _drop_path(self, path):
+        for key in [k for k in self._models if k[0] == path]:
+            _, size = self._models.pop(key)
+            self._bytes -= size
+
+    def _evict(self):
+        while self._models and (len(self._models) > self.max_count
+                                or (self._bytes > self.max_bytes and len(self._models) > 1)):
+            key, (_, size) = self._models.popitem(last=False)
+            self._bytes -= size
+            log.info("模型缓存淘汰: %s", key[0])
+
+    def invalidate(self, path=None):
+        """
+        移除指定模型的缓存，path为空时清空全部缓存
+        """
+        with self._lock:
+            if path is None:
+                self._models.clear()
+                self._bytes = 0
+            else:
+                self._drop_path(os.path.abspath(path))
+
+    def warmup(self, model_dir, suffix=model_io.MODEL_SUFFIXES, limit=None) -> int:
+        """
+        预加载目录下最新的模型
+
+        Args:
+          model_dir: 模型目录
+          suffix: 模型文件后缀，可以是元组
+          limit: 最多加载的模型数，默认为max_count
+
+        Returns:
+          加载的模型数
+        """
+        if not os.path.isdir(model_dir):
+            return 0
+        paths = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.endswith(suffix)]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        count = 0
+        for path in paths[:limit or self.max_count]:
+            try:
+                self.get(path)
+                count += 1
+            except Exception:
+                log.exception("模型预加载失败: %s", path, exc_info=True)
+        return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "models": [k[0] for k in self._models],
+                "count": len(self._models),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,143 @@
+"""
+模型文件读写，使用xgboost原生的UBJSON格式保存，兼容读取旧的joblib(.pkl)模型.
+
+用法(迁移旧模型)：python model_io.py ./dic/models/ [--remove]
+"""
+import argparse
+import os
+import time
+import typing as t
+
+import joblib
+import xgboost as xgb
+
+import common_log
+import model_meta
+
+log = common_log.get_log('server.log', 'debug')
+
+# 原生格式(UBJSON)后缀
+NATIVE_SUFFIX = ".ubj"
+# 旧的joblib格式后缀
+PICKLE_SUFFIX = ".pkl"
+# 模型文件后缀
+MODEL_SUFFIXES = (NATIVE_SUFFIX, PICKLE_SUFFIX)
+
+
+def save_model(model, path: str) -> str:
+    """
+    以原生格式保存模型，先写临时文件再改名，避免读到写了一半的模型
+
+    Args:
+      model: XGBModel或Booster
+      path: 模型路径，后缀为.ubj
+
+    Returns:
+      模型路径
+    """
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    root, suffix = os.path.splitext(path)
+    # 保留后缀，xgboost按后缀选择格式
+    tmp_path = root + ".tmp" + suffix
+    booster.save_model(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_model(path: str):
+    """
+    加载模型
+
+    原生格式由xgboost直接从文件解析为只读使用的Booster，不经过pickle，也不在Python中保留文件内容；
+    .pkl为旧格式，需要反序列化Python对象，只用于兼容和迁移
+
+    Returns:
+      原生格式返回xgb.Booster，.pkl返回保存时的对象
+    """
+    if path.endswith(NATIVE_SUFFIX):
+        booster = xgb.Booster()
+        booster.load_model(path)
+        return booster
+    if path.endswith(PICKLE_SUFFIX):
+        log.warning("加载pickle格式模型，建议迁移为原生格式: %s", path)
+        return joblib.load(path)
+    raise ValueError("不支持的模型格式: %s" % path)
+
+
+def native_path(pickle_path: str) -> str:
+    return os.path.splitext(pickle_path)[0] + NATIVE_SUFFIX
+
+
+def migrate(pickle_path: str, remove=False) -> str:
+    """
+    把.pkl模型转换为原生格式，并补充元数据文件
+
+    Args:
+      pickle_path: .pkl模型路径
+      remove: 转换成功后是否删除.pkl文件
+
+    Returns:
+      原生格式模型路径
+    """
+    model = joblib.load(pickle_path)
+    path = save_model(model, native_path(pickle_path))
+    # 原生格式与pkl同名，已有的元数据文件直接沿用
+    meta = model_meta.load_meta(pickle_path)
+    if meta is None:
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        # 旧模型的训练数据行数未知
+        meta = model_meta.build_meta(
+            path, rows=None, features=booster.num_features(), accuracy=_parse_accuracy(pickle_path),
+            rounds=booster.num_boosted_rounds(),
+            trainedAt=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(pickle_path))))
+    meta.update(model=os.path.basename(path), migratedFrom=os.path.basename(pickle_path))
+    model_meta.save_meta(path, meta)
+    if remove:
+        os.remove(pickle_path)
+    log.info("模型迁移完成: %s -> %s", pickle_path, path)
+    return path
+
+
+def _parse_accuracy(path: str) -> t.Optional[float]:
+    """
+    从 <name>_acc=<x>.pkl 文件名中解析准确率
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    if "_acc=" not in name:
+        return None
+    try:
+        return float(name.rsplit("_acc=", 1)[1])
+    except ValueError:
+        return None
+
+
+def migrate_dir(model_dir: str, remove=False) -> t.List[str]:
+    """
+    迁移目录下所有还没有原生格式的.pkl模型
+
+    Returns:
+      迁移后的模型路径列表
+    """
+    paths = []
+    for file_name in sorted(os.listdir(model_dir)):
+        if not file_name.endswith(PICKLE_SUFFIX):
+            continue
+        pickle_path = os.path.join(model_dir, file_name)
+        if os.path.exists(native_path(pickle_path)):
+            continue
+        try:
+            paths.append(migrate(pickle_path, remove=remove))
+        except Exception:
+            log.exception("模型迁移失败: %s", pickle_path, exc_info=True)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="把joblib(.pkl)模型迁移为xgboost原生格式")
+    parser.add_argument("model_dir", nargs="?", default="./dic/models/", help="模型目录")
+    parser.add_argument("--remove", action="store_true", help="迁移成功后删除.pkl文件")
+    args = parser.parse_args()
+    migrated = migrate_dir(args.model_dir, remove=args.remove)
+    print("已迁移 %s 个模型" % len(migrated))
+    for p in migrated:
+        print(p)
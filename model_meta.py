@@ -0,0 +1,95 @@
+"""
+模型元数据，以 JSON 文件保存在模型文件旁，记录模型的训练来源(lineage).
+"""
+import json
+import os
+import time
+import typing as t
+
+import common_log
+
+log = common_log.get_log('server.log', 'debug')
+
+# 元数据文件后缀，文件名为 模型文件名(不含后缀) + META_SUFFIX
+META_SUFFIX = ".meta.json"
+
+
+def meta_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + META_SUFFIX
+
+
+def is_meta_file(file_name: str) -> bool:
+    return file_name.endswith(META_SUFFIX)
+
+
+def load_meta(model_path: str) -> t.Optional[dict]:
+    """
+    读取模型元数据
+
+    Returns:
+      元数据字典，文件不存在或解析失败时返回None
+    """
+    path = meta_path(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        log.warning("模型元数据读取失败: %s", path)
+        return None
+
+
+def save_meta(model_path: str, meta: dict) -> str:
+    """
+    写入模型元数据，先写临时文件再改名
+
+    Returns:
+      元数据文件路径
+    """
+    path = meta_path(model_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_meta(model_path: str, rows: t.Optional[int], features: int, accuracy: float, rounds: int,
+               parent_path: t.Optional[str] = None, **extra) -> dict:
+    """
+    生成模型元数据，增量训练时继承父模型的来源信息
+
+    Args:
+      model_path: 模型文件路径
+      rows: 本次训练使用的数据行数，未知时为None
+      features: 特征数
+      accuracy: 验证集准确率
+      rounds: 模型的总迭代轮数
+      parent_path: 增量训练的父模型路径，从头训练时为空
+      extra: 其他需要记录的信息
+
+    Returns:
+      元数据字典
+    """
+    parent = load_meta(parent_path) if parent_path else None
+    lineage = []
+    rows_seen = rows
+    if parent_path:
+        lineage = list((parent or {}).get("lineage") or []) + [os.path.basename(parent_path)]
+        if parent is not None and rows_seen is not None:
+            rows_seen += parent.get("rowsSeen") or 0
+    meta = {
+        "model": os.path.basename(model_path),
+        "parent": os.path.basename(parent_path) if parent_path else None,
+        # 从最早的祖先模型到父模型
+        "lineage": lineage,
+        "rows": rows,
+        "rowsSeen": rows_seen,
+        "features": features,
+        "accuracy": accuracy,
+        "rounds": rounds,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+    }
+    meta.update(extra)
+    return meta
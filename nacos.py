@@ -1,7 +1,6 @@
 """
 nacos module.
 """
-import hashlib
 import json
 import logging
 import string
@@ -11,13 +10,21 @@ import typing as t
 import urllib
 import files
 
-import requests
 import yaml
 from requests import Response
 
+import balancer
+import metrics
 import util
-from constants import BEAT_TIME, REGISTER_DICT_KEY, TIME_OUT
+from beat_reactor import (BeatInfo, BeatReactor, CODE_OK, CODE_RESOURCE_NOT_FOUND,
+                          instance_key)
+from config_dispatcher import ConfigDispatcher
+from config_listener import ConfigListener, ConfigSubscription, content_md5
+from constants import TIME_OUT
 from exception import ForbiddenException
+from push_receiver import PushReceiver
+from service_cache import ServiceCache
+from token_manager import TokenManager
 from util import HostPool, logger
 
 DEFAULTS = {
@@ -27,8 +34,15 @@ DEFAULTS = {
     "CALLBACK_THREAD_NUM": 10,
     "FAILOVER_BASE": "nacos-data/data",
     "SNAPSHOT_BASE": "nacos-data/snapshot",
+    "INSTANCE_CACHE_TTL": 10,  # in seconds
+    "INSTANCE_CACHE_JITTER": 0.2,
 }
 
+BEAT_SECONDS = metrics.histogram(
+    "nacos_beat_duration_seconds", "Nacos心跳请求耗时", ["host"])
+BEAT_FAILURES = metrics.counter(
+    "nacos_beat_failures_total", "Nacos心跳失败次数", ["host", "reason"])
+
 
 def info(msg, *args, **kwargs):
     logger.info("[Nacos] " + msg, *args, **kwargs)
@@ -61,22 +75,49 @@ class Nacos:
         self.host_pool = HostPool(host)
         self.username = username
         self.password = password
-        self._thread_healthy_dict = {}
         self._config_dict = {}
+        self.config_listener = ConfigListener(
+            host_getter=self.__get_host,
+            url_wrapper=self.__wrap_auth_url,
+            token_refresher=self.__refresh_token,
+            on_change=self.__on_config_change,
+            pulling_timeout=DEFAULTS["PULLING_TIMEOUT"],
+            batch_size=DEFAULTS["PULLING_CONFIG_SIZE"],
+            timeout=DEFAULTS["TIMEOUT"])
+        # 配置变更回调在独立的线程池中执行，不阻塞长轮询
+        self.config_dispatcher = ConfigDispatcher(max_workers=DEFAULTS["CALLBACK_THREAD_NUM"])
+        self.service_cache = ServiceCache(
+            fetcher=self.__query_instances,
+            ttl=DEFAULTS["INSTANCE_CACHE_TTL"],
+            jitter=DEFAULTS["INSTANCE_CACHE_JITTER"],
+            snapshot_base=DEFAULTS["SNAPSHOT_BASE"],
+            failover_base=DEFAULTS["FAILOVER_BASE"])
+        # (service, group, cluster, strategy) -> [实例版本号, Selector]
+        self._selector_dict = {}
+        self._selector_lock = threading.Lock()
+        self.push_receiver = None
+        self.push_client_ip = ""
         self._register_dict = {}
+        self.beat_reactor = BeatReactor(beat_fn=self.__send_beat,
+                                        register_fn=self.__register_instance)
         self.healthy = ""
-        self.access_token = ""  # token
-        self.access_token_invalid_time = -1  # token失效时间
+        self.token_manager = TokenManager(self.host_pool, username=username, password=password)
         if username and password:
-            login_data = util.get_access_token(
-                host=self.host_pool, username=username, password=password)
-            if login_data:
-                self.access_token = login_data["accessToken"]
-                vt = int(time.time()) + login_data["tokenTtl"] - 10  # 设置10秒偏移量
-                self.access_token_invalid_time = vt
-            else:
-                logging.error("nacos认证失败，请检查账号密码是否正确")
-                exit(1)
+            # 登录失败不再退出，由后台线程退避重试，期间使用本地快照提供服务
+            if not self.token_manager.refresh():
+                logger.error("nacos认证失败，请检查账号密码是否正确")
+            self.token_manager.start()
+        # 启动时先加载本地实例快照，注册中心不可用时也能提供服务发现，
+        # 后台刷新会用到push_receiver和token_manager，因此放在最后
+        self.service_cache.warm_up()
+
+    @property
+    def access_token(self):
+        return self.token_manager.access_token
+
+    @property
+    def access_token_invalid_time(self):
+        return self.token_manager.invalid_time
 
     def __get_host(self):
         """
@@ -90,29 +131,14 @@ class Nacos:
         return client
 
     def __refresh_token(self):
-        """刷新token
-        """
-        login_data = util.get_access_token(
-            host=self.host_pool,
-            username=self.username, password=self.password)
-        if login_data:
-            self.access_token = login_data["accessToken"]
-            self.access_token_invalid_time = (int(time.time()) +
-                                              login_data["tokenTtl"] - 10)  # 设置10秒偏移量
-            return self.access_token
-        else:
-            logger.error("nacos认证失败，请检查账号密码是否正确")
-            exit(1)
+        """刷新token，并发调用时只会登录一次
+        """
+        return self.token_manager.refresh(force=True)
 
     def __get_token(self):
         """检查并获取token
         """
-        if self.access_token:
-            if time.time() < self.access_token_invalid_time:
-                return self.access_token
-            else:
-                return self.__refresh_token()
-        return self.__refresh_token()
+        return self.token_manager.get_token()
 
     def __wrap_auth_url(self, url=""):
         """
@@ -124,56 +150,46 @@ class Nacos:
                     token if "?" in url else url + "?accessToken=" + token)
         return url
 
+    def __host_url(self, client, uri):
+        """
+        拼接客户端host的带认证链接，拼接失败时归还客户端的探测名额
+        """
+        try:
+            return self.__wrap_auth_url("http://" + client.host + uri)
+        except Exception:
+            client.release_probe()
+            raise
+
     def __healthy_check_thread_run(self):
         """启动健康检查
 
-        register_service注册服务以及config获取配置后，这两个方法会分别启动线程维持心跳,
+        register_service注册服务以及config获取配置后，会分别启动心跳线程和配置监听线程,
         本方法用于做异常处理，多次心跳失败后会重新进行注册和配置获取
         """
         while True:
             time.sleep(5)
             self.healthy = int(time.time())
-            # 检查configThread
+            # 检查配置监听线程
             try:
-                for item in self._config_dict:
-                    config_msg = item.split("\001")
-                    data_id = config_msg[0]
-                    group = config_msg[1]
-                    tenant = config_msg[2]
-                    ht = self._thread_healthy_dict[data_id + group + tenant]
-                    x = int(time.time()) - ht
-                    if x > 50 and self.config_thread is None:
-                        md5_content = config_msg[3]
-                        app_config = self._config_dict[item]
-                        self.config_thread = threading.Thread(
-                            target=self.__config_listening_thread_run,
-                            args=(data_id, group, tenant,
-                                  md5_content, app_config))
-                        hk = data_id + group + tenant
-                        self._thread_healthy_dict[hk] = int(time.time())
-                        self.config_thread.start()
-                        logger.info(
-                            "配置信息监听线程重启成功: dataId=%s; group=%s; tenant=%s",
-                            data_id, group, tenant)
+                x = int(time.time()) - self.config_listener.healthy
+                if self._config_dict and (not self.config_listener.is_alive()
+                                          or x > DEFAULTS["PULLING_TIMEOUT"] + 50):
+                    self.config_listener.stop()
+                    self.config_listener.start()
+                    logger.info("配置信息监听线程重启成功, 监听配置数: %s",
+                                len(self._config_dict))
             except Exception:
                 logger.exception("配置信息监听线程健康检查错误", exc_info=True)
-            # 检查registerThread
+            # 检查心跳调度线程，长时间没有心跳成功的实例重新注册
             try:
-                x = int(time.time()) - self._register_dict["healthy"]
-                if x > 15:
-                    service_ip = self._register_dict["serviceIp"]
-                    service_port = self._register_dict["servicePort"]
-                    service_name = self._register_dict["serviceName"]
-                    namespace_id = self._register_dict["namespaceId"]
-                    group_name = self._register_dict["groupName"]
-                    cluster_name = self._register_dict["clusterName"]
-                    ephemeral = self._register_dict["ephemeral"]
-                    metadata = self._register_dict["metadata"]
-                    weight = self._register_dict["weight"]
-                    enabled = self._register_dict["enabled"]
-                    self.register_service(service_ip, service_name, service_port,
-                                          namespace_id, group_name, cluster_name,
-                                          ephemeral, metadata, weight, enabled)
+                if self.beat_reactor.entries() and not self.beat_reactor.is_alive():
+                    self.beat_reactor.start()
+                    logger.info("心跳调度线程重启成功")
+                now = int(time.time())
+                for info in self.beat_reactor.entries():
+                    if now - info.last_beat > max(15, 3 * info.interval):
+                        logger.warning("服务心跳超时，重新注册: %s", info.key)
+                        self.__register_instance(info)
             except Exception:
                 logger.exception("服务注册心跳进程健康检查失败", exc_info=True)
 
@@ -184,80 +200,41 @@ class Nacos:
         th.start()
         logger.info("健康检查线程已启动")
 
-    def __config_listening_thread_run(self,
-                                      data_id, group, tenant, md5_content, app_config):
-        """监听配置修改
-
-        Args:
-            dataId: str 服务id
-            group: str
-            group，默认 DEFAULT_GROUP
-            tenant: str 租户
-            md5Content: str 内容md5，用于快速比较是否配置有修改
-            myConfig: dict 应用当前配置字典
+    def __on_config_change(self, sub: ConfigSubscription, content: str):
+        """配置变更回调，将新配置写入应用配置字典并保存快照
         """
-        params = {
-            "dataId": data_id,
-            "group": group,
-            "tenant": tenant
-        }
+        nacos_json = self.__get_config_dict(content, file_type=sub.file_type) or {}
+        if sub.app_config is not None:
+            for item in nacos_json:
+                sub.app_config[item] = nacos_json[item]
+        cache_key = group_key(sub.data_id, sub.group, sub.tenant) + ".yml"
+        files.save_file(DEFAULTS['SNAPSHOT_BASE'], cache_key, nacos_json)
+        if self.config_dispatcher.has_callbacks(sub.key):
+            config = self.__parse_config(content, sub.file_type)
+            if config is None:
+                logger.warning("[Nacos] 配置解析失败，不通知订阅者: dataId=%s; group=%s; tenant=%s",
+                               sub.data_id, sub.group, sub.tenant)
+                return
+            self.config_dispatcher.dispatch(sub.key, config)
 
-        # 设置长连接30秒，接口会在30秒后返回结果
-        header = {"Long-Pulling-Timeout": "30000"}
-        dk = data_id + group + tenant
-        while True:
-            try:
-                time.sleep(BEAT_TIME)
-            except Exception:
-                break
-            if not self.config_thread:
-                break
-            # URL
-            get_config_url = self.__wrap_auth_url("http://" +
-                                                  self.__get_host().host + "/nacos/v1/cs/configs")
-            license_config_url = self.__wrap_auth_url(
-                "http://" + self.__get_host().host +
-                "/nacos/v1/cs/configs/listener")
-            self._thread_healthy_dict[dk] = int(time.time())
-            if tenant == "public":
-                lck = data_id + "\002" + group + "\002" + md5_content + "\001"
-            else:
-                lck = "{}\002{}\002{}\002{}\001".format(
-                    data_id, group, md5_content, tenant)
-            re = requests.post(
-                license_config_url,
-                data={"Listening-Configs": lck},
-                timeout=50,
-                headers=header)
-            if re.status_code == 403:
-                # relogin
-                info("获取配置token失效, 准备重新获取")
-                self.__refresh_token()
-            elif re.status_code == 200:
-                if re.text != "":
-                    try:
-                        re = requests.get(get_config_url, params=params)
-                        info("获取更新配置内容为\n%s", re.text)
-                        nacos_json = self.__get_config_dict(re.text)
-                        md5 = hashlib.md5()
-                        md5.update(re.content)
-                        md5_content = md5.hexdigest()
-                        for item in nacos_json:
-                            app_config[item] = nacos_json[item]
-                        info(
-                            "配置信息更新成功: dataId=%s; group=%s; tenant=%s",
-                            data_id, group, tenant)
-                    except Exception:
-                        logger.exception(
-                            "配置信息更新失败：dataId=" + data_id + "; group=" +
-                            group + "; tenant=" + tenant,
-                            exc_info=True)
-                        self.config_thread = None
-                        break
+    def __parse_config(self, content: str, file_type="yaml"):
+        """解析配置内容用于通知订阅者，yaml和json解析为字典，其他类型返回原文
+
+        Returns:
+          解析结果，配置为空或被删除时返回{}，解析失败时返回None
+        """
+        if not content:
+            return {}
+        if file_type not in ("yaml", "yml", "json"):
+            return content
+        try:
+            if file_type == "json":
+                config = json.loads(content)
             else:
-                info("获取配置失败终止监听,status_code-%s, message-%s",
-                     re.status_code, re.text)
-                break
+                config = yaml.load(content, Loader=yaml.Loader)
+        except Exception:
+            return None
+        return config if config is not None else {}
 
     def __get_data_id(self, env="", file_type="yaml"):
         """获取dataId，用于定位到nacos配置文件
@@ -284,24 +261,95 @@ class Nacos:
         except Exception:
             return {}
 
+    def __load_local_config(self, data_id, group, tenant, file_type="yaml"):
+        """从容灾目录或快照目录读取配置，容灾目录优先
+
+        Returns:
+          配置字典，没有本地配置时返回None
+        """
+        cache_key = group_key(data_id, group, tenant) + ".yml"
+        for base in (DEFAULTS["FAILOVER_BASE"], DEFAULTS["SNAPSHOT_BASE"]):
+            content = files.read_file_str(base, cache_key)
+            if content:
+                logger.info("从本地加载配置: dataId=%s; group=%s; tenant=%s; 目录: %s",
+                            data_id, group, tenant, base)
+                return self.__get_config_dict(content, file_type="yaml")
+        return None
+
     def config(self, app_config, env="", file_type="yaml",
-               group="DEFAULT_GROUP", tenant="dipper", config_name=""):
+               group="DEFAULT_GROUP", tenant="dipper", config_name="", callback=None):
         """开始执行配置读取
            检测本服务配置文件
 
+           本地容灾/快照目录存在配置时，先用本地配置填充app_config并立即返回，
+           在后台线程中从nacos拉取最新配置；否则同步拉取
+
         Args:
           app_config: 应用配置字典
           env: 环境，用于拼接data_id，生成格式为：SERVICE_NAME-env.file_type
           file_type: 文件类型，对应nacos可配置的文件类型，例如json、text、yaml等，默认yaml
           group: group，和nacos中配置对应，默认 DEFAULT_GROUP
           tenant: 租户，和nacos中配置对应，默认 public
-          :param config_name:
+          config_name:
+          callback: 配置变更回调，见subscribe_config，从nacos拉取到配置后注册并立即通知一次
         """
         data_id = self.__get_data_id(env=env, file_type=file_type)
+        local_config = self.__load_local_config(data_id, group, tenant)
+        if local_config:
+            if isinstance(app_config, dict):
+                app_config.update(local_config)
+            th = threading.Thread(target=self.__fetch_config,
+                                  args=(app_config, data_id, file_type, group, tenant, config_name,
+                                        callback),
+                                  daemon=True)
+            th.start()
+            return
+        self.__fetch_config(app_config, data_id, file_type, group, tenant, config_name, callback)
+
+    def subscribe_config(self, data_id, callback, group="DEFAULT_GROUP", tenant="dipper",
+                         file_type="yaml"):
+        """订阅配置变更
+
+        回调参数为ConfigChange，包含解析后的配置以及相对上一次通知的key级差异(嵌套字典按点分隔展开)，
+        在CALLBACK_THREAD_NUM个线程的线程池中执行，慢的回调不会阻塞长轮询；
+        配置已在监听中时立即以当前配置通知一次，否则在首次拉取到配置后通知
+
+        Args:
+          data_id: 配置的dataId
+          callback: 回调方法，参数为ConfigChange
+          group: group，默认 DEFAULT_GROUP
+          tenant: 租户，默认 dipper
+          file_type: 文件类型，yaml/yml/json解析为字典，其他类型以原文通知
+
+        Returns:
+          配置key (dataId, group, tenant)
+        """
+        sub = self.config_listener.get(data_id, group, tenant)
+        if sub is not None and sub.content is not None:
+            current = self.__parse_config(sub.content, sub.file_type)
+            self.config_dispatcher.add(sub.key, callback, current={} if current is None else current)
+        else:
+            # md5为空，首次长轮询即返回变更并拉取配置
+            sub = self.config_listener.add(data_id, group, tenant, file_type=file_type)
+            self.config_dispatcher.add(sub.key, callback)
+        self.config_listener.start()
+        return sub.key
+
+    def unsubscribe_config(self, data_id, callback=None, group="DEFAULT_GROUP", tenant="dipper"):
+        """注销配置变更回调，callback为空时注销该配置的全部回调，配置本身继续监听
+
+        Returns:
+          注销的回调数
+        """
+        return self.config_dispatcher.remove((data_id, group, tenant), callback)
+
+    def __fetch_config(self, app_config, data_id, file_type, group, tenant, config_name, callback=None):
+        """从nacos拉取配置，保存快照并加入监听
+        """
         logger.info("正在获取配置: dataId=" +
                     data_id + "; group=" + group + "; tenant=" + tenant)
-        get_config_url = self.__wrap_auth_url(
-            "http://" + self.__get_host().host + "/nacos/v1/cs/configs")
+        client = self.__get_host()
+        get_config_url = self.__host_url(client, "/nacos/v1/cs/configs")
         params = {
             "dataId": "*" + data_id + "*",
             "group": group,
@@ -315,106 +363,249 @@ class Nacos:
                 "username": 'nacos',
                 "search": "blur"
             }
+        # 不需要认证时链接中没有accessToken，查询参数不能直接拼接在"&"之后
+        accurate_params = {"dataId": data_id, "group": "", "search": "accurate",
+                           "username": "nacos", "pageNo": 1, "pageSize": 10}
         try:
-            get_config_url = get_config_url + "&dataId=" + data_id + "&group=&search=accurate&username=nacos&pageNo=1&pageSize=10"
-            re = requests.get(get_config_url)
+            with client.track():
+                re = util.session_for_url(get_config_url).get(
+                    get_config_url, params=accurate_params, timeout=DEFAULTS["TIMEOUT"])
             if re.status_code != 200:
                 logger.warning("配置获取失败：dataId=" +
                                data_id + "; group=" + group + "; tenant=" + tenant)
+                self.__listen_unfetched_config(app_config, data_id, file_type, group, tenant,
+                                               callback)
                 return
             logging.info("[Nacos] config: %s", re.text)
             nacos_json = self.__get_config_dict(re.text, file_type=file_type)
-            md5 = hashlib.md5()
-            md5.update(re.content)
-            md5_content = md5.hexdigest()
+            page_item = nacos_json.get('pageItems')[0]
+            content = page_item['content']
+            md5_content = content_md5(content)
             dk = data_id + "\001" + group + "\001" + tenant + "\001" + md5_content
             self._config_dict[dk] = app_config
-            config_info = self.__get_config_dict(nacos_json.get('pageItems')[0]['content'], file_type='yaml')
+            config_info = self.__get_config_dict(content, file_type='yaml')
             cache_key = group_key(data_id, group, tenant) + ".yml"
             files.save_file(DEFAULTS['SNAPSHOT_BASE'], cache_key, config_info)
-            # for item in nacos_json:
-            #     app_config[item] = nacos_json[item]
+            if isinstance(app_config, dict) and isinstance(config_info, dict):
+                app_config.update(config_info)
             logger.info("配置获取成功：dataId=%s; group=%s; tenant=%s",
                         data_id, group, tenant)
-            self.config_thread = threading.Thread(
-                target=self.__config_listening_thread_run,
-                args=(data_id, group, tenant, md5_content, nacos_json))
-            self._thread_healthy_dict[data_id + group + tenant] = int(time.time())
-            self.config_thread.start()
+            # 加入批量监听，所有配置共用一个长轮询线程
+            sub = self.config_listener.add(
+                page_item.get('dataId', data_id), page_item.get('group', group),
+                page_item.get('tenant', tenant), md5=md5_content, content=content,
+                file_type=file_type,
+                app_config=app_config if isinstance(app_config, dict) else None)
+            if callback is not None:
+                current = self.__parse_config(content, file_type)
+                self.config_dispatcher.add(sub.key, callback, current={} if current is None else current)
+            self.config_listener.start()
         except Exception:
             logger.exception("配置获取失败：dataId=" +
                              data_id + "; group=" + group + "; tenant=" + tenant, exc_info=True)
+            self.__listen_unfetched_config(app_config, data_id, file_type, group, tenant, callback)
+
+    def __listen_unfetched_config(self, app_config, data_id, file_type, group, tenant, callback=None):
+        """拉取配置失败时仍加入监听，由长轮询与服务端对齐
 
-    def __register_beat_thread_run(self, service_ip, service_port, service_name,
-                                   group_name, namespace_id, metadata, weight):
-        """"
-        注册心跳检测
+        md5为空：服务端存在该配置时首次长轮询即返回变更并拉取；服务端不存在时继续使用本地配置，
+        配置发布后再拉取，不会用空配置覆盖本地快照
         """
-        beat_json = {
-            "ip": service_ip,
-            "port": service_port,
-            "serviceName": service_name,
-            "metadata": metadata,
-            #            "scheduled": "true",
-            "weight": weight
-        }
-        params_beat = {
+        try:
+            sub = self.config_listener.add(
+                data_id, group, tenant, file_type=file_type,
+                app_config=app_config if isinstance(app_config, dict) else None)
+            self._config_dict[data_id + "\001" + group + "\001" + tenant + "\001"] = app_config
+            if callback is not None:
+                self.config_dispatcher.add(sub.key, callback)
+            self.config_listener.start()
+            logger.info("配置获取失败，已加入监听等待重试：dataId=%s; group=%s; tenant=%s",
+                        data_id, group, tenant)
+        except Exception:
+            logger.exception("配置加入监听失败：dataId=%s; group=%s; tenant=%s",
+                             data_id, group, tenant, exc_info=True)
+
+    def __send_beat(self, info: BeatInfo):
+        """发送一次心跳，供心跳调度器调用
+
+        Returns:
+          心跳结果字典，请求失败时返回None
+        """
+        # 先获取token再借出客户端，获取token失败时不会占用探测名额
+        access_token = self.__get_token()
+        client = self.__get_host()
+        start = time.perf_counter()
+        try:
+            re = client.beat(access_token=access_token, params=info.beat_params)
+        except Exception:
+            BEAT_FAILURES.inc(host=client.host, reason="error")
+            raise
+        finally:
+            BEAT_SECONDS.observe(time.perf_counter() - start, host=client.host)
+        if re is None:
+            BEAT_FAILURES.inc(host=client.host, reason="error")
+            logger.warning("[Nacos] 心跳请求失败: %s", info.key)
+            return None
+        if re.status_code == 403:
+            BEAT_FAILURES.inc(host=client.host, reason="forbidden")
+            self.__refresh_token()
+            logger.info("[Nacos] 重新刷新token结果: %s", self.access_token)
+            return None
+        if re.status_code != 200:
+            BEAT_FAILURES.inc(host=client.host, reason="status")
+            logger.warning("[Nacos] 心跳请求失败: %s", re.text)
+            return None
+        result = re.json()
+        if result.get("code") not in (CODE_OK, CODE_RESOURCE_NOT_FOUND):
+            BEAT_FAILURES.inc(host=client.host, reason="code")
+            logger.warning("[Nacos] 心跳请求失败: %s", re.text)
+        return result
+
+    def __register_instance(self, info: BeatInfo):
+        """按保存的注册参数注册实例
+
+        Returns:
+          是否注册成功
+        """
+        try:
+            access_token = self.__get_token()
+            re = self.__get_host().regist_service(
+                access_token=access_token, params=info.register_params)
+            if re == "ok":
+                info.last_beat = int(time.time())
+                return True
+            logger.error("服务注册失败 %s", re)
+        except ForbiddenException:
+            self.__refresh_token()
+        except Exception:
+            logger.exception("服务注册失败", exc_info=True)
+        return False
+
+    def __query_instances(self, service_name, group_name, cluster_name):
+        """从nacos拉取服务的全部实例，供实例缓存刷新使用
+        """
+        client = self.__get_host()
+        instance_url = self.__host_url(client, "/nacos/v1/ns/instance/list")
+        params = {
             "serviceName": service_name,
             "groupName": group_name,
-            "namespaceId": namespace_id,
-            "beat": urllib.request.quote(json.dumps(beat_json))
+            "clusters": cluster_name,
+            "namespaceId": "",
+            "healthyOnly": "false"
         }
+        if self.push_receiver is not None:
+            # 携带udp端口向服务端订阅实例变化推送
+            params["udpPort"] = self.push_receiver.port
+            params["clientIP"] = self.push_client_ip
+        with client.track():
+            re = util.session_for_url(instance_url).get(
+                instance_url, params=params, timeout=DEFAULTS["TIMEOUT"])
+        if re.status_code == 403:
+            self.__refresh_token()
+        if re.status_code != 200:
+            logger.warning("获取服务实例失败：serviceName=%s; clusterName=%s; groupName=%s; status_code=%s",
+                           service_name, cluster_name, group_name, re.status_code)
+            return None
+        logger.debug("[Nacos] server: %s", re.text)
+        return re.json()
+
+    def __on_instance_push(self, key, service_info):
+        """UDP推送回调，推送的实例列表直接写入缓存
+        """
+        self.service_cache.put(key, service_info.get("hosts") or [],
+                               service_info.get("lastRefTime", 0),
+                               service_info.get("cacheMillis", 0))
 
-        while True:
-            self._register_dict[REGISTER_DICT_KEY] = int(time.time())
-            try:
-                time.sleep(BEAT_TIME)
-                re = self.__get_host().beat(
-                    access_token=self.access_token, params=params_beat)
-                if (re is None or re.status_code != 200
-                        or re.json()["code"] != 10200):
-                    self._register_dict[REGISTER_DICT_KEY] = int(time.time()) - 10
-                    logger.warning("[Nacos] 心跳请求失败: %s", (re and re.text))
-
-                if re is not None and re.status_code == 403:
-                    self.__refresh_token()
-                    logger.info("[Nacos] 重新刷新token结果: %s", self.access_token)
-            except json.JSONDecodeError:
-                self._register_dict[REGISTER_DICT_KEY] = int(time.time()) - 10
-                break
-            except Exception:
-                logger.exception("服务心跳维持失败！", exc_info=True)
-                break
+    def enable_push(self, port=0, client_ip=""):
+        """开启UDP推送接收，之后查询的服务实例变化时由服务端主动推送
 
-    def get_server_instance(self, service_name, cluster_name='DEFAULT', group_name='DEFAULT_GROUP'):
-        # DEFAULT_GROUP@@naas-ai
+        Args:
+          port: 本地UDP端口，0表示随机端口
+          client_ip: 服务端回推的本机ip，默认自动获取
+        """
+        if self.push_receiver is not None:
+            return self.push_receiver.port
+        self.push_client_ip = client_ip or util.get_host_ip()
+        self.push_receiver = PushReceiver(on_push=self.__on_instance_push, port=port)
+        self.push_receiver.start()
+        # 已缓存的服务立即刷新一次，完成订阅
+        for key in self.service_cache.keys():
+            self.service_cache.refresh(key)
+        return self.push_receiver.port
+
+    def get_server_instances(self, service_name, cluster_name='DEFAULT',
+                             group_name='DEFAULT_GROUP', healthy_only=True):
+        """获取服务实例列表，优先读取本地缓存
 
-        instance_url = self.__wrap_auth_url(
-            "http://" + self.__get_host().host + "/nacos/v1/ns/catalog/instances")
-        instance_url = instance_url + "&serviceName=" + service_name + "&clusterName=" + cluster_name + "&groupName=" + group_name + "&pageSize=10&pageNo=1&namespaceId="
-        re = requests.get(instance_url)
-        if re.status_code != 200:
-            logger.warning("获取服务实例失败：serviceName=" +
-                           service_name + "; clusterName=" + cluster_name + "; groupName=" + group_name)
-            return
-        logging.info("[Nacos] server: %s", re.text)
-        # 解析JSON数据
-        data = json.loads(re.text)
-
-        # 获取列表中第一个元素
-        first_element = data['list'][0]
-
-        # 检查healthy字段的值
-        if first_element['healthy']:
-            # 获取IP和端口
-            ip = first_element['ip']
-            port = first_element['port']
-            # 打印IP和端口
-            print("IP:", ip)
-            print("Port:", port)
-            return "http://" + str(ip) + ":" + str(port)
-        else:
-            print("No healthy instance found.")
+        Args:
+          service_name: 服务名称
+          cluster_name: 集群名称，默认 DEFAULT
+          group_name: 分组，默认 DEFAULT_GROUP
+          healthy_only: 是否只返回健康且启用的实例
+
+        Returns:
+          实例字典列表，nacos不可用时返回最近一次缓存的结果
+        """
+        instances = self.service_cache.get(service_name, group_name, cluster_name)
+        if instances is None:
+            return []
+        return instances.healthy_hosts() if healthy_only else instances.hosts
+
+    def get_selector(self, service_name, cluster_name='DEFAULT', group_name='DEFAULT_GROUP',
+                     strategy=balancer.WEIGHTED_RANDOM) -> balancer.Selector:
+        """获取服务的实例选择器，实例列表变化时自动重建
+
+        Args:
+          service_name: 服务名称
+          cluster_name: 集群名称，默认 DEFAULT
+          group_name: 分组，默认 DEFAULT_GROUP
+          strategy: 负载均衡策略，见balancer.STRATEGIES
+
+        Returns:
+          Selector对象
+        """
+        instances = self.service_cache.get(service_name, group_name, cluster_name)
+        key = (service_name, group_name, cluster_name, strategy)
+        version = instances.version if instances is not None else 0
+        hosts = instances.hosts if instances is not None else []
+        with self._selector_lock:
+            entry = self._selector_dict.get(key)
+            if entry is None:
+                entry = [version, balancer.create_selector(strategy, hosts)]
+                self._selector_dict[key] = entry
+            elif entry[0] != version:
+                entry[1].update(hosts)
+                entry[0] = version
+            return entry[1]
+
+    def select_instance(self, service_name, cluster_name='DEFAULT', group_name='DEFAULT_GROUP',
+                        strategy=balancer.WEIGHTED_RANDOM, key=None) -> t.Optional[dict]:
+        """按负载均衡策略选择一个健康实例
+
+        Args:
+          strategy: 负载均衡策略，默认按权重随机
+          key: 一致性哈希使用的key
+
+        Returns:
+          实例字典，没有可用实例时返回None
+        """
+        return self.get_selector(service_name, cluster_name, group_name,
+                                 strategy).pick(key)
+
+    def get_server_instance(self, service_name, cluster_name='DEFAULT', group_name='DEFAULT_GROUP',
+                            strategy=balancer.WEIGHTED_RANDOM, key=None):
+        """获取一个健康的服务实例地址
+
+        Returns:
+          形如 http://ip:port 的地址，没有健康实例时返回None
+        """
+        # DEFAULT_GROUP@@naas-ai
+        host = self.select_instance(service_name, cluster_name, group_name, strategy, key)
+        if host is None:
+            logger.warning("没有健康的服务实例：serviceName=%s; clusterName=%s; groupName=%s",
+                           service_name, cluster_name, group_name)
+            return None
+        return "http://" + str(host['ip']) + ":" + str(host['port'])
 
     def register_service(self, service_ip,
                          service_name, service_port=80, namespace_id="dipper",
@@ -437,6 +628,7 @@ class Nacos:
           enabled: 是否启用 默认True
         """
         service_ip = service_ip or util.get_host_ip()
+        # 记录最近一次注册的服务，用于拼接配置的dataId
         self._register_dict["serviceIp"] = service_ip
         self._register_dict["servicePort"] = service_port
         self._register_dict["serviceName"] = service_name
@@ -448,8 +640,6 @@ class Nacos:
         self._register_dict["weight"] = weight
         self._register_dict["enabled"] = enabled
 
-        self._register_dict["healthy"] = int(time.time())
-
         params = {
             "ip": service_ip,
             "port": service_port,
@@ -462,22 +652,72 @@ class Nacos:
             "weight": weight,
             "enabled": enabled
         }
+        beat_json = {
+            "ip": service_ip,
+            "port": service_port,
+            "serviceName": service_name,
+            "cluster": cluster_name,
+            "metadata": metadata,
+            #            "scheduled": "true",
+            "weight": weight
+        }
+        params_beat = {
+            "serviceName": service_name,
+            "groupName": group_name,
+            "namespaceId": namespace_id,
+            "beat": urllib.request.quote(json.dumps(beat_json))
+        }
+        key = instance_key(namespace_id, group_name, service_name, service_ip, service_port)
+        info = BeatInfo(key, params, params_beat)
+        if self.__register_instance(info):
+            logger.info("服务注册成功。")
+            # 同一实例重复注册只会替换心跳信息，所有实例共用一个心跳线程
+            self.beat_reactor.add(info)
+            return True
+        return False
+
+    def deregister_service(self, service_ip, service_name, service_port=80,
+                           namespace_id="dipper", group_name="DEFAULT_GROUP",
+                           cluster_name="DEFAULT", ephemeral=True):
+        """注销服务，停止心跳并从nacos删除实例
+
+        Returns:
+          是否注销成功
+        """
+        service_ip = service_ip or util.get_host_ip()
+        self.beat_reactor.remove(
+            instance_key(namespace_id, group_name, service_name, service_ip, service_port))
+        params = {
+            "ip": service_ip,
+            "port": service_port,
+            "serviceName": service_name,
+            "namespaceId": namespace_id,
+            "groupName": group_name,
+            "clusterName": cluster_name,
+            "ephemeral": ephemeral
+        }
         try:
-            re = self.__get_host().regist_service(
-                access_token=self.access_token, params=params)
+            access_token = self.__get_token()
+            re = self.__get_host().deregister_service(
+                access_token=access_token, params=params)
             if re == "ok":
-                logger.info("服务注册成功。")
-                beat_thread = threading.Thread(
-                    target=self.__register_beat_thread_run,
-                    args=(service_ip, service_port, service_name,
-                          group_name, namespace_id, metadata, weight))
-                beat_thread.start()
-            else:
-                logger.error("服务注册失败 %s", re)
+                logger.info("服务注销成功: %s", service_name)
+                return True
+            logger.error("服务注销失败 %s", re)
         except ForbiddenException:
             self.__refresh_token()
         except Exception:
-            logger.exception("服务注册失败", exc_info=True)
+            logger.exception("服务注销失败", exc_info=True)
+        return False
+
+    def registered_instances(self):
+        """当前客户端注册的全部实例
+
+        Returns:
+          [{"key": 实例key, "interval": 心跳间隔, "lastBeat": 最近心跳成功时间}]
+        """
+        return [{"key": info.key, "interval": info.interval, "lastBeat": info.last_beat}
+                for info in self.beat_reactor.entries()]
 
 
 def default_fallback_fun():
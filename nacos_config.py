@@ -8,4 +8,37 @@ service_name = 'service_name'
 GlobalConfig = {}
 # 服务注册的ip和端口,如果为空或者localhost，则使用本机ip和端口
 server_ip = '127.0.0.1'
-server_port = 0
\ No newline at end of file
+server_port = 0
+# 训练任务队列：同时训练的进程数、排队上限、训练进程绑定的CPU编号(如[0, 1, 2, 3])，None表示不限制
+train_workers = 1
+train_queue_size = 4
+train_cpu_affinity = None
+# 模型缓存：最多缓存的模型数、模型文件总大小上限(字节)、启动时是否预加载最新的模型
+model_cache_size = 8
+model_cache_bytes = 2 * 1024 ** 3
+model_warmup = True
+# 流式预测时每块的行数
+predict_chunk_rows = 50000
+# 模型选择：随机划分的候选数、k折交叉验证折数(大于1时代替随机划分)、同时训练的候选数(None表示按线程数自动)、
+# 最大迭代轮数、早停轮数
+train_candidates = 10
+train_cv_folds = 0
+train_parallel_fits = None
+train_max_rounds = 400
+train_early_stopping_rounds = 50
+# 增量训练时在基础模型上最多新增的迭代轮数
+train_warm_start_rounds = 100
+# 预测合批：是否开启、一批最多的行数、请求最长等待合批的时间(秒)
+predict_batching = True
+predict_batch_rows = 65536
+predict_batch_latency = 0.005
+# 日志：是否由后台线程写日志、是否输出JSON格式、单条日志最大字符数、每秒最多输出的超长日志条数
+log_queue = True
+log_json = False
+log_max_length = 4096
+log_large_per_second = 5
+# 性能分析：是否记录每个/predict请求的阶段耗时、按比例抽样进行cProfile分析(0~1)、最多保留的结果数；
+# 请求头X-Profile为timing/cprofile/pyinstrument时对该请求进行相应的分析
+profile_timing = False
+profile_sample_rate = 0.0
+profile_keep = 50
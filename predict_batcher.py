@@ -0,0 +1,196 @@
+"""
+预测请求合批，并发请求对同一模型的预测在很短的时间窗口内合并为一次predict，再把结果拆分返回.
+"""
+import threading
+import time
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import gevent
+except ImportError:  # pragma: no cover
+    gevent = None
+
+import common_log
+
+log = common_log.get_log('server.log', 'debug')
+
+
+class _Request:
+    __slots__ = ("x", "future", "created")
+
+    def __init__(self, x: np.ndarray):
+        self.x = x
+        self.future = Future()
+        self.created = time.monotonic()
+
+
+def _wait(future: Future):
+    # gevent未打补丁时直接阻塞会卡住整个事件循环，改为在gevent线程池中等待
+    if gevent is not None and isinstance(gevent.getcurrent(), gevent.Greenlet):
+        return gevent.get_hub().threadpool.apply(future.result)
+    return future.result()
+
+
+class PredictBatcher:
+    """
+    预测合批器
+
+    每个模型一个等待队列，由后台线程合并：队列中的行数达到max_batch_rows、最早的请求等待超过max_latency，
+    或者该模型所有活跃会话都已提交请求时，合并为一个矩阵，交给max_workers个线程的线程池调用一次predict_fn，
+    再按行拆分给各个请求，不同模型的批次可以同时执行；
+    单个请求超过max_batch_rows时不合批，直接预测
+    """
+
+    def __init__(self, predict_fn, max_batch_rows=65536, max_latency=0.005, max_workers=4):
+        """
+        Args:
+          predict_fn: 预测方法，参数为(model, 特征矩阵)，返回一维预测结果，需要线程安全
+          max_batch_rows: 一批最多的行数
+          max_latency: 请求最长等待合批的时间，单位秒
+          max_workers: 同时执行的批次数
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_latency = max_latency
+        self.max_workers = max_workers
+        self._executor: t.Optional[ThreadPoolExecutor] = None
+        # id(model) -> (model, 等待中的请求)
+        self._queues: t.Dict[int, t.Tuple[t.Any, t.List[_Request]]] = {}
+        # id(model) -> 活跃会话数
+        self._active: t.Dict[int, int] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+
+    @contextmanager
+    def session(self, model):
+        """
+        声明一个会持续提交预测的调用方(如一次多步预测)，合批时等到所有活跃会话都提交后立即执行，
+        只有一个调用方时不必等待max_latency；
+        会话期间应连续提交，不能在会话内等待客户端等外部事件，否则同模型的其他请求每一步都要等满max_latency
+        """
+        key = id(model)
+        with self._cond:
+            self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                count = self._active.get(key, 0) - 1
+                if count > 0:
+                    self._active[key] = count
+                else:
+                    self._active.pop(key, None)
+                self._cond.notify()
+
+    def predict(self, model, x: np.ndarray) -> np.ndarray:
+        """
+        提交预测并等待结果
+
+        Returns:
+          与x行数相同的预测结果
+        """
+        if len(x) >= self.max_batch_rows:
+            return self.predict_fn(model, x)
+        request = _Request(x)
+        key = id(model)
+        with self._cond:
+            self._ensure_started()
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = (model, [])
+            queue[1].append(request)
+            self._cond.notify()
+        return _wait(request.future)
+
+    def _ensure_started(self):
+        if self._running and self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="predict-batch")
+        self._thread = threading.Thread(target=self._run, name="predict-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _ready(self, key, requests: t.List[_Request], now) -> float:
+        """
+        Returns:
+          0表示可以执行，否则为还需等待的秒数
+        """
+        if sum(len(r.x) for r in requests) >= self.max_batch_rows:
+            return 0
+        if len(requests) >= self._active.get(key, 0):
+            return 0
+        return max(0.0, requests[0].created + self.max_latency - now)
+
+    def _take(self):
+        """
+        取出一批可以执行的请求，没有时等待
+        """
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                timeout = None
+                for key, (model, requests) in list(self._queues.items()):
+                    remain = self._ready(key, requests, now)
+                    if remain == 0:
+                        batch, rows = [], 0
+                        while requests and (not batch or rows + len(requests[0].x) <= self.max_batch_rows):
+                            rows += len(requests[0].x)
+                            batch.append(requests.pop(0))
+                        if not requests:
+                            del self._queues[key]
+                        return model, batch
+                    timeout = remain if timeout is None else min(timeout, remain)
+                self._cond.wait(timeout)
+        return None, []
+
+    def _run(self):
+        while self._running:
+            model, batch = self._take()
+            if batch:
+                self._executor.submit(self._execute, model, batch)
+
+    def _execute(self, model, batch: t.List[_Request]):
+        try:
+            if len(batch) == 1:
+                results = [self.predict_fn(model, batch[0].x)]
+            else:
+                x = np.concatenate([r.x for r in batch])
+                y = self.predict_fn(model, x)
+                offsets = np.cumsum([len(r.x) for r in batch])[:-1]
+                results = np.split(y, offsets)
+        except Exception as e:
+            for r in batch:
+                r.future.set_exception(e)
+            return
+        with self._cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.rows += sum(len(r.x) for r in batch)
+        for r, y in zip(batch, results):
+            r.future.set_result(y)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "rows": self.rows,
+            "avgRequestsPerBatch": round(self.requests / self.batches, 3) if self.batches else 0,
+            "maxBatchRows": self.max_batch_rows,
+            "maxLatency": self.max_latency,
+            "maxWorkers": self.max_workers,
+        }
@@ -1,15 +1,28 @@
+import collections
+import itertools
 import os
 import random
+import threading
 import time
+import typing as t
 
-import joblib
 import numpy as np
 import pandas as pd
 import requests
 import xgboost as xgb
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from urllib.parse import quote
-from sklearn.model_selection import (train_test_split)
+from sklearn.model_selection import KFold, train_test_split
 
+import common_log
+import model_io
+import model_meta
+import profiling
+import result_stream
+from model_cache import ModelCache
+from predict_batcher import PredictBatcher
+
+log = common_log.get_log('server.log', 'debug')
 
 # 定义实验目录
 path = 'dic/'
@@ -17,6 +30,12 @@ path = 'dic/'
 data_path = path + 'data/VAI_20231023_000120231025110813.csv'
 # 定义结果路径
 result_path = path + 'results/'
+# 定义模型路径
+model_dir = path + 'models/'
+# 模型缓存，避免每次预测都反序列化模型
+model_cache = ModelCache()
+# 流式预测时每块的行数
+predict_chunk_rows = 50000
 
 
 # '''准确率计算'''
@@ -35,110 +54,379 @@ def get_accuracy(y_true: np.array, y_pred: np.array):
     return acc
 
 
-def xgb_predict_building(X_train: np.array, X_test: np.array, y_train: np.array, y_test: np.array, iteration: int):
+def xgb_predict_building(X_train: np.array, X_test: np.array, y_train: np.array, y_test: np.array, iteration: int,
+                         n_jobs=30, n_estimators=400, early_stopping_rounds=50, xgb_model=None):
     """
     模型训练
     :param X_train:训练集
-    :param X_test:测试集
+    :param X_test:测试集，同时作为早停的验证集
     :param y_train:训练标签
     :param y_test:测试标签
-    :return:
+    :param n_jobs: 训练使用的线程数
+    :param n_estimators: 最大迭代轮数
+    :param early_stopping_rounds: 验证集误差连续多少轮不下降则停止，为空时不早停
+    :param xgb_model: 增量训练的基础模型，在其基础上继续迭代n_estimators轮
+    :return: (模型, 准确率)
     """
     xgb_regressor = xgb.XGBRegressor(learning_rate=0.01,
-                                     n_estimators=400,
+                                     n_estimators=n_estimators,
                                      max_depth=7,
-                                     n_jobs=30,
-                                     min_child_weight=1)
+                                     n_jobs=n_jobs,
+                                     min_child_weight=1,
+                                     early_stopping_rounds=early_stopping_rounds or None)
 
-    xgb_regressor.fit(X_train, y_train)
+    xgb_regressor.fit(X_train, y_train, eval_set=[(X_test, y_test)], verbose=False, xgb_model=xgb_model)
 
-    # 打印出当前迭代轮次
-    print("第{}轮迭代".format(iteration + 1))
-    y_pred = xgb_regressor.predict(X_test)
+    y_pred = predict_rows(xgb_regressor, X_test)
     acc_30 = get_accuracy(y_test, y_pred)
-    print("准确率:", acc_30)
-    print("预测值:", y_pred)
-    return xgb_regressor, str(acc_30)
+    log.info("第%s轮迭代, 准确率: %s, 迭代轮数: %s", iteration + 1, acc_30, _best_rounds(xgb_regressor))
+    return xgb_regressor, acc_30
+
+
+def _booster(model) -> t.Optional[xgb.Booster]:
+    if hasattr(model, 'get_booster'):
+        return model.get_booster()
+    if isinstance(model, xgb.Booster):
+        return model
+    return None
+
+
+def _best_iteration(model) -> t.Optional[int]:
+    """
+    训练时使用了早停则返回最优轮次，否则返回None
+    """
+    try:
+        return model.best_iteration
+    except AttributeError:
+        return None
+
+
+def _best_rounds(model) -> int:
+    best = _best_iteration(model)
+    if best is not None:
+        return best + 1
+    return _booster(model).num_boosted_rounds()
+
+
+def _base_booster(model):
+    """
+    增量训练的起点，训练时使用了早停则截掉最优轮次之后的树
+    """
+    booster = _booster(model)
+    best = _best_iteration(model)
+    if booster is None or best is None:
+        return booster
+    return booster[:best + 1]
+
+
+def iter_splits(feature: np.array, label: np.array, candidates=10, cv_folds=0):
+    """
+    生成候选模型的训练集/验证集划分
+    :param candidates: 随机划分的候选数，cv_folds大于1时不使用
+    :param cv_folds: k折交叉验证的折数，大于1时每一折作为一个候选
+    :return: (X_train, X_test, y_train, y_test) 迭代器
+    """
+    if cv_folds and cv_folds > 1:
+        kfold = KFold(n_splits=cv_folds, shuffle=True, random_state=random.randint(0, 100))
+        for train_index, test_index in kfold.split(feature):
+            yield feature[train_index], feature[test_index], label[train_index], label[test_index]
+        return
+    for _ in range(candidates):
+        rs = random.randint(0, 100)
+        yield train_test_split(feature, label, test_size=0.2, random_state=rs)
+
 
+def select_model(feature: np.array, label: np.array, n_jobs=30, candidates=10, cv_folds=0,
+                 parallel=None, n_estimators=400, early_stopping_rounds=50, base_model=None, progress=None):
+    """
+    并行训练多个候选模型，按验证集准确率选出最优模型，训练过程中只保留当前最优的模型
+    :param feature: 特征
+    :param label: 标签
+    :param n_jobs: 总线程数，按并行数平分给每个候选
+    :param candidates: 随机划分的候选数
+    :param cv_folds: k折交叉验证的折数，大于1时每一折作为一个候选
+    :param parallel: 同时训练的候选数，默认为min(候选数, n_jobs)
+    :param n_estimators: 最大迭代轮数
+    :param early_stopping_rounds: 早停轮数
+    :param base_model: 增量训练的基础模型，所有候选都在其基础上继续迭代
+    :param progress: 进度回调，参数为(进度0~1, 说明)
+    :return: (最优模型, 最优准确率, 每个候选的统计列表)
+    """
+    total = cv_folds if cv_folds and cv_folds > 1 else candidates
+    parallel = max(1, min(parallel or n_jobs, total, n_jobs))
+    # 每个候选的线程数
+    threads = max(1, n_jobs // parallel)
+    booster = _base_booster(base_model)
+    lock = threading.Lock()
+    best = {"model": None, "acc": -1.0}
+    stats = []
+
+    def fit(i, split):
+        X_train, X_test, y_train, y_test = split
+        start = time.time()
+        model, acc = xgb_predict_building(X_train, X_test, y_train, y_test, i, n_jobs=threads,
+                                          n_estimators=n_estimators,
+                                          early_stopping_rounds=early_stopping_rounds, xgb_model=booster)
+        stat = {"candidate": i + 1, "accuracy": acc, "rounds": _best_rounds(model),
+                "seconds": round(time.time() - start, 3)}
+        with lock:
+            stats.append(stat)
+            if acc > best["acc"]:
+                best["model"], best["acc"] = model, acc
+            done = len(stats)
+        if progress is not None:
+            progress(done / float(total), "第{}轮迭代, 准确率: {}".format(i + 1, acc))
+        return stat
 
-def model_training(feature: np.array, label: np.array, savePath: str,ai_server: str,project_id:str):
+    log.info("模型选择: 候选数 %s, 并行数 %s, 每个候选线程数 %s", total, parallel, threads)
+    # 划分按需生成，内存中只保留正在训练的候选的训练集/验证集
+    splits = enumerate(iter_splits(feature, label, candidates, cv_folds))
+    if parallel == 1:
+        for i, split in splits:
+            fit(i, split)
+    else:
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="model-select") as executor:
+            running = {executor.submit(fit, i, split) for i, split in itertools.islice(splits, parallel)}
+            try:
+                while running:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    # 完成几个候选再生成几个划分
+                    for i, split in itertools.islice(splits, len(done)):
+                        running.add(executor.submit(fit, i, split))
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+    stats.sort(key=lambda item: item["candidate"])
+    if cv_folds and cv_folds > 1:
+        log.info("%s折交叉验证平均准确率: %s", total,
+                 round(float(np.mean([item["accuracy"] for item in stats])), 6))
+    return best["model"], best["acc"], stats
+
+
+def model_training(feature: np.array, label: np.array, savePath: str, ai_server: str, project_id: str,
+                   n_jobs=30, progress=None, candidates=10, cv_folds=0, parallel=None,
+                   n_estimators=400, early_stopping_rounds=50, base_model_path=None, profile=None):
     """
     模型训练
     :param feature: 特征
     :param label: 标签
+    :param n_jobs: 训练使用的总线程数
+    :param progress: 进度回调，参数为(进度0~1, 说明)
+    :param candidates: 随机划分的候选数
+    :param cv_folds: k折交叉验证的折数，大于1时代替随机划分
+    :param parallel: 同时训练的候选数
+    :param n_estimators: 最大迭代轮数，增量训练时为新增的轮数
+    :param early_stopping_rounds: 早停轮数
+    :param base_model_path: 增量训练的基础模型路径，为空时从头训练
+    :param profile: 性能分析模式，见profiling.MODES，为空时不分析
     :return: 模型路径
     """
-    xgb_regressor = []
-    acc_30 = []
-    # 模型训练
-    for i in range(0, 10):
-        rs = random.randint(0, 100)
-        X_train, X_test, y_train, y_test = train_test_split(
-            feature, label, test_size=0.2, random_state=rs)
-        results = xgb_predict_building(
-            X_train, X_test, y_train, y_test, i)
-        xgb_regressor.append(results[0])
-        acc_30.append(results[1])
-    # 模型保存
-    index = np.argmax(acc_30)
-    joblib.dump(xgb_regressor[index], savePath +
-                '_acc={}.pkl'.format(acc_30[index]))
-    file_path = savePath + '_acc={}.pkl'.format(acc_30[index])
-    file_name = os.path.basename(file_path)
-    requests.get(ai_server + "/updateModel?modelName=" + quote(file_name) + "&projectId=" + project_id)
+    start = time.time()
+    prof = profiling.start('model_training', profile, rows=len(feature), features=feature.shape[1],
+                           baseModel=base_model_path)
+    try:
+        with prof.stage('load_base_model'):
+            base_model = model_io.load_model(base_model_path) if base_model_path else None
+        if base_model is not None:
+            log.info("增量训练，基础模型: %s", base_model_path)
+        with prof.stage('select_model'):
+            model, acc_30, stats = select_model(feature, label, n_jobs=n_jobs, candidates=candidates,
+                                                cv_folds=cv_folds, parallel=parallel, n_estimators=n_estimators,
+                                                early_stopping_rounds=early_stopping_rounds, base_model=base_model,
+                                                progress=progress)
+        for stat in stats:
+            log.info("候选模型 %(candidate)s: 准确率 %(accuracy)s, 迭代轮数 %(rounds)s, 耗时 %(seconds)ss", stat)
+        log.info("模型训练完成, 最优准确率: %s, 总耗时: %.3fs", acc_30, time.time() - start)
+        # 模型保存
+        file_path = savePath + '_acc={}{}'.format(acc_30, model_io.NATIVE_SUFFIX)
+        with prof.stage('save_model'):
+            model_io.save_model(model, file_path)
+        # 特征数即预测时滑动窗口的长度
+        with prof.stage('save_meta'):
+            model_meta.save_meta(file_path, model_meta.build_meta(
+                file_path, rows=len(feature), features=feature.shape[1], accuracy=acc_30,
+                rounds=_best_rounds(model), parent_path=base_model_path, window=feature.shape[1],
+                candidates=stats, seconds=round(time.time() - start, 3)))
+        file_name = os.path.basename(file_path)
+        with prof.stage('notify'):
+            requests.get(ai_server + "/updateModel?modelName=" + quote(file_name) + "&projectId=" + project_id)
+    except BaseException as e:
+        prof.finish(error=str(e))
+        raise
+    # 每个候选的训练耗时见candidates
+    prof.finish(model=file_name, candidates=stats)
+    return file_path
 
 
-# 默认预测1个时间点
-def model_call(model_path: str, path_result: str, key: pd.Series, feature: np.array, num_future_points=1):
+def predict_rows(model, x: np.ndarray) -> np.ndarray:
     """
-    模型调用
-    :param num_future_points: 默认预测1个时间点
-    :param path: 模型路径
-    :param key: 主键
-    :param feature: 特征
-    :return: 无输出
+    单步预测，xgboost模型直接调用booster.inplace_predict，不构造DMatrix，支持切片视图
+    :param model: 模型
+    :param x: 特征，可以是非连续的切片视图
+    :return: 预测结果
+    """
+    booster = _booster(model)
+    if booster is None:
+        return model.predict(x)
+    # 训练时使用了早停则只用最优轮次之前的树，与model.predict保持一致
+    best = _best_iteration(model)
+    iteration_range = (0, best + 1) if best is not None else (0, 0)
+    return booster.inplace_predict(x, iteration_range=iteration_range)
+
+
+# 并发预测请求合批
+predict_batcher = PredictBatcher(predict_rows)
+
+
+def recursive_forecast(model, feature: np.array, num_future_points=1, predict_fn=None) -> np.ndarray:
+    """
+    多步递归预测：每一步去掉最早的一列特征，并把上一步的预测值作为最新的一列特征
+
+    预先分配 (行数, 窗口长度 + 预测步数) 的float32数组，第i步的特征就是第i列开始、长度为窗口的切片视图，
+    预测结果直接写入第 窗口长度+i 列，整个过程不复制特征矩阵
+    :param model: 模型
+    :param feature: 初始特征，(行数, 窗口长度)
+    :param num_future_points: 预测步数
+    :param predict_fn: 单步预测方法，参数为(model, 特征)，默认predict_rows
+    :return: (行数, num_future_points) 的预测结果，是内部数组的视图
+    """
+    predict_fn = predict_fn or predict_rows
+    rows, window = feature.shape
+    buffer = np.empty((rows, window + num_future_points), dtype=np.float32)
+    buffer[:, :window] = feature
+    for i in range(num_future_points):
+        buffer[:, window + i] = predict_fn(model, buffer[:, i:i + window])
+    return buffer[:, window:]
+
+
+def load_model(model_path: str):
+    """
+    从缓存加载模型，model_path为模型目录下的文件名
+    """
+    return model_cache.get(model_dir + model_path)
+
+
+def read_feature_chunks(source, data_index: int, chunk_rows=None, encoding='utf-8',
+                        close_source=False, profile=profiling.NULL_PROFILE) -> t.Iterator[t.Tuple[pd.Series, np.ndarray]]:
+    """
+    按块读取预测数据，只读取cgi列和特征列，特征直接解析为float32
+    :param source: 文件路径或文件流
+    :param data_index: 特征截止列，特征为第1列到data_index-1列
+    :param chunk_rows: 每块的行数，默认predict_chunk_rows
+    :param encoding: 文件编码
+    :param close_source: 读取结束后是否关闭文件流
+    :param profile: 性能分析，读取和切片的耗时分别记入read_csv和slice阶段
+    :return: (cgi, 特征) 迭代器
+    """
+    dtype = collections.defaultdict(lambda: np.float32, cgi=str)
+    try:
+        with profile.stage('read_csv'):
+            reader = pd.read_csv(source, encoding=encoding, usecols=range(int(data_index)), dtype=dtype,
+                                 chunksize=chunk_rows or predict_chunk_rows)
+        with reader:
+            for chunk in profile.wrap('read_csv', reader):
+                with profile.stage('slice'):
+                    batch = chunk['cgi'], chunk.iloc[:, 1:].to_numpy(dtype=np.float32)
+                yield batch
+    finally:
+        if close_source:
+            source.close()
+
+
+def predict_chunks(model, batches: t.Iterable[t.Tuple[pd.Series, np.ndarray]],
+                   num_future_points=1, batching=False) -> t.Iterator[pd.DataFrame]:
+    """
+    逐块进行多步预测，每块生成一个DataFrame，第一列为cgi，之后每列为一个时间点的预测结果
+    :param model: 模型
+    :param batches: (cgi, 特征) 迭代器
+    :param num_future_points: 预测时间点数
+    :param batching: 是否通过predict_batcher与其他并发请求合批预测
+    :return: DataFrame迭代器
+    """
+    columns = [str(i) for i in range(int(num_future_points))]
+    return _predict_chunks(model, batches, int(num_future_points), columns, batching)
+
+
+def forecast(model, feature: np.ndarray, num_future_points=1, batching=False) -> np.ndarray:
+    """
+    对内存中的少量特征直接进行多步预测
+    :param model: 模型
+    :param feature: 特征，(行数, 窗口长度)
+    :param num_future_points: 预测时间点数
+    :param batching: 是否通过predict_batcher与其他并发请求合批预测
+    :return: (行数, num_future_points) 的预测结果
+    """
+    if not batching:
+        return recursive_forecast(model, feature, int(num_future_points))
+    with predict_batcher.session(model):
+        return recursive_forecast(model, feature, int(num_future_points), predict_batcher.predict)
+
+
+def num_features(model) -> t.Optional[int]:
+    """
+    模型的特征数，即滑动窗口长度，无法获取时返回None
     """
-    model_path = './dic/models/' + model_path
-    model = joblib.load(model_path)
-    # 定义存储预测结果的列表
-    future_predictions = []
+    booster = _booster(model)
+    return booster.num_features() if booster is not None else None
 
-    # 复制初始特征数据
-    updated_features = np.copy(feature)
 
-    # 使用循环进行多次预测
-    for i in range(int(num_future_points)):
-        # 进行单个时间点的预测
-        prediction = model.predict(updated_features)
+def _predict_chunks(model, batches, num_future_points, columns, batching=False):
+    for key, feature in batches:
+        if batching:
+            # 合批会话只覆盖一块的多步预测，生成器因客户端读取慢而挂起时不占用会话，不拖慢同模型的其他请求
+            with predict_batcher.session(model):
+                predictions = recursive_forecast(model, feature, num_future_points, predict_batcher.predict)
+        else:
+            predictions = recursive_forecast(model, feature, num_future_points)
+        df = pd.DataFrame(predictions, columns=columns, copy=False)
+        df.insert(0, 'cgi', np.asarray(key))
+        yield df
 
-        # 将预测结果添加到列表中
-        future_predictions.append(prediction)
 
-        # 更新特征数据：去掉原来的第一列，并在末尾添加预测结果
-        updated_features = np.delete(updated_features, 0, axis=1)  # 删除第一列
-        updated_features = np.column_stack((updated_features, prediction))  # 添加预测结果作为新的最后一列
+def iter_predictions(model, key: pd.Series, feature: np.array, num_future_points=1,
+                     chunk_rows=None) -> t.Iterator[pd.DataFrame]:
+    """
+    对内存中的特征按块进行多步预测
+    :param model: 模型
+    :param key: 主键
+    :param feature: 特征
+    :param num_future_points: 预测时间点数
+    :param chunk_rows: 每块的行数，默认predict_chunk_rows
+    :return: DataFrame迭代器
+    """
+    chunk_rows = chunk_rows or predict_chunk_rows
+    keys = np.asarray(key)
+    batches = ((keys[i:i + chunk_rows], feature[i:i + chunk_rows])
+               for i in range(0, len(feature), chunk_rows))
+    return predict_chunks(model, batches, num_future_points)
+
 
-    # 创建一个空的DataFrame用于保存所有时间点的预测结果
-    all_predictions = pd.DataFrame()
-    # 生成时间戳
+def result_file_path(path_result: str, fmt='csv') -> str:
+    """
+    生成带时间戳的结果文件路径
+    """
     file_name_ = time.strftime("%Y%m%d%H%M%S", time.localtime())
-    # 将所有预测结果保存为CSV文件
-    file_path = path_result + str(file_name_) + '.csv'
-    # 将 future_predictions 转换为二维数组
-    array_predictions = np.array(future_predictions)
-    # 转置二维数组
-    transposed_predictions = array_predictions.T
-
-    # 创建 DataFrame
-    df = pd.DataFrame()
-    # 添加 key 列
-    df['cgi'] = key
-    # 将转置后的预测结果添加到 DataFrame 中
-    df = pd.concat([df, pd.DataFrame(transposed_predictions)], axis=1)
-
-    # 将 DataFrame 写入文件
-    df.to_csv(file_path, index=False)
-    result = pd.read_csv(file_path, encoding='utf-8')
+    return path_result + str(file_name_) + result_stream.file_suffix(fmt)
+
+
+# 默认预测1个时间点
+def model_call(model_path: str, path_result: str, key: pd.Series, feature: np.array, num_future_points=1):
+    """
+    模型调用，预测结果写入结果目录
+    :param num_future_points: 默认预测1个时间点
+    :param path: 模型路径
+    :param key: 主键
+    :param feature: 特征
+    :return: 结果文件路径
+    """
+    model = load_model(model_path)
+    file_path = result_file_path(path_result)
+    chunks = iter_predictions(model, key, feature, num_future_points)
+    for _ in result_stream.encode(chunks, 'csv', save_path=file_path):
+        pass
     return file_path
 
 
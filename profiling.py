@@ -0,0 +1,294 @@
+"""
+热点路径性能分析，记录请求和训练各阶段的耗时，可选附带cProfile或pyinstrument的分析结果，
+结果以JSON文件保存在profile_dir中，训练子进程写入的结果同样可以通过接口查看.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import typing as t
+import uuid
+from contextlib import contextmanager
+
+try:
+    import pyinstrument
+except ImportError:  # pragma: no cover
+    pyinstrument = None
+
+import common_log
+
+log = common_log.get_log('server.log', 'debug')
+
+# 分析模式：只记录阶段耗时 / 阶段耗时加cProfile / 阶段耗时加pyinstrument
+TIMING = "timing"
+CPROFILE = "cprofile"
+PYINSTRUMENT = "pyinstrument"
+MODES = (TIMING, CPROFILE, PYINSTRUMENT)
+
+# 结果保存目录
+profile_dir = 'dic/profiles/'
+# 最多保留的结果数，超过时删除最早的
+profile_keep = 50
+# cProfile结果输出的函数数
+profile_top = 40
+
+# 同一时间只允许一个分析器运行，Python 3.12起同一线程上不能同时启用两个cProfile
+_profiler_lock = threading.Lock()
+
+
+def choose_mode(requested: t.Optional[str], timing=False, sample_rate=0.0) -> t.Optional[str]:
+    """
+    确定本次请求的分析模式
+
+    Args:
+      requested: 请求中指定的模式，如X-Profile请求头，为空时按配置决定
+      timing: 未指定时是否记录阶段耗时
+      sample_rate: 未指定时按此比例抽样进行cProfile分析
+
+    Returns:
+      分析模式，不分析时返回None
+    """
+    if requested:
+        requested = requested.strip().lower()
+        if requested in ("1", "true", "yes"):
+            return TIMING
+        return requested if requested in MODES else None
+    if sample_rate and random.random() < sample_rate:
+        return CPROFILE
+    return TIMING if timing else None
+
+
+class Profile:
+    """
+    一次请求或训练的性能分析
+
+    阶段耗时为独占时间，嵌套阶段的耗时不计入外层阶段，流式响应中逐块拉取的各层生成器用wrap包装后，
+    读取、预测、编码的耗时可以分开统计；
+    cProfile和pyinstrument从创建到finish期间一直运行，只分析当前线程，gevent下同一线程上其他请求的调用也会计入
+    """
+
+    def __init__(self, name, mode=TIMING, **extra):
+        """
+        Args:
+          name: 名称，如接口路径
+          mode: 分析模式
+          extra: 其他需要记录的信息
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.mode = mode
+        self.extra = dict(extra)
+        self.stages: t.Dict[str, float] = {}
+        self.created = time.time()
+        self._start = time.perf_counter()
+        # 线程id -> 各层阶段中子阶段的耗时
+        self._stacks: t.Dict[int, t.List[float]] = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._finished = False
+        if mode in (CPROFILE, PYINSTRUMENT):
+            self._start_profiler(mode)
+
+    def _start_profiler(self, mode):
+        if mode == PYINSTRUMENT and pyinstrument is None:
+            self.extra["profilerError"] = "pyinstrument未安装，请先安装：pip install pyinstrument"
+            self.mode = TIMING
+            return
+        if not _profiler_lock.acquire(blocking=False):
+            # 其他请求正在分析，本次只记录阶段耗时
+            self.extra["profilerError"] = "busy"
+            self.mode = TIMING
+            return
+        if mode == CPROFILE:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+
+    def _stop_profiler(self) -> t.Optional[str]:
+        if self._profiler is None:
+            return None
+        try:
+            if self.mode == CPROFILE:
+                self._profiler.disable()
+                out = io.StringIO()
+                pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(profile_top)
+                return out.getvalue()
+            self._profiler.stop()
+            return self._profiler.output_text(unicode=True)
+        finally:
+            self._profiler = None
+            _profiler_lock.release()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        记录一个阶段的耗时，同名阶段累加
+        """
+        stack = self._stacks.setdefault(threading.get_ident(), [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            child = stack.pop()
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed - child
+            if stack:
+                stack[-1] += elapsed
+
+    def add(self, name, seconds):
+        """
+        直接累加一个阶段的耗时
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def wrap(self, name, iterable: t.Iterable) -> t.Iterator:
+        """
+        包装生成器，每次取下一项的耗时计入name阶段
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def finish(self, rest=None, **extra) -> dict:
+        """
+        结束分析并保存结果，重复调用只保存一次
+
+        Args:
+          rest: 总耗时减去各阶段耗时的剩余部分记入的阶段名，如响应发送
+          extra: 其他需要记录的信息
+
+        Returns:
+          分析结果
+        """
+        seconds = time.perf_counter() - self._start
+        if self._finished:
+            return self.to_dict(seconds)
+        self._finished = True
+        self.extra.update(extra)
+        if rest:
+            self.stages[rest] = max(0.0, seconds - sum(self.stages.values()))
+        profile = self._stop_profiler()
+        record = self.to_dict(seconds)
+        record["profile"] = profile
+        try:
+            save(record)
+        except OSError:
+            log.exception("性能分析结果保存失败", exc_info=True)
+        log.info("性能分析 %s %s: 总耗时 %.3fs, 各阶段: %s", self.name, self.id, seconds,
+                 ", ".join("%s=%.3fs" % item for item in self.stages.items()))
+        return record
+
+    def to_dict(self, seconds=None) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "mode": self.mode,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created)),
+            "seconds": round(seconds if seconds is not None else time.perf_counter() - self._start, 6),
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            "extra": self.extra,
+        }
+
+
+class _NullProfile:
+    """
+    未开启分析时使用，所有操作为空
+    """
+    id = None
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def add(self, name, seconds):
+        pass
+
+    def wrap(self, name, iterable):
+        return iterable
+
+    def finish(self, rest=None, **extra):
+        return None
+
+
+NULL_PROFILE = _NullProfile()
+
+
+def start(name, mode: t.Optional[str], **extra):
+    """
+    开始分析，mode为空时返回空操作的对象，调用方不必判断是否开启
+    """
+    if not mode:
+        return NULL_PROFILE
+    return Profile(name, mode, **extra)
+
+
+def _path(profile_id) -> str:
+    return os.path.join(profile_dir, profile_id + ".json")
+
+
+def save(record: dict) -> str:
+    """
+    保存分析结果，先写临时文件再改名，超过profile_keep个时删除最早的
+
+    Returns:
+      文件路径
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    path = _path(record["id"])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+    files = sorted((os.path.join(profile_dir, name) for name in os.listdir(profile_dir)
+                    if name.endswith(".json")), key=os.path.getmtime)
+    for old in files[:max(0, len(files) - profile_keep)]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+def load(profile_id) -> t.Optional[dict]:
+    """
+    读取分析结果，不存在时返回None
+    """
+    if not profile_id.isalnum():
+        return None
+    try:
+        with open(_path(profile_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def records() -> t.List[dict]:
+    """
+    全部分析结果的摘要，最新的在前，不含分析器输出
+    """
+    if not os.path.isdir(profile_dir):
+        return []
+    result = []
+    for name in os.listdir(profile_dir):
+        if not name.endswith(".json"):
+            continue
+        record = load(name[:-len(".json")])
+        if record is not None:
+            record.pop("profile", None)
+            result.append(record)
+    result.sort(key=lambda r: r["created"], reverse=True)
+    return result
@@ -0,0 +1,110 @@
+"""
+UDP推送接收器，接收nacos服务端推送的实例变化并写入本地缓存.
+"""
+import gzip
+import json
+import socket
+import threading
+import typing as t
+
+from service_cache import DEFAULT_CLUSTER, DEFAULT_GROUP, service_key
+from util import logger
+
+# 单个UDP包最大长度
+BUFFER_SIZE = 64 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def decode_packet(packet: bytes) -> dict:
+    """
+    解析推送数据包，服务端在数据较大时会gzip压缩
+    """
+    if packet[:2] == GZIP_MAGIC:
+        packet = gzip.decompress(packet)
+    return json.loads(packet.decode("UTF-8"))
+
+
+def parse_service_name(name: str) -> t.Tuple[str, str]:
+    """
+    拆分 group@@service 格式的服务名
+
+    Returns:
+      (service, group)
+    """
+    if "@@" in name:
+        group, service = name.split("@@", 1)
+        return service, group
+    return name, DEFAULT_GROUP
+
+
+class PushReceiver:
+    """
+    监听UDP端口，收到服务端推送后回调on_push并回复ack
+
+    查询实例列表时携带udpPort和clientIP参数即可向服务端订阅推送
+    """
+
+    def __init__(self, on_push, host="0.0.0.0", port=0):
+        """
+        Args:
+          on_push: 推送回调，参数为(服务key, 服务信息字典)
+          host: 监听地址
+          port: 监听端口，0表示随机端口
+        """
+        self.on_push = on_push
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self.port = self._sock.getsockname()[1]
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="nacos-push-receiver",
+                                        daemon=True)
+        self._thread.start()
+        logger.info("[Nacos] UDP推送监听已启动, 端口: %s", self.port)
+
+    def stop(self):
+        self._running = False
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def _run(self):
+        while self._running:
+            try:
+                packet, address = self._sock.recvfrom(BUFFER_SIZE)
+            except OSError:
+                if self._running:
+                    logger.exception("[Nacos] UDP推送接收失败", exc_info=True)
+                break
+            try:
+                ack = self.handle(packet)
+                self._sock.sendto(json.dumps(ack).encode("UTF-8"), address)
+            except Exception:
+                logger.exception("[Nacos] UDP推送处理失败", exc_info=True)
+
+    def handle(self, packet: bytes) -> dict:
+        """
+        处理一个推送数据包
+
+        Returns:
+          需要回复给服务端的ack
+        """
+        msg = decode_packet(packet)
+        push_type = msg.get("type")
+        last_ref_time = msg.get("lastRefTime", 0)
+        if push_type in ("dom", "service"):
+            data = msg.get("data")
+            info = json.loads(data) if isinstance(data, str) else data
+            service, group = parse_service_name(info.get("name", ""))
+            key = service_key(service, group, info.get("clusters") or DEFAULT_CLUSTER)
+            logger.debug("[Nacos] 收到实例推送: %s, 实例数: %s", key,
+                         len(info.get("hosts") or []))
+            self.on_push(key, info)
+            return {"type": "push-ack", "lastRefTime": last_ref_time, "data": ""}
+        return {"type": "unknown-ack", "lastRefTime": last_ref_time, "data": ""}
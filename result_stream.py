@@ -0,0 +1,149 @@
+"""
+预测结果流式输出，按块编码为CSV/Arrow/Parquet，边预测边返回，可选同时写入结果文件.
+"""
+import io
+import os
+import typing as t
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+import common_log
+
+log = common_log.get_log('server.log', 'debug')
+
+# 输出格式：(Content-Type, 文件后缀)
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", ".arrow"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+# 输出开始后出错时追加的错误标记，格式为 "#ERROR: 错误信息\n"
+ERROR_MARKER = b"#ERROR: "
+
+
+def check_format(fmt: str) -> str:
+    """
+    校验输出格式
+
+    Returns:
+      小写的格式名
+
+    Raises:
+      ValueError: 不支持的格式，或Arrow/Parquet缺少pyarrow
+    """
+    fmt = (fmt or "csv").lower()
+    if fmt not in FORMATS:
+        raise ValueError("不支持的输出格式: %s, 可选: %s" % (fmt, ", ".join(FORMATS)))
+    if fmt != "csv" and pyarrow is None:
+        raise ValueError("输出格式 %s 依赖 pyarrow，请先安装：pip install pyarrow" % fmt)
+    return fmt
+
+
+def content_type(fmt: str) -> str:
+    return FORMATS[fmt][0]
+
+
+def file_suffix(fmt: str) -> str:
+    return FORMATS[fmt][1]
+
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def encode_csv(chunks: t.Iterable[pd.DataFrame]) -> t.Iterator[bytes]:
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+
+
+def encode_arrow(chunks: t.Iterable[pd.DataFrame]) -> t.Iterator[bytes]:
+    buffer = io.BytesIO()
+    writer = None
+    for chunk in chunks:
+        batch = pyarrow.RecordBatch.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.ipc.new_stream(buffer, batch.schema)
+        writer.write_batch(batch)
+        yield _drain(buffer)
+    if writer is not None:
+        writer.close()
+        yield _drain(buffer)
+
+
+def encode_parquet(chunks: t.Iterable[pd.DataFrame]) -> t.Iterator[bytes]:
+    buffer = io.BytesIO()
+    writer = None
+    for chunk in chunks:
+        table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(buffer, table.schema)
+        # 每块写成一个row group，写完即可发送
+        writer.write_table(table)
+        yield _drain(buffer)
+    if writer is not None:
+        writer.close()
+        yield _drain(buffer)
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "arrow": encode_arrow,
+    "parquet": encode_parquet,
+}
+
+
+def _mark_error(parts: t.Iterator[bytes]) -> t.Iterator[bytes]:
+    """
+    响应头已经发出后无法再改状态码，预测或编码中途出错时追加一行错误标记，再重新抛出异常由WSGI服务器中断连接，
+    分块传输缺少结束块，客户端会收到连接不完整的错误；
+    CSV的最后一行为错误标记，Arrow/Parquet在数据后追加标记后无法被完整解析，不会被误当作完整结果
+    """
+    try:
+        yield from parts
+    except Exception as e:
+        log.exception("预测结果输出中断", exc_info=True)
+        message = " ".join(str(e).split()) or type(e).__name__
+        yield ERROR_MARKER + message.encode("utf-8") + b"\n"
+        raise
+
+
+def encode(chunks: t.Iterable[pd.DataFrame], fmt="csv", save_path=None) -> t.Iterator[bytes]:
+    """
+    按块编码预测结果
+
+    Args:
+      chunks: 预测结果DataFrame块
+      fmt: 输出格式，csv/arrow/parquet
+      save_path: 结果文件路径，不为空时边输出边写入，先写临时文件，全部完成后再改名
+
+    Returns:
+      字节块迭代器，中途出错时最后一块为ERROR_MARKER开头的错误信息，之后抛出原异常，不保存结果文件
+    """
+    fmt = check_format(fmt)
+    data = _mark_error(ENCODERS[fmt](chunks))
+    if not save_path:
+        yield from (part for part in data if part)
+        return
+    tmp_path = save_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for part in data:
+                if part:
+                    f.write(part)
+                    yield part
+        os.replace(tmp_path, save_path)
+        log.info("预测结果已保存：%s" % save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
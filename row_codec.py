@@ -0,0 +1,138 @@
+"""
+/predict/rows 的请求解析和结果编码，支持JSON、NumPy(.npy)和Arrow IPC，结果使用与请求相同的编码.
+"""
+import io
+import typing as t
+
+import numpy as np
+
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+JSON = "json"
+NPY = "npy"
+ARROW = "arrow"
+
+CONTENT_TYPES = {
+    JSON: "application/json",
+    NPY: "application/x-npy",
+    ARROW: "application/vnd.apache.arrow.stream",
+}
+
+# 主键列名，Arrow请求中存在时原样返回
+KEY_COLUMN = "cgi"
+
+
+class RowDecodeError(ValueError):
+    """
+    请求数据无法解析
+    """
+
+
+def detect_format(content_type: str) -> str:
+    """
+    根据Content-Type判断编码
+
+    Raises:
+      RowDecodeError: 不支持的Content-Type
+    """
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    for fmt, value in CONTENT_TYPES.items():
+        if mimetype == value:
+            return fmt
+    raise RowDecodeError("不支持的Content-Type: %s, 可选: %s"
+                         % (content_type, ", ".join(CONTENT_TYPES.values())))
+
+
+def _as_features(rows) -> np.ndarray:
+    try:
+        features = np.asarray(rows, dtype=np.float32)
+    except (TypeError, ValueError) as e:
+        raise RowDecodeError("特征必须是数值矩阵: %s" % e)
+    if features.ndim == 1 and features.size:
+        features = features.reshape(1, -1)
+    if features.ndim != 2 or not features.size:
+        raise RowDecodeError("特征必须是非空的二维矩阵，当前形状: %s" % (features.shape,))
+    return features
+
+
+def decode(fmt: str, body: bytes, json_data=None) -> t.Tuple[t.Optional[list], np.ndarray, dict]:
+    """
+    解析请求
+
+    Args:
+      fmt: 编码
+      body: 请求体
+      json_data: 已解析的JSON请求体
+
+    Returns:
+      (主键列表或None, float32特征矩阵, 请求体中的参数)
+
+    Raises:
+      RowDecodeError: 请求数据无法解析
+    """
+    if fmt == JSON:
+        if not isinstance(json_data, dict):
+            raise RowDecodeError("JSON请求体必须是对象，包含rows字段")
+        params = {k: v for k, v in json_data.items() if k not in ("rows", "keys")}
+        keys = json_data.get("keys")
+        features = _as_features(json_data.get("rows"))
+        if keys is not None and len(keys) != len(features):
+            raise RowDecodeError("keys与rows的行数不一致")
+        return keys, features, params
+    if fmt == NPY:
+        try:
+            array = np.load(io.BytesIO(body), allow_pickle=False)
+        except (ValueError, OSError, EOFError) as e:
+            raise RowDecodeError("npy解析失败: %s" % e)
+        return None, _as_features(array), {}
+    if fmt == ARROW:
+        if pyarrow is None:
+            raise RowDecodeError("Arrow请求依赖 pyarrow，请先安装：pip install pyarrow")
+        try:
+            table = pyarrow.ipc.open_stream(body).read_all()
+        except pyarrow.ArrowInvalid as e:
+            raise RowDecodeError("Arrow解析失败: %s" % e)
+        keys = None
+        if KEY_COLUMN in table.column_names:
+            keys = table.column(KEY_COLUMN).to_pylist()
+            table = table.drop_columns([KEY_COLUMN])
+        columns = [table.column(i).to_numpy() for i in range(table.num_columns)]
+        if not columns:
+            raise RowDecodeError("Arrow请求没有特征列")
+        return keys, _as_features(np.column_stack(columns)), {}
+    raise RowDecodeError("不支持的编码: %s" % fmt)
+
+
+def encode(fmt: str, keys: t.Optional[list], predictions: np.ndarray):
+    """
+    编码预测结果
+
+    Returns:
+      JSON编码返回字典，其他编码返回字节
+    """
+    if fmt == JSON:
+        data = {"predictions": predictions.tolist()}
+        if keys is not None:
+            data["keys"] = keys
+        return {"code": 200, "msg": "success", "data": data}
+    if fmt == NPY:
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(predictions), allow_pickle=False)
+        return buffer.getvalue()
+    if fmt == ARROW:
+        arrays, names = [], []
+        if keys is not None:
+            arrays.append(pyarrow.array(keys))
+            names.append(KEY_COLUMN)
+        for i in range(predictions.shape[1]):
+            arrays.append(pyarrow.array(predictions[:, i]))
+            names.append(str(i))
+        batch = pyarrow.RecordBatch.from_arrays(arrays, names=names)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        return sink.getvalue().to_pybytes()
+    raise RowDecodeError("不支持的编码: %s" % fmt)
@@ -1,3 +1,5 @@
+import io
+import itertools
 import os
 import time
 
@@ -6,19 +8,87 @@ import requests
 import nacos
 import nacos_config
 
-from concurrent.futures import ThreadPoolExecutor
-
 import numpy as np
 import pandas as pd
 from gevent import pywsgi
 
 import common_log
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, stream_with_context
 
-from prediction_code import model_call, model_training
+import metrics
+import model_meta
+import prediction_code
+import profiling
+import result_stream
+import row_codec
+from prediction_code import (load_model, model_cache, model_training, predict_chunks,
+                             read_feature_chunks, result_file_path)
+from train_queue import QueueFullError, TrainingQueue
 
 log = common_log.get_log('server.log', 'debug')
+common_log.configure(queue=nacos_config.log_queue, json_format=nacos_config.log_json,
+                     max_length=nacos_config.log_max_length,
+                     large_per_second=nacos_config.log_large_per_second)
 nass_ai_server = ''
+nacos_server = None
+# 训练任务队列，训练在独立进程中执行
+train_queue = TrainingQueue(max_workers=nacos_config.train_workers,
+                            max_queue=nacos_config.train_queue_size,
+                            cpu_affinity=nacos_config.train_cpu_affinity)
+# 新模型写入后清理对应的缓存
+train_queue.add_done_callback(lambda job: job.result and model_cache.invalidate(job.result))
+# 可以通过配置中心修改、无需重启即生效的nacos_config运行参数：(类型, 最小值, 最大值)，None表示不限制
+RUNTIME_SETTINGS = {
+    'model_cache_size': (int, 1, None),
+    'model_cache_bytes': (int, 0, None),
+    'predict_chunk_rows': (int, 1, None),
+    'predict_batching': (bool, None, None),
+    'predict_batch_rows': (int, 1, None),
+    'predict_batch_latency': (float, 0, None),
+    'train_candidates': (int, 1, None),
+    'train_cv_folds': (int, 0, None),
+    'train_parallel_fits': (int, 1, None),
+    'train_max_rounds': (int, 1, None),
+    'train_early_stopping_rounds': (int, 0, None),
+    'train_warm_start_rounds': (int, 1, None),
+    'profile_timing': (bool, None, None),
+    'profile_sample_rate': (float, 0, 1),
+    'profile_keep': (int, 1, None),
+}
+# 可以设为空的运行参数，空表示自动
+NULLABLE_SETTINGS = ('train_parallel_fits',)
+
+
+def apply_runtime_settings():
+    """
+    把nacos_config中的运行参数应用到各组件，请求中直接读取nacos_config的参数不需要在此处理
+    """
+    model_cache.max_count = nacos_config.model_cache_size
+    model_cache.max_bytes = nacos_config.model_cache_bytes
+    prediction_code.predict_chunk_rows = nacos_config.predict_chunk_rows
+    prediction_code.predict_batcher.max_batch_rows = nacos_config.predict_batch_rows
+    prediction_code.predict_batcher.max_latency = nacos_config.predict_batch_latency
+    profiling.profile_keep = nacos_config.profile_keep
+
+
+apply_runtime_settings()
+# 监控指标，由/metrics输出
+PREDICT_SECONDS = metrics.histogram('predict_duration_seconds', '预测请求耗时，流式预测到最后一块返回为止',
+                                    ['model', 'api'])
+PREDICT_ROWS = metrics.counter('predict_rows_total', '预测的数据行数', ['model', 'api'])
+PREDICT_ROWS_PER_SECOND = metrics.gauge('predict_rows_per_second', '最近一次预测请求每秒预测的行数',
+                                        ['model', 'api'])
+metrics.gauge('train_queue_depth', '运行和排队中的训练任务数', fn=lambda: train_queue.pending())
+metrics.gauge('model_cache_models', '已缓存的模型数', fn=lambda: model_cache.stats()['count'])
+metrics.gauge('model_cache_bytes', '已缓存的模型文件总大小', fn=lambda: model_cache.stats()['bytes'])
+metrics.counter('model_cache_hits_total', '模型缓存命中次数', fn=lambda: model_cache.hits)
+metrics.counter('model_cache_misses_total', '模型缓存未命中次数', fn=lambda: model_cache.misses)
+metrics.counter('predict_batches_total', '合批执行的预测次数', fn=lambda: prediction_code.predict_batcher.batches)
+metrics.counter('predict_batch_requests_total', '参与合批的预测请求数',
+                fn=lambda: prediction_code.predict_batcher.requests)
+# 网关服务名及回调接口前缀
+GATEWAY_SERVICE_NAME = 'dipper-gateway'
+GATEWAY_CALLBACK_PREFIX = '/naas-bs/ai/noAuth'
 # 创建一个服务，赋值给APP
 app = Flask(__name__)
 
@@ -26,8 +96,9 @@ app = Flask(__name__)
 # 指定接口访问的路径（set_response是API名称），支持什么请求方式get，post
 @app.route('/predict', methods=['post'])
 def set_response():
-    global data_path
     global nass_ai_server
+    profile = profiling.start(request.path, profile_mode())
+    result = None
     try:
         # 获取训练数据的索引值
         data_index = request.form.get('dataIndex')
@@ -39,6 +110,10 @@ def set_response():
         num_future_points = request.form.get('numFuturePoints')
         if num_future_points is None:
             num_future_points = 1
+        # 输出格式：csv/arrow/parquet，默认csv
+        output_format = request.form.get('outputFormat', 'csv')
+        # 是否同时把结果写入结果目录，默认只返回不落盘
+        save_result = request.form.get('saveResult', 'false').lower() in ('1', 'true', 'yes')
         # 如果未传入结果路径，则默认为当前路径
         if data_save_path is None:
             log.info("未传入结果路径，使用默认路径")
@@ -49,19 +124,27 @@ def set_response():
         # 保存二进制文件
         if data_index is None:
             return {'code': 500, 'msg': 'data_index is empty'}
+        f = request.files['file']
+        # 如果传入模型路径，则进行模型调用：按块读取上传数据，不整体加载到内存
+        if model_path is not None:
+            result = predict_response(f, int(data_index), model_path, result_path, num_future_points,
+                                      output_format, save_result, request.form.get("dataSavePath"), profile)
+            return result
         # 保存文件
         # 设置保存路径
-        f = request.files['file']
         if f is not None and f != '':
             # f 不为空的处理逻辑
             data_path = os.path.join(data_save_path, f.filename)
-            f.save(data_path)
+            with profile.stage('save_upload'):
+                f.save(data_path)
             log.info("文件保存成功！路径：%s" % data_path)
         else:
             # f 为空的处理逻辑
             log.info("未选择文件进行上传")
+            return {'code': 500, 'msg': 'file is empty'}
         # 异常处理
-        data = pd.read_csv(data_path, encoding='utf-8')
+        with profile.stage('read_csv'):
+            data = pd.read_csv(data_path, encoding='utf-8')
         # 划分训练集和测试集
         # 选择模型训练的周
         feature = data['cgi']
@@ -85,37 +168,338 @@ def set_response():
             # 表示使用iloc方法进行基于索引的切片操作。其中，:表示选择所有行，1: 7
             # 表示选择从索引1到索引6的列（不包括索引7）,因为索引是从0开始的，所以实际上选择的是第2到第6列,不包含第7列。
             # 1 到 索引值 ，不包含索引值，格式化字符串
-            train_data_x = data.iloc[:, 1:int(data_index)]
-            # "6个连续月流量数据"
-            train_data_x = pd.concat([feature, train_data_x], axis=1)
-            train_data_y = data.iloc[:, int(data_index)]  # "选择第八列,第7个月流量数据"
-            train_data_y = pd.concat([feature, train_data_y], axis=1)
-            v1_x = np.array(train_data_x.iloc[:, 1:])  # 选择所有行，从第2列开始
-            v1_y = np.array(train_data_y.iloc[:, 1:])  # 选择所有行，从第2列开始
-            # 调用模型训练方法，异步执行
-            executor = ThreadPoolExecutor(max_workers=1)
+            with profile.stage('slice'):
+                train_data_x = data.iloc[:, 1:int(data_index)]
+                # "6个连续月流量数据"
+                train_data_x = pd.concat([feature, train_data_x], axis=1)
+                train_data_y = data.iloc[:, int(data_index)]  # "选择第八列,第7个月流量数据"
+                train_data_y = pd.concat([feature, train_data_y], axis=1)
+                v1_x = np.array(train_data_x.iloc[:, 1:])  # 选择所有行，从第2列开始
+                v1_y = np.array(train_data_y.iloc[:, 1:])  # 选择所有行，从第2列开始
+            # 调用模型训练方法，提交到训练队列异步执行
             # 改为时间戳,防止文件重名，格式化为2019-01-21-13:49:00 形式
             save_path = model_path + model_name
-            executor.submit(model_training, v1_x, v1_y, save_path,nass_ai_server,projectId)
-            return {'code': 200, 'msg': 'success',
-                    'data': '模型训练中，请稍后查看结果!模型前缀为：' + model_name,
-                    'extend': model_name}
-        # 如果传入模型路径，则进行模型调用
-        else:
-            log.info("模型调用")
-            log.info('模型路径：%s' % model_path)
-            log.info('结果路径：%s' % result_path)
-            log.info('特征：%s' % feature)
-            log.info('数据：%s' % data)
-            log.info('数据类型：%s' % type(data))
-            prediction_data_x = data.iloc[:, 1:int(data_index)]
-            prediction_data_x = pd.concat([feature, prediction_data_x], axis=1)
-            v2_x = np.array(prediction_data_x.iloc[:, 1:])
-            file_path = model_call(model_path, result_path, feature, v2_x, num_future_points)
-            return send_file(file_path, as_attachment=True)
+            result = submit_training(v1_x, v1_y, save_path, projectId, model_name)
+            profile.finish(rest='other', rows=len(v1_x))
+            return result
     except Exception as e:
+        profile.finish(error=str(e))
         log.error(e)
         return {'code': 500, 'msg': str(e)}
+    finally:
+        # 流式响应在发送结束后由profiled_stream保存，其余返回路径都在这里结束分析，
+        # 避免cProfile一直运行、占用分析器锁
+        if not isinstance(result, Response):
+            profile.finish(rest='other')
+
+
+@app.route('/predict/rows', methods=['post'])
+def predict_rows_api():
+    """
+    在线预测，请求体直接是特征行，支持JSON、NumPy(.npy)和Arrow IPC，结果使用相同编码返回
+
+    JSON请求体为 {"modelPath": ..., "numFuturePoints": ..., "rows": [[...]], "keys": [...]}，
+    npy和Arrow的modelPath、numFuturePoints通过查询参数传入，Arrow中的cgi列作为主键原样返回
+    """
+    start = time.perf_counter()
+    try:
+        fmt = row_codec.detect_format(request.content_type)
+        json_data = request.get_json(silent=True) if fmt == row_codec.JSON else None
+        keys, feature, params = row_codec.decode(fmt, request.get_data(cache=False), json_data)
+    except row_codec.RowDecodeError as e:
+        return {'code': 400, 'msg': str(e)}, 400
+    model_path = params.get('modelPath') or request.args.get('modelPath')
+    num_future_points = params.get('numFuturePoints')
+    if num_future_points is None:
+        num_future_points = request.args.get('numFuturePoints', 1)
+    if model_path is None:
+        return {'code': 400, 'msg': 'model_path is empty'}, 400
+    try:
+        num_future_points = int(num_future_points)
+    except (TypeError, ValueError):
+        num_future_points = 0
+    if num_future_points < 1:
+        return {'code': 400, 'msg': 'numFuturePoints应为正整数'}, 400
+    try:
+        model = load_model(model_path)
+    except FileNotFoundError:
+        return {'code': 404, 'msg': '模型不存在: %s' % model_path}, 404
+    except ValueError as e:
+        # 不支持的模型格式
+        return {'code': 400, 'msg': str(e)}, 400
+    window = prediction_code.num_features(model)
+    if window is not None and feature.shape[1] != window:
+        return {'code': 400, 'msg': '特征列数 %s 与模型窗口长度 %s 不一致' % (feature.shape[1], window)}, 400
+    try:
+        predictions = prediction_code.forecast(model, feature, num_future_points,
+                                               batching=nacos_config.predict_batching)
+    except Exception as e:
+        log.error(e)
+        return {'code': 500, 'msg': str(e)}, 500
+    observe_predict(model_path, 'rows', start, len(feature))
+    result = row_codec.encode(fmt, keys, predictions)
+    if fmt == row_codec.JSON:
+        return result
+    return Response(result, mimetype=row_codec.CONTENT_TYPES[fmt])
+
+
+def submit_training(feature, label, save_path, project_id, model_name, base_model_path=None, cv_folds=0):
+    """
+    提交训练任务到训练队列
+
+    Args:
+      feature: 特征
+      label: 标签
+      save_path: 模型保存路径前缀
+      project_id: 项目id
+      model_name: 模型名称
+      base_model_path: 增量训练的基础模型路径，为空时从头训练
+      cv_folds: k折交叉验证的折数，0和1表示不做交叉验证
+    """
+    n_estimators = nacos_config.train_warm_start_rounds if base_model_path else nacos_config.train_max_rounds
+    try:
+        job = train_queue.submit(model_training, feature, label, save_path, get_ai_server(), project_id,
+                                 n_jobs=train_queue.cpu_budget(), name=model_name,
+                                 candidates=nacos_config.train_candidates,
+                                 cv_folds=cv_folds,
+                                 parallel=nacos_config.train_parallel_fits,
+                                 n_estimators=n_estimators,
+                                 early_stopping_rounds=nacos_config.train_early_stopping_rounds,
+                                 base_model_path=base_model_path, profile=profile_mode(timing=False))
+    except QueueFullError as e:
+        return {'code': 429, 'msg': str(e)}, 429
+    return {'code': 200, 'msg': 'success',
+            'data': '模型训练中，请稍后查看结果!模型前缀为：' + model_name,
+            'extend': model_name,
+            'jobId': job.job_id}
+
+
+@app.route('/train', methods=['post'])
+def train():
+    """
+    模型训练，传入modelPath时在该模型基础上用新数据继续训练(增量训练)，否则从头训练
+    """
+    try:
+        data_index = request.form.get('dataIndex')
+        model_path = request.form.get('modelPath')
+        model_name = request.form.get("modelName")
+        project_id = request.form.get("projectId")
+        data_save_path = request.form.get("dataSavePath")
+        if data_index is None:
+            return {'code': 500, 'msg': 'data_index is empty'}
+        if model_name is None:
+            return {'code': 500, 'msg': 'model_name is empty'}
+        cv_folds = request.form.get('cvFolds')
+        try:
+            cv_folds = (nacos_config.train_cv_folds if cv_folds is None
+                        else parse_setting('train_cv_folds', cv_folds))
+        except ValueError as e:
+            return {'code': 400, 'msg': 'cvFolds%s' % e}, 400
+        base_model_path = None
+        if model_path is not None:
+            base_model_path = os.path.join(prediction_code.model_dir, model_path)
+            if not os.path.exists(base_model_path):
+                return {'code': 500, 'msg': '模型不存在: %s' % model_path}
+        f = request.files['file']
+        source = f.stream
+        if data_save_path:
+            source = os.path.join(data_save_path, f.filename)
+            f.save(source)
+            log.info("文件保存成功！路径：%s" % source)
+        data_index = int(data_index)
+        data = pd.read_csv(source, encoding='utf-8')
+        if data.empty:
+            return {'code': 500, 'msg': 'feature is empty'}
+        feature = data.iloc[:, 1:data_index].to_numpy(dtype=np.float32)
+        label = data.iloc[:, [data_index]].to_numpy(dtype=np.float32)
+        del data
+        if cv_folds > len(feature):
+            return {'code': 400, 'msg': 'cvFolds不能大于数据行数 %s' % len(feature)}, 400
+        log.info("模型训练, 数据: %s 行, 基础模型: %s" % (len(feature), model_path))
+        return submit_training(feature, label, prediction_code.model_dir + model_name, project_id, model_name,
+                               base_model_path, cv_folds)
+    except Exception as e:
+        log.error(e)
+        return {'code': 500, 'msg': str(e)}
+
+
+def predict_response(f, data_index, model_path, result_path, num_future_points, output_format,
+                     save_result=False, data_save_path=None, profile=profiling.NULL_PROFILE):
+    """
+    模型调用，按块读取上传数据、按块预测并流式返回，内存中只保留当前块和模型
+
+    开始返回后中途出错时状态码已是200，结果末尾会追加一行result_stream.ERROR_MARKER开头的错误信息并中断连接，
+    客户端需检查响应是否完整接收(分块传输的结束块)以及末尾是否有错误标记
+
+    Args:
+      f: 上传的数据文件
+      data_index: 特征截止列，特征为第1列到data_index-1列
+      model_path: 模型文件名
+      result_path: 结果目录
+      num_future_points: 预测时间点数
+      output_format: 输出格式
+      save_result: 是否把结果写入结果目录
+      data_save_path: 传入时先把上传文件保存到该目录再按块读取
+      profile: 性能分析，流式响应结束后保存
+    """
+    start = time.perf_counter()
+    log.info("模型调用")
+    log.info('模型路径：%s' % model_path)
+    output_format = result_stream.check_format(output_format)
+    # 模型加载失败在返回响应前报错
+    with profile.stage('load_model'):
+        model = load_model(model_path)
+    if data_save_path:
+        source = os.path.join(data_save_path, f.filename)
+        with profile.stage('save_upload'):
+            f.save(source)
+        log.info("文件保存成功！路径：%s" % source)
+        batches = read_feature_chunks(source, data_index, profile=profile)
+    else:
+        # 请求结束时会关闭上传文件，而流式响应还要继续读取，因此取出文件流，读取结束后自行关闭
+        source, f.stream = f.stream, io.BytesIO()
+        batches = read_feature_chunks(source, data_index, close_source=True, profile=profile)
+    # 预读第一块，数据为空时直接返回错误
+    first = next(batches, None)
+    if first is None or first[0].empty:
+        profile.finish(rest='other', error='feature is empty')
+        return {'code': 500, 'msg': 'feature is empty'}
+    log.debug('第一块数据：%s 行, %s 列特征' % first[1].shape)
+    file_path = result_file_path(result_path, output_format)
+    chunks = profile.wrap('predict', predict_chunks(model, itertools.chain([first], batches), num_future_points,
+                                                    batching=nacos_config.predict_batching))
+    chunks = observe_chunks(chunks, model_path, start)
+    body = profile.wrap('write_result', result_stream.encode(chunks, output_format,
+                                                             save_path=file_path if save_result else None))
+    headers = {'Content-Disposition': 'attachment; filename=%s' % os.path.basename(file_path)}
+    if profile.id:
+        headers['X-Profile-Id'] = profile.id
+    # 边预测边返回，不等全部结果写完
+    response = Response(stream_with_context(profiled_stream(body, profile, model=model_path)),
+                        mimetype=result_stream.content_type(output_format), headers=headers)
+    # 响应还没开始发送就被关闭时profiled_stream不会执行，在关闭时兜底结束分析
+    response.call_on_close(lambda: profile.finish(rest='other', model=model_path))
+    return response
+
+
+def profile_mode(timing=None):
+    """
+    当前请求的性能分析模式，请求头X-Profile优先，否则按配置抽样
+
+    Args:
+      timing: 未指定请求头时是否记录阶段耗时，默认按配置
+    """
+    if timing is None:
+        timing = nacos_config.profile_timing
+    return profiling.choose_mode(request.headers.get('X-Profile'), timing=timing,
+                                 sample_rate=nacos_config.profile_sample_rate)
+
+
+def profiled_stream(body, profile, **extra):
+    """
+    流式响应中每块交给服务器发送的耗时记入send阶段，响应结束或客户端断开后保存性能分析
+    """
+    try:
+        for chunk in body:
+            start = time.perf_counter()
+            yield chunk
+            profile.add('send', time.perf_counter() - start)
+    finally:
+        profile.finish(rest='other', **extra)
+
+
+def observe_predict(model_path, api, start, rows):
+    """
+    记录一次预测请求的耗时和行数，只在模型加载成功后调用，model标签为模型文件名，
+    避免客户端传入任意路径使指标无限增长
+
+    Args:
+      model_path: 已加载的模型路径
+      api: 接口名称
+      start: 请求开始时间，time.perf_counter()
+      rows: 预测的行数
+    """
+    seconds = time.perf_counter() - start
+    model = os.path.basename(model_path)
+    PREDICT_SECONDS.observe(seconds, model=model, api=api)
+    PREDICT_ROWS.inc(rows, model=model, api=api)
+    if seconds > 0:
+        PREDICT_ROWS_PER_SECOND.set(rows / seconds, model=model, api=api)
+
+
+def observe_chunks(chunks, model_path, start):
+    """
+    流式预测时逐块统计行数，最后一块返回或客户端断开后记录
+    """
+    rows = 0
+    try:
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+    finally:
+        observe_predict(model_path, 'predict', start, rows)
+
+
+# 监控指标，Prometheus文本格式
+@app.route('/metrics', methods=['get'])
+def metrics_api():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# 性能分析结果列表，不含分析器输出
+@app.route('/profiles', methods=['get'])
+def profile_list():
+    return {'code': 200, 'msg': 'success', 'data': profiling.records()}
+
+
+# 性能分析结果，format=text时只返回cProfile/pyinstrument的文本输出
+@app.route('/profiles/<profile_id>', methods=['get'])
+def profile_detail(profile_id):
+    record = profiling.load(profile_id)
+    if record is None:
+        return {'code': 404, 'msg': 'profile not found'}, 404
+    if request.args.get('format') == 'text':
+        return Response(record.get('profile') or '', mimetype='text/plain')
+    return {'code': 200, 'msg': 'success', 'data': record}
+
+
+# 训练任务列表
+@app.route('/jobs', methods=['get'])
+def job_list():
+    return {'code': 200, 'msg': 'success',
+            'data': [job.to_dict() for job in train_queue.jobs()],
+            'extend': {'pending': train_queue.pending()}}
+
+
+# 训练任务状态和进度
+@app.route('/jobs/<job_id>', methods=['get'])
+def job_status(job_id):
+    job = train_queue.get(job_id)
+    if job is None:
+        return {'code': 404, 'msg': 'job not found'}, 404
+    return {'code': 200, 'msg': 'success', 'data': job.to_dict()}
+
+
+# 取消训练任务
+@app.route('/jobs/<job_id>', methods=['delete'])
+def job_cancel(job_id):
+    if not train_queue.cancel(job_id):
+        return {'code': 404, 'msg': 'job not found or finished'}, 404
+    return {'code': 200, 'msg': 'success', 'data': train_queue.get(job_id).to_dict()}
+
+
+# 模型缓存状态
+@app.route('/model_cache', methods=['get'])
+def model_cache_stats():
+    return {'code': 200, 'msg': 'success', 'data': model_cache.stats()}
+
+
+# 清理模型缓存，不传modelPath时清空全部
+@app.route('/model_cache', methods=['delete'])
+def model_cache_invalidate():
+    model_path = request.args.get('modelPath')
+    model_cache.invalidate(os.path.join('./dic/models/', model_path) if model_path else None)
+    return {'code': 200, 'msg': 'success', 'data': model_cache.stats()}
 
 
 # 定义返回模型列表接口，返回模型列表，目录是./dic/models/
@@ -125,7 +509,26 @@ def model_list():
     if model_path is None:
         log.info("未传入模型路径，使用默认路径")
         model_path = './dic/models/'
-    return {'code': 200, 'msg': 'success', 'data': os.listdir(model_path)}
+    return {'code': 200, 'msg': 'success',
+            'data': [name for name in os.listdir(model_path) if not model_meta.is_meta_file(name)]}
+
+
+# 预测合批统计
+@app.route('/predict_batcher', methods=['get'])
+def predict_batcher_stats():
+    return {'code': 200, 'msg': 'success', 'data': prediction_code.predict_batcher.stats()}
+
+
+# 模型元数据，包括增量训练的来源
+@app.route('/model_meta', methods=['get'])
+def model_meta_info():
+    model_path = request.args.get('modelPath')
+    if model_path is None:
+        return {'code': 500, 'msg': 'model_path is empty'}
+    meta = model_meta.load_meta(os.path.join(prediction_code.model_dir, model_path))
+    if meta is None:
+        return {'code': 404, 'msg': 'not found'}, 404
+    return {'code': 200, 'msg': 'success', 'data': meta}
 
 
 # 定义返回结果列表接口，返回结果列表，目录是./dic/results/
@@ -149,9 +552,21 @@ def uploader():
         return {'code': 200, 'msg': 'success', 'data': '上传成功！'}
 
 
+def get_ai_server():
+    """
+    按权重从网关实例中选择一个地址，选择失败时使用启动时获取的地址
+    """
+    if nacos_server is not None:
+        gateway = nacos_server.get_server_instance(service_name=GATEWAY_SERVICE_NAME)
+        if gateway:
+            return gateway + GATEWAY_CALLBACK_PREFIX
+    return nass_ai_server
+
+
 # nacos服务
 def service_register():
     global nass_ai_server
+    global nacos_server
     # 创建初始nacos连接对象
     nacos_server = nacos.Nacos(host=nacos_config.nacos_ip, username=nacos_config.username,
                                password=nacos_config.password)
@@ -162,14 +577,75 @@ def service_register():
         nacos_config.server_port = nacos_config.port
     nacos_server.register_service(service_ip=nacos_config.server_ip, service_port=nacos_config.server_port,
                                   service_name=nacos_config.service_name)
-    nacos_server.config(app_config='cmcc', env='dev', file_type='yml', config_name='dipper-simu3d-prod.yml')
-    nass_ai_server =  nacos_server.get_server_instance(service_name='dipper-gateway')
-    nass_ai_server = nass_ai_server + "/naas-bs/ai/noAuth"
+    nacos_server.config(app_config=nacos_config.GlobalConfig, env='dev', file_type='yml',
+                        config_name='dipper-simu3d-prod.yml', callback=on_config_change)
+    nass_ai_server = nacos_server.get_server_instance(service_name=GATEWAY_SERVICE_NAME)
+    nass_ai_server = nass_ai_server + GATEWAY_CALLBACK_PREFIX
 
     # 开启监听配置的线程和服务注册心跳进程的健康检查进程
     nacos_server.healthy_check()
 
 
+def parse_setting(key, value):
+    """
+    按RUNTIME_SETTINGS转换并校验配置中心下发的运行参数，如"500"转为500
+
+    Raises:
+      ValueError: 类型不符或超出取值范围
+    """
+    kind, low, high = RUNTIME_SETTINGS[key]
+    if value is None or value == '':
+        if key in NULLABLE_SETTINGS:
+            return None
+        raise ValueError('不能为空')
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in ('1', 'true', 'yes', 'on'):
+            return True
+        if text in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError('应为布尔值')
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError('应为数值')
+    try:
+        # 整数参数不接受1.5这样的小数
+        number = float(value) if kind is float else int(str(value).strip())
+    except ValueError:
+        raise ValueError('应为%s' % ('数值' if kind is float else '整数'))
+    if low is not None and not number >= low:
+        raise ValueError('不能小于%s' % low)
+    if high is not None and not number <= high:
+        raise ValueError('不能大于%s' % high)
+    return number
+
+
+def on_config_change(change):
+    """
+    配置中心的配置变更回调，配置中与RUNTIME_SETTINGS同名的顶层参数校验通过后立即生效，
+    无效的值和从配置中删除的参数保持当前值
+    """
+    updated = {}
+    if not isinstance(change.config, dict):
+        return
+    for key in change.changed_keys:
+        if key in RUNTIME_SETTINGS and key in change.config:
+            try:
+                value = parse_setting(key, change.config[key])
+            except ValueError as e:
+                log.warning("运行参数 %s 的值 %r 无效，保持当前值 %r: %s",
+                            key, change.config[key], getattr(nacos_config, key), e)
+                continue
+            setattr(nacos_config, key, value)
+            updated[key] = value
+    if updated:
+        apply_runtime_settings()
+        log.info("运行参数已更新: %s", updated)
+    else:
+        log.info("配置已更新: %s", change)
+
+
 import socket
 
 
@@ -192,6 +668,9 @@ if __name__ == '__main__':
     # port = 19996
     # app.run(ip, port, debug=True)
     service_register()
+    # 预加载最新的模型，首个预测请求不再等待反序列化
+    if nacos_config.model_warmup:
+        model_cache.warmup('./dic/models/')
     # 获取本机 IP 地址
     ip_address = get_local_ip()
     print('本机IP地址为：' + ip_address)
@@ -0,0 +1,263 @@
+"""
+服务实例本地缓存，后台按TTL刷新，查询直接读内存.
+"""
+import heapq
+import os
+import random
+import threading
+import time
+import typing as t
+
+import yaml
+
+import files
+from util import logger
+
+DEFAULT_CLUSTER = "DEFAULT"
+DEFAULT_GROUP = "DEFAULT_GROUP"
+
+
+# 实例快照在快照/容灾目录下的子目录
+NAMING_DIR = "naming"
+
+
+def service_key(service_name, group_name=DEFAULT_GROUP, cluster_name=DEFAULT_CLUSTER):
+    return service_name, group_name or DEFAULT_GROUP, cluster_name or DEFAULT_CLUSTER
+
+
+def snapshot_file_name(key) -> str:
+    service_name, group_name, cluster_name = key
+    return "{}@@{}@@{}.yml".format(group_name, service_name, cluster_name)
+
+
+def parse_snapshot_file_name(file_name) -> t.Optional[tuple]:
+    if not file_name.endswith(".yml"):
+        return None
+    words = file_name[:-len(".yml")].split("@@")
+    if len(words) != 3:
+        return None
+    group_name, service_name, cluster_name = words
+    return service_name, group_name, cluster_name
+
+
+class ServiceInstances:
+    """
+    一个(service, group, cluster)对应的实例列表快照，创建后不再修改
+    """
+
+    def __init__(self, key, hosts=None, last_ref_time=0, cache_millis=0, version=0):
+        self.key = key
+        self.hosts: t.List[dict] = list(hosts or [])
+        self.last_ref_time = last_ref_time
+        self.cache_millis = cache_millis
+        # 本地版本号，每次实例列表变化递增
+        self.version = version
+        self.updated = time.time()
+
+    def healthy_hosts(self) -> t.List[dict]:
+        return [h for h in self.hosts
+                if h.get("healthy", True) and h.get("enabled", True)]
+
+
+class ServiceCache:
+    """
+    服务实例缓存
+
+    首次查询某个服务时优先使用本地容灾/快照数据并在后台刷新，没有本地数据时同步拉取一次，
+    之后由后台线程按 ttl*(1±jitter) 刷新；刷新失败时保留旧数据继续提供服务
+    """
+
+    def __init__(self, fetcher, ttl=10, jitter=0.2, min_ttl=1,
+                 snapshot_base=None, failover_base=None):
+        """
+        Args:
+          fetcher: 拉取实例列表的方法，参数为(service, group, cluster)，返回nacos instance/list的结果字典
+          ttl: 刷新间隔，单位秒
+          jitter: 刷新间隔抖动比例，避免多个服务同时刷新
+          min_ttl: 最小刷新间隔，单位秒
+          snapshot_base: 快照目录，实例列表变化时写入，为空则不保存
+          failover_base: 容灾目录，存在时优先于快照加载
+        """
+        self._fetcher = fetcher
+        self.snapshot_base = snapshot_base and os.path.join(snapshot_base, NAMING_DIR)
+        self.failover_base = failover_base and os.path.join(failover_base, NAMING_DIR)
+        self.ttl = ttl
+        self.jitter = jitter
+        self.min_ttl = min_ttl
+        self._data: t.Dict[tuple, ServiceInstances] = {}
+        # (下次刷新时间, key) 小顶堆
+        self._schedule: t.List[tuple] = []
+        self._scheduled = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._listeners = []
+
+    def add_listener(self, fn):
+        """
+        注册实例变化回调，参数为新的ServiceInstances
+        """
+        self._listeners.append(fn)
+
+    def get(self, service_name, group_name=DEFAULT_GROUP,
+            cluster_name=DEFAULT_CLUSTER) -> t.Optional[ServiceInstances]:
+        """
+        获取服务实例，命中缓存时直接返回；未命中时优先加载本地数据，没有本地数据才同步拉取
+
+        Returns:
+          ServiceInstances，拉取失败且无缓存时返回None
+        """
+        key = service_key(service_name, group_name, cluster_name)
+        instances = self._data.get(key)
+        if instances is not None:
+            return instances
+        if self.load_local(key) is not None:
+            # 本地数据先提供服务，后台立即与服务端对齐
+            self._subscribe(key, delay=0)
+        else:
+            self.refresh(key)
+            self._subscribe(key)
+        return self._data.get(key)
+
+    def load_local(self, key) -> t.Optional[ServiceInstances]:
+        """
+        从容灾目录或快照目录加载实例列表，容灾目录优先
+
+        Returns:
+          加载到的ServiceInstances，没有本地数据时返回None
+        """
+        for base in (self.failover_base, self.snapshot_base):
+            if not base:
+                continue
+            content = files.read_file_str(base, snapshot_file_name(key))
+            if not content:
+                continue
+            try:
+                data = yaml.safe_load(content) or {}
+            except yaml.YAMLError:
+                logger.warning("[Nacos] 实例快照解析失败: %s/%s", base, snapshot_file_name(key))
+                continue
+            logger.info("[Nacos] 从本地加载服务实例: %s, 目录: %s", key, base)
+            return self.put(key, data.get("hosts") or [], data.get("lastRefTime", 0),
+                            data.get("cacheMillis", 0), save=False)
+        return None
+
+    def warm_up(self) -> int:
+        """
+        启动时加载容灾/快照目录下的全部实例列表，并加入后台刷新
+
+        Returns:
+          加载的服务数
+        """
+        count = 0
+        for base in (self.failover_base, self.snapshot_base):
+            if not base or not os.path.isdir(base):
+                continue
+            for file_name in os.listdir(base):
+                key = parse_snapshot_file_name(file_name)
+                if key is None or key in self._data:
+                    continue
+                if self.load_local(key) is not None:
+                    self._subscribe(key, delay=0)
+                    count += 1
+        return count
+
+    def put(self, key, hosts, last_ref_time=0, cache_millis=0, save=True) -> ServiceInstances:
+        """
+        写入实例列表，推送或本地快照加载时使用
+
+        Args:
+          save: 实例列表变化时是否写入快照目录
+
+        Returns:
+          当前缓存中的ServiceInstances
+        """
+        old = self._data.get(key)
+        if old is not None and last_ref_time and old.last_ref_time > last_ref_time:
+            # 旧数据不覆盖新数据
+            return old
+        if old is not None and old.hosts == hosts:
+            old.updated = time.time()
+            old.last_ref_time = last_ref_time or old.last_ref_time
+            return old
+        instances = ServiceInstances(key, hosts, last_ref_time, cache_millis,
+                                     version=(old.version + 1) if old else 1)
+        self._data[key] = instances
+        if save and self.snapshot_base:
+            files.save_file(self.snapshot_base, snapshot_file_name(key), {
+                "hosts": instances.hosts,
+                "lastRefTime": last_ref_time,
+                "cacheMillis": cache_millis,
+            })
+        for fn in self._listeners:
+            try:
+                fn(instances)
+            except Exception:
+                logger.exception("[Nacos] 实例变化回调执行失败", exc_info=True)
+        return instances
+
+    def refresh(self, key) -> bool:
+        """
+        同步刷新一个服务的实例列表
+
+        Returns:
+          是否刷新成功
+        """
+        try:
+            data = self._fetcher(*key)
+        except Exception as e:
+            logger.warning("[Nacos] 刷新服务实例失败, 使用缓存数据: %s, %s", key, str(e))
+            return False
+        if data is None:
+            logger.warning("[Nacos] 刷新服务实例失败, 使用缓存数据: %s", key)
+            return False
+        self.put(key, data.get("hosts") or [], data.get("lastRefTime", 0),
+                 data.get("cacheMillis", 0))
+        return True
+
+    def keys(self) -> t.List[tuple]:
+        return list(self._data.keys())
+
+    def _subscribe(self, key, delay=None):
+        with self._cond:
+            if key in self._scheduled:
+                return
+            self._scheduled.add(key)
+            next_time = self._next_time() if delay is None else time.monotonic() + delay
+            heapq.heappush(self._schedule, (next_time, key))
+            self._cond.notify()
+        self.start()
+
+    def _next_time(self):
+        delay = self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+        return time.monotonic() + max(self.min_ttl, delay)
+
+    def start(self):
+        if self._running and self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="nacos-service-cache",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _run(self):
+        while self._running:
+            with self._cond:
+                while self._running and (not self._schedule or
+                                         self._schedule[0][0] > time.monotonic()):
+                    timeout = (self._schedule[0][0] - time.monotonic()
+                               if self._schedule else None)
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                _, key = heapq.heappop(self._schedule)
+            try:
+                self.refresh(key)
+            finally:
+                with self._cond:
+                    heapq.heappush(self._schedule, (self._next_time(), key))
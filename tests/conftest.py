@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# 仓库中的模块都在根目录下，不是包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_nacos import FakeNacosServer  # noqa: E402
+
+
+@pytest.fixture
+def fake_nacos():
+    server = FakeNacosServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def nacos_client(fake_nacos, tmp_path, monkeypatch):
+    """
+    连接fake_nacos的客户端，快照和容灾文件写在临时目录
+    """
+    import nacos
+
+    monkeypatch.chdir(tmp_path)
+    client = nacos.Nacos(host=fake_nacos.address)
+    yield client
+    client.service_cache.stop()
+    if client.push_receiver is not None:
+        client.push_receiver.stop()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import async_nacos  # noqa: E402
+import util  # noqa: E402
+
+
+def test_deleted_config_notifies_once_and_stops_polling(fake_nacos, monkeypatch):
+    monkeypatch.setitem(async_nacos.DEFAULTS, "PULLING_TIMEOUT", 1)
+    fake_nacos.publish_config("naas-ai.yaml", "model: a.ubj", tenant="dipper")
+
+    async def run():
+        client = async_nacos.AsyncNacos(host=fake_nacos.address)
+        changes = []
+        try:
+            content = await client.config("naas-ai.yaml", tenant="dipper",
+                                          callback=lambda *args: changes.append(args[3]))
+            await asyncio.sleep(0.2)
+            fake_nacos.remove_config("naas-ai.yaml", tenant="dipper")
+            await asyncio.sleep(0.5)
+            polls = fake_nacos.request_count["/nacos/v1/cs/configs/listener"]
+            await asyncio.sleep(1.5)
+            polls = fake_nacos.request_count["/nacos/v1/cs/configs/listener"] - polls
+            return content, changes, polls, client.host_pool.stats()
+        finally:
+            await client.close()
+
+    content, changes, polls, stats = asyncio.run(run())
+    assert content == "model: a.ubj"
+    assert changes == [""]
+    # 删除后md5已更新，长轮询挂起等待而不是反复返回同一个key
+    assert polls <= 2
+    assert stats[0]["successCount"] > 0
+
+
+def test_connection_errors_open_the_circuit(monkeypatch):
+    async def run():
+        client = async_nacos.AsyncNacos(host="127.0.0.1:1")
+        host = client.host_pool.hosts[0]
+        host.failure_threshold = 1
+        try:
+            with pytest.raises(Exception):
+                await client.get_config("naas-ai.yaml")
+        finally:
+            await client.close()
+        return host
+
+    host = asyncio.run(run())
+    assert host.state == util.CIRCUIT_OPEN
+    assert host.failure_count == 1
+    assert host.open_until > time.time()
+
+
+def test_beat_reregisters_an_instance_the_server_dropped(fake_nacos, monkeypatch):
+    monkeypatch.setattr(async_nacos, "BEAT_TIME", 0.05)
+    fake_nacos.client_beat_interval = 50
+    key = ("DEFAULT_GROUP@@naas-ai", "10.0.0.1", 8080)
+
+    async def run():
+        client = async_nacos.AsyncNacos(host=fake_nacos.address)
+        try:
+            assert await client.register_service("10.0.0.1", "naas-ai", 8080)
+            await asyncio.sleep(0.2)
+            # 模拟nacos重启后实例丢失，下一次心跳返回20404
+            fake_nacos.deregister_instance({"serviceName": "naas-ai", "ip": "10.0.0.1",
+                                            "port": "8080"}, {})
+            assert key not in fake_nacos.beats
+            await asyncio.sleep(0.3)
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    assert key in fake_nacos.beats
+    assert fake_nacos.request_count["/nacos/v1/ns/instance"] == 2
+    assert fake_nacos.service_info("DEFAULT_GROUP@@naas-ai", "DEFAULT")["hosts"][0]["ip"] == "10.0.0.1"
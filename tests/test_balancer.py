@@ -0,0 +1,78 @@
+import collections
+import random
+
+import pytest
+
+import balancer
+
+HOSTS = [
+    {"ip": "10.0.0.1", "port": 80, "weight": 1},
+    {"ip": "10.0.0.2", "port": 80, "weight": 3},
+]
+
+
+def picks(selector, n, key=None):
+    return collections.Counter(balancer.instance_id(selector.pick(key)) for _ in range(n))
+
+
+def test_available_hosts_filters_unhealthy_disabled_and_zero_weight():
+    hosts = HOSTS + [
+        {"ip": "10.0.0.3", "port": 80, "healthy": False},
+        {"ip": "10.0.0.4", "port": 80, "enabled": False},
+        {"ip": "10.0.0.5", "port": 80, "weight": 0},
+    ]
+    assert balancer.available_hosts(hosts) == HOSTS
+
+
+@pytest.mark.parametrize("strategy", sorted(balancer.STRATEGIES))
+def test_empty_selector_picks_none(strategy):
+    assert balancer.create_selector(strategy, []).pick("key") is None
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        balancer.create_selector("fastest", HOSTS)
+
+
+def test_weighted_random_follows_weights():
+    random.seed(0)
+    counts = picks(balancer.WeightedRandomSelector(HOSTS), 4000)
+    assert 0.7 < counts["10.0.0.2:80"] / 4000 < 0.8
+
+
+def test_smooth_round_robin_is_exact_per_cycle():
+    selector = balancer.SmoothWeightedRoundRobinSelector(HOSTS)
+    counts = picks(selector, 400)
+    assert counts == {"10.0.0.1:80": 100, "10.0.0.2:80": 300}
+
+
+def test_least_outstanding_avoids_busy_host():
+    selector = balancer.LeastOutstandingSelector(HOSTS)
+    busy = HOSTS[1]
+    for _ in range(10):
+        selector.acquire(busy)
+    assert all(selector.pick() is HOSTS[0] for _ in range(50))
+    for _ in range(10):
+        selector.release(busy)
+    with selector.track() as host:
+        assert selector._outstanding[balancer.instance_id(host)] == 1
+    assert set(selector._outstanding.values()) == {0}
+
+
+def test_consistent_hash_is_stable_and_moves_few_keys():
+    hosts = [{"ip": "10.0.0.%d" % i, "port": 80} for i in range(1, 5)]
+    selector = balancer.ConsistentHashSelector(hosts)
+    keys = ["cell-%d" % i for i in range(1000)]
+    before = {k: balancer.instance_id(selector.pick(k)) for k in keys}
+    assert before == {k: balancer.instance_id(selector.pick(k)) for k in keys}
+
+    selector.update(hosts + [{"ip": "10.0.0.5", "port": 80}])
+    moved = sum(before[k] != balancer.instance_id(selector.pick(k)) for k in keys)
+    # 新增一个实例只应迁移约1/5的key
+    assert moved < 350
+
+
+def test_update_rebuilds_selector():
+    selector = balancer.SmoothWeightedRoundRobinSelector(HOSTS)
+    selector.update([HOSTS[0]])
+    assert picks(selector, 10) == {"10.0.0.1:80": 10}
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from beat_reactor import CODE_OK, CODE_RESOURCE_NOT_FOUND, BeatInfo, BeatReactor
+
+
+def wait_until(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def make_reactor():
+    reactors = []
+
+    def make(beat_fn, register_fn=lambda info: True, **kwargs):
+        reactor = BeatReactor(beat_fn, register_fn, tick=0.01, **kwargs)
+        reactors.append(reactor)
+        return reactor
+
+    yield make
+    for reactor in reactors:
+        reactor.stop()
+
+
+def test_hung_beat_does_not_delay_other_instances(make_reactor):
+    release = threading.Event()
+    beats = []
+
+    def beat(info):
+        if info.key == "hung":
+            release.wait(5)
+        beats.append(info.key)
+        return {"code": CODE_OK}
+
+    reactor = make_reactor(beat)
+    reactor.add(BeatInfo("hung", {}, {}, interval=0.02))
+    reactor.add(BeatInfo("ok", {}, {}, interval=0.02))
+    try:
+        assert wait_until(lambda: beats.count("ok") >= 5, timeout=1)
+        assert "hung" not in beats
+    finally:
+        release.set()
+    # 卡住的实例完成后重新进入时间轮
+    assert wait_until(lambda: beats.count("hung") >= 2)
+
+
+def test_server_beat_interval_is_applied(make_reactor):
+    reactor = make_reactor(lambda info: {"code": CODE_OK, "clientBeatInterval": 30})
+    info = BeatInfo("a", {}, {}, interval=0.02)
+    reactor.add(info)
+
+    assert wait_until(lambda: info.interval == 0.03)
+
+
+def test_not_found_reregisters(make_reactor):
+    registered = []
+    reactor = make_reactor(lambda info: {"code": CODE_RESOURCE_NOT_FOUND},
+                           register_fn=registered.append)
+    info = BeatInfo("a", {}, {}, interval=0.02)
+    info.last_beat = 0
+    reactor.add(info)
+
+    assert wait_until(lambda: registered)
+    assert registered[0] is info
+    # 实例不存在不算心跳成功
+    assert info.last_beat == 0
+
+
+def test_beat_reregisters_an_instance_the_server_dropped(fake_nacos, nacos_client):
+    fake_nacos.client_beat_interval = 50
+    key = ("DEFAULT_GROUP@@naas-ai", "10.0.0.1", 8080)
+    try:
+        nacos_client.register_service("10.0.0.1", "naas-ai", 8080)
+        info = nacos_client.beat_reactor.entries()[0]
+        info.interval = 0.05
+        nacos_client.beat_reactor.add(info)
+        beats = fake_nacos.request_count.get("/nacos/v1/ns/instance/beat", 0)
+        assert wait_until(lambda: fake_nacos.request_count.get("/nacos/v1/ns/instance/beat", 0) > beats)
+
+        # 模拟nacos重启后实例丢失，下一次心跳返回20404
+        fake_nacos.deregister_instance({"serviceName": "naas-ai", "ip": "10.0.0.1",
+                                        "port": "8080"}, {})
+
+        assert wait_until(lambda: key in fake_nacos.beats)
+        assert fake_nacos.request_count["/nacos/v1/ns/instance"] == 2
+    finally:
+        nacos_client.beat_reactor.stop()
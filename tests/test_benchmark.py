@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import benchmark
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark.py")
+
+
+def test_traffic_csv_is_reproducible(tmp_path):
+    first = benchmark.make_traffic_csv(str(tmp_path / "a.csv"), 30, months=5, seed=1)
+    second = benchmark.make_traffic_csv(str(tmp_path / "b.csv"), 30, months=5, seed=1)
+
+    with open(first, "rb") as a, open(second, "rb") as b:
+        assert a.read() == b.read()
+    data = pd.read_csv(first)
+    assert list(data.columns) == ["cgi", "2023-01", "2023-02", "2023-03", "2023-04", "2023-05"]
+    assert len(data) == 30
+    assert (data.iloc[:, 1:] > 0).all().all()
+
+
+def test_summarize_reports_milliseconds():
+    result = benchmark.summarize([0.001, 0.002, 0.003, 0.004], 0.5, rows=10)
+
+    assert result["count"] == 4
+    assert result["perSecond"] == 8
+    assert result["meanMs"] == 2.5
+    assert result["maxMs"] == 4
+    assert result["rows"] == 10
+    assert benchmark.summarize([], 0)["meanMs"] is None
+
+
+def test_compare_flags_regressions():
+    baseline = {"results": {"beat": {"perSecond": 1000, "p50Ms": 1.0},
+                            "train": {"seconds": 10}}}
+    current = {"results": {"beat": {"perSecond": 800, "p50Ms": 1.05},
+                           "train": {"seconds": 8}, "new": {"perSecond": 1}}}
+
+    lines = benchmark.compare(current, baseline)
+
+    regressed = [line.split()[:2] for line in lines if line.endswith("回退")]
+    # 吞吐下降20%为回退，延迟上升5%和耗时下降不算
+    assert regressed == [["beat", "perSecond"]]
+    assert len(lines) == 3
+
+
+def run_benchmark(tmp_path, *args):
+    output = tmp_path / "result.json"
+    proc = subprocess.run(
+        [sys.executable, SCRIPT, "--workdir", str(tmp_path / "work"), "--output", str(output)]
+        + list(args),
+        cwd=str(tmp_path), capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    with open(output, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_benchmark_runs_end_to_end(tmp_path):
+    pytest.importorskip("xgboost")
+
+    report = run_benchmark(tmp_path, "--rows", "200", "--requests", "10", "--config-changes", "2",
+                           "--predict-requests", "1", "--candidates", "1")
+
+    results = report["results"]
+    assert set(results) == {"beat", "instanceLookup", "configChange", "train", "predict_csv",
+                            "predictRows"}
+    assert results["beat"]["count"] == 10
+    assert results["train"]["rows"] == 200
+    assert results["predict_csv"]["rows"] == 200
+    assert report["meta"]["args"]["rows"] == 200
+
+
+def test_benchmark_can_rerun_in_the_same_workdir(tmp_path):
+    pytest.importorskip("xgboost")
+    args = ("--only", "nacos", "--requests", "10", "--config-changes", "2")
+
+    run_benchmark(tmp_path, *args)
+    # 上一次运行留下的快照不影响服务实例查询
+    report = run_benchmark(tmp_path, *args)
+
+    assert report["results"]["instanceLookup"]["count"] == 10
@@ -0,0 +1,93 @@
+import json
+import logging
+import types
+
+import pytest
+
+import common_log
+from common_log import PayloadLimitFilter
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(monkeypatch):
+    # 限流按整秒计数，固定时钟避免跨秒
+    monkeypatch.setattr(common_log, "time", types.SimpleNamespace(monotonic=lambda: 100.0))
+
+
+def make_record(message, level=logging.INFO, args=None):
+    return logging.LogRecord("test", level, __file__, 1, message, args, None)
+
+
+def test_short_records_pass_unchanged():
+    payload_filter = PayloadLimitFilter(max_length=10, large_per_second=1)
+    record = make_record("id=%s", args=(1,))
+
+    for _ in range(3):
+        assert payload_filter.filter(record)
+    assert record.getMessage() == "id=1"
+
+
+def test_long_records_are_truncated():
+    payload_filter = PayloadLimitFilter(max_length=10, large_per_second=0)
+    record = make_record("x" * 8 + "%s", args=("y" * 20,))
+
+    assert payload_filter.filter(record)
+    assert record.getMessage() == "x" * 8 + "yy...(共28字符，已截断)"
+
+
+def test_long_debug_records_are_rate_limited():
+    payload_filter = PayloadLimitFilter(max_length=10, large_per_second=2)
+
+    passed = [payload_filter.filter(make_record("x" * 20)) for _ in range(5)]
+
+    assert passed == [True, True, False, False, False]
+    assert payload_filter.dropped == 3
+
+
+@pytest.mark.parametrize("level", [logging.WARNING, logging.ERROR, logging.CRITICAL])
+def test_long_warnings_are_always_kept(level):
+    payload_filter = PayloadLimitFilter(max_length=10, large_per_second=1)
+    records = [make_record("x" * 20, level) for _ in range(5)]
+
+    assert all(payload_filter.filter(r) for r in records)
+    assert all(r.getMessage().startswith("x" * 10 + "...") for r in records)
+    # 告警不占用限流名额
+    assert payload_filter.filter(make_record("x" * 20))
+
+
+def test_dropped_count_is_reported_on_next_record():
+    payload_filter = PayloadLimitFilter(max_length=10, large_per_second=1)
+    payload_filter.filter(make_record("x" * 20))
+    payload_filter.filter(make_record("x" * 20))
+    record = make_record("x" * 20, logging.ERROR)
+
+    assert payload_filter.filter(record)
+    assert record.getMessage().endswith("(此前丢弃1条超长日志)")
+    assert payload_filter.dropped == 0
+
+
+@pytest.fixture
+def restore_settings():
+    saved = dict(common_log.settings)
+    yield
+    common_log.configure(**saved)
+
+
+def test_configure_reinstalls_handlers(tmp_path, monkeypatch, restore_settings):
+    monkeypatch.chdir(tmp_path)
+    logger = common_log.get_log("payload-test.log", "debug")
+
+    common_log.configure(queue=False, json_format=True, max_length=10)
+    logger.info("y" * 20)
+    logger.error("%s", "z" * 20)
+    for handler in logger.handlers:
+        handler.flush()
+
+    with open(tmp_path / "payload-test.log", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["level"] for line in lines] == ["INFO", "ERROR"]
+    assert lines[1]["message"].startswith("z" * 10 + "...")
+    assert len(logger.filters) == 1
+
+    with pytest.raises(ValueError, match="未知的日志设置"):
+        common_log.configure(colour=True)
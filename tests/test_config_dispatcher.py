@@ -0,0 +1,124 @@
+import threading
+import time
+
+from config_dispatcher import ConfigChange, ConfigDispatcher, diff_config, flatten_config
+
+KEY = ("naas-ai.yaml", "DEFAULT_GROUP", "dipper")
+
+
+def test_flatten_config():
+    assert flatten_config({"a": {"b": 1, "c": {"d": 2}}, "e": {}, "f": [1]}) == {
+        "a.b": 1, "a.c.d": 2, "e": {}, "f": [1]}
+    assert flatten_config("text") == {"": "text"}
+    assert flatten_config(None) == {}
+
+
+def test_diff_config():
+    added, removed, modified = diff_config(
+        {"a": 1, "b": {"c": 2, "d": 3}},
+        {"a": 1, "b": {"c": 4}, "e": 5})
+    assert added == {"e": 5}
+    assert removed == {"b.d": 3}
+    assert modified == {"b.c": (2, 4)}
+
+
+def test_change_keys():
+    change = ConfigChange(KEY, {"a": 2, "b": 1}, {"a": 1})
+    assert (change.data_id, change.group, change.tenant) == KEY
+    assert change.changed_keys == {"a", "b"}
+
+
+class Recorder:
+    def __init__(self, block=False):
+        self.changes = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, change):
+        self.started.set()
+        self.release.wait(5)
+        self.changes.append(change)
+
+
+def test_add_with_current_notifies_immediately():
+    dispatcher = ConfigDispatcher(max_workers=2)
+    recorder = Recorder()
+    dispatcher.add(KEY, recorder, current={"a": 1})
+    dispatcher.shutdown()
+
+    assert len(recorder.changes) == 1
+    assert recorder.changes[0].added == {"a": 1}
+
+
+def test_busy_callback_coalesces_changes():
+    dispatcher = ConfigDispatcher(max_workers=2)
+    recorder = Recorder(block=True)
+    dispatcher.add(KEY, recorder)
+
+    dispatcher.dispatch(KEY, {"v": 1})
+    assert recorder.started.wait(2)
+    for i in range(2, 6):
+        dispatcher.dispatch(KEY, {"v": i})
+    recorder.release.set()
+    dispatcher.shutdown()
+
+    assert [c.config for c in recorder.changes] == [{"v": 1}, {"v": 5}]
+    # 合并后的差异相对于上一次通知的配置
+    assert recorder.changes[1].modified == {"v": (1, 5)}
+
+
+def test_slow_callback_does_not_block_others_or_dispatch():
+    dispatcher = ConfigDispatcher(max_workers=2)
+    slow, fast = Recorder(block=True), Recorder()
+    dispatcher.add(KEY, slow)
+    dispatcher.add(KEY, fast)
+
+    start = time.perf_counter()
+    dispatcher.dispatch(KEY, {"v": 1})
+    assert time.perf_counter() - start < 0.5
+    deadline = time.time() + 2
+    while not fast.changes and time.time() < deadline:
+        time.sleep(0.01)
+    assert [c.config for c in fast.changes] == [{"v": 1}]
+    assert slow.changes == []
+    slow.release.set()
+    dispatcher.shutdown()
+
+
+def test_unchanged_config_is_not_delivered():
+    dispatcher = ConfigDispatcher(max_workers=1)
+    recorder = Recorder()
+    dispatcher.add(KEY, recorder, current={"a": 1})
+    dispatcher.dispatch(KEY, {"a": 1})
+    dispatcher.shutdown()
+
+    assert len(recorder.changes) == 1
+
+
+def test_failing_callback_does_not_stop_delivery():
+    dispatcher = ConfigDispatcher(max_workers=1)
+    recorder = Recorder()
+
+    def broken(change):
+        raise RuntimeError("boom")
+
+    dispatcher.add(KEY, broken)
+    dispatcher.add(KEY, recorder)
+    dispatcher.dispatch(KEY, {"a": 1})
+    dispatcher.shutdown()
+
+    assert len(recorder.changes) == 1
+
+
+def test_remove():
+    dispatcher = ConfigDispatcher()
+    first, second = Recorder(), Recorder()
+    dispatcher.add(KEY, first)
+    dispatcher.add(KEY, second)
+
+    assert dispatcher.remove(KEY, first) == 1
+    assert dispatcher.has_callbacks(KEY)
+    assert dispatcher.remove(KEY) == 1
+    assert not dispatcher.has_callbacks(KEY)
@@ -0,0 +1,107 @@
+import threading
+import time
+from urllib.parse import quote
+
+import pytest
+
+import util
+from config_listener import ConfigListener, content_md5, parse_changed_keys
+
+LISTENER_PATH = "/nacos/v1/cs/configs/listener"
+CONFIG_PATH = "/nacos/v1/cs/configs"
+
+
+def wait_until(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class Changes:
+    """
+    记录on_change回调收到的(dataId, 内容)
+    """
+
+    def __init__(self):
+        self.items = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sub, content):
+        with self._lock:
+            self.items.append((sub.data_id, content))
+
+    def data_ids(self):
+        with self._lock:
+            return sorted(d for d, _ in self.items)
+
+
+@pytest.fixture
+def make_listener(fake_nacos):
+    host = util.HostClient(host=fake_nacos.address)
+    listeners = []
+
+    def make(**kwargs):
+        changes = Changes()
+        listener = ConfigListener(host_getter=lambda: host, url_wrapper=lambda url: url,
+                                  token_refresher=lambda: None, on_change=changes,
+                                  pulling_timeout=1, **kwargs)
+        listeners.append(listener)
+        return listener, changes
+
+    yield make
+    for listener in listeners:
+        listener.stop()
+
+
+def test_parse_changed_keys():
+    text = quote("a.yaml\x02DEFAULT_GROUP\x02dipper\x01b.yaml\x02G\x01")
+
+    assert parse_changed_keys(text) == [("a.yaml", "DEFAULT_GROUP", "dipper"), ("b.yaml", "G", "")]
+    assert parse_changed_keys("") == []
+
+
+def test_one_thread_polls_all_subscriptions(fake_nacos, make_listener):
+    listener, changes = make_listener()
+    for name in ("a", "b", "c"):
+        fake_nacos.publish_config(name + ".yaml", "name: " + name)
+        listener.add(name + ".yaml", "DEFAULT_GROUP", "")
+
+    listener.start()
+
+    assert wait_until(lambda: changes.data_ids() == ["a.yaml", "b.yaml", "c.yaml"])
+    # 一次长轮询返回全部变更，只拉取变更的配置
+    assert fake_nacos.request_count[LISTENER_PATH] <= 2
+    assert fake_nacos.request_count[CONFIG_PATH] == 3
+    assert listener.get("b.yaml", "DEFAULT_GROUP", "").md5 == content_md5("name: b")
+
+
+def test_only_changed_configs_are_fetched(fake_nacos, make_listener):
+    listener, changes = make_listener()
+    for name in ("a", "b", "c"):
+        content = "name: " + name
+        fake_nacos.publish_config(name + ".yaml", content)
+        listener.add(name + ".yaml", "DEFAULT_GROUP", "", md5=content_md5(content), content=content)
+    listener.start()
+    assert wait_until(lambda: fake_nacos.request_count.get(LISTENER_PATH, 0) >= 1)
+
+    fake_nacos.publish_config("b.yaml", "name: b2")
+
+    assert wait_until(lambda: changes.items == [("b.yaml", "name: b2")])
+    assert fake_nacos.request_count[CONFIG_PATH] == 1
+
+
+def test_subscriptions_are_polled_in_batches(fake_nacos, make_listener):
+    listener, changes = make_listener(batch_size=2)
+    names = ["c%d.yaml" % i for i in range(5)]
+    for name in names:
+        fake_nacos.publish_config(name, "name: " + name)
+        listener.add(name, "DEFAULT_GROUP", "")
+
+    assert [len(batch) for batch in listener._batches()] == [2, 2, 1]
+
+    listener.start()
+
+    assert wait_until(lambda: changes.data_ids() == names)
@@ -0,0 +1,61 @@
+import json
+import time
+
+from push_receiver import PushReceiver
+
+SERVICE_NAME = "dipper-gateway"
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_query_subscribes_with_udp_port(fake_nacos, nacos_client):
+    fake_nacos.set_instances(SERVICE_NAME, [{"ip": "10.0.0.1", "port": 80}])
+    port = nacos_client.enable_push(client_ip="127.0.0.1")
+
+    assert nacos_client.get_server_instance(SERVICE_NAME) == "http://10.0.0.1:80"
+    subscribers = fake_nacos._subscribers[("DEFAULT_GROUP@@" + SERVICE_NAME, "DEFAULT")]
+    assert ("127.0.0.1", port) in subscribers
+
+
+def test_push_updates_cache_and_acks(fake_nacos, nacos_client):
+    fake_nacos.set_instances(SERVICE_NAME, [{"ip": "10.0.0.1", "port": 80}])
+    nacos_client.enable_push(client_ip="127.0.0.1")
+    nacos_client.get_server_instance(SERVICE_NAME)
+    queries = fake_nacos.request_count.get("/nacos/v1/ns/instance/list", 0)
+
+    acks = fake_nacos.set_instances(SERVICE_NAME, [{"ip": "10.0.0.2", "port": 8080}], push=True)
+
+    assert len(acks) == 1
+    assert acks[0]["type"] == "push-ack"
+    assert wait_until(lambda: nacos_client.get_server_instance(SERVICE_NAME) == "http://10.0.0.2:8080")
+    # 推送直接写入缓存，不需要再查询服务端
+    assert fake_nacos.request_count.get("/nacos/v1/ns/instance/list", 0) == queries
+
+
+def test_push_to_unsubscribed_client_is_not_sent(fake_nacos, nacos_client):
+    fake_nacos.set_instances(SERVICE_NAME, [{"ip": "10.0.0.1", "port": 80}])
+    nacos_client.get_server_instance(SERVICE_NAME)
+
+    acks = fake_nacos.set_instances(SERVICE_NAME, [{"ip": "10.0.0.2", "port": 80}], push=True)
+
+    assert acks == []
+    assert nacos_client.get_server_instance(SERVICE_NAME) == "http://10.0.0.1:80"
+
+
+def test_receiver_acks_unknown_push_type():
+    pushed = []
+    receiver = PushReceiver(on_push=lambda key, info: pushed.append(key), host="127.0.0.1")
+    try:
+        ack = receiver.handle(json.dumps({"type": "dump", "lastRefTime": 7}).encode("UTF-8"))
+    finally:
+        receiver.stop()
+
+    assert ack == {"type": "unknown-ack", "lastRefTime": 7, "data": ""}
+    assert pushed == []
@@ -0,0 +1,103 @@
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def sample(text, name):
+    """
+    从Prometheus文本中取出一个样本的值，不存在时返回None
+    """
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line[len(name) + 1:])
+    return None
+
+
+def test_counter_and_gauge_render_labels():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "请求数", ["host"]))
+    depth = registry.register(Gauge("queue_depth", "队列长度"))
+
+    requests.inc(host="a")
+    requests.inc(2, host='b"1')
+    depth.set(5)
+    depth.dec()
+    text = registry.render()
+
+    assert "# TYPE requests_total counter" in text
+    assert sample(text, 'requests_total{host="a"}') == 1
+    assert sample(text, 'requests_total{host="b\\"1"}') == 2
+    assert sample(text, "queue_depth") == 4
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "耗时", buckets=(0.1, 1))
+
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    text = "\n".join(histogram.render())
+
+    assert sample(text, 'latency_seconds_bucket{le="0.1"}') == 2
+    assert sample(text, 'latency_seconds_bucket{le="1"}') == 3
+    assert sample(text, 'latency_seconds_bucket{le="+Inf"}') == 4
+    assert sample(text, "latency_seconds_sum") == pytest.approx(3.65)
+    assert sample(text, "latency_seconds_count") == 4
+
+
+def test_histogram_time_records_on_error():
+    histogram = Histogram("job_seconds", "耗时", ["status"])
+
+    with pytest.raises(RuntimeError):
+        with histogram.time(status="failed"):
+            raise RuntimeError("boom")
+
+    assert sample("\n".join(histogram.render()), 'job_seconds_count{status="failed"}') == 1
+
+
+def test_wrong_labels_are_rejected():
+    with pytest.raises(ValueError, match="标签"):
+        Counter("c_total", "计数", ["host"]).inc(model="m")
+
+
+def test_registry_returns_the_existing_metric():
+    registry = Registry()
+    first = registry.register(Counter("c_total", "计数", ["host"]))
+
+    assert registry.register(Counter("c_total", "计数", ["host"])) is first
+    with pytest.raises(ValueError, match="已注册"):
+        registry.register(Gauge("c_total", "计数", ["host"]))
+
+
+def test_callback_metrics_and_failures():
+    registry = Registry()
+    registry.register(Gauge("cache_models", "缓存模型数", fn=lambda: 3))
+    registry.register(Gauge("pool_size", "连接数", ["host"], fn=lambda: {("a",): 1, ("b",): 2}))
+    registry.register(Gauge("broken", "取值失败", fn=lambda: 1 / 0))
+
+    text = registry.render()
+
+    assert sample(text, "cache_models") == 3
+    assert sample(text, 'pool_size{host="b"}') == 2
+    # 取值失败的指标注明原因，不影响其他指标
+    assert "# broken 输出失败" in text
+
+
+def test_beats_are_measured_per_host(fake_nacos, nacos_client):
+    try:
+        nacos_client.register_service("10.0.0.1", "naas-ai", 8080)
+        info = nacos_client.beat_reactor.entries()[0]
+    finally:
+        nacos_client.beat_reactor.stop()
+    name = 'nacos_beat_duration_seconds_count{host="%s"}' % fake_nacos.address
+    failures = 'nacos_beat_failures_total{host="%s",reason="status"}' % fake_nacos.address
+    beats = sample(metrics.render(), name) or 0
+    failed = sample(metrics.render(), failures) or 0
+
+    nacos_client._Nacos__send_beat(info)
+    fake_nacos.routes[("PUT", "/nacos/v1/ns/instance/beat")] = lambda params, headers: (500, "busy")
+    nacos_client._Nacos__send_beat(info)
+
+    text = metrics.render()
+    assert sample(text, name) == beats + 2
+    assert sample(text, failures) == failed + 1
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+
+import pytest
+
+from model_cache import ModelCache
+
+
+class Loader:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.loaded = []
+
+    def __call__(self, path):
+        time.sleep(self.delay)
+        self.loaded.append(os.path.basename(path))
+        with open(path) as f:
+            return f.read()
+
+
+@pytest.fixture
+def models(tmp_path):
+    def write(name, content="model", size=None):
+        path = tmp_path / name
+        path.write_text(content if size is None else "x" * size)
+        return str(path)
+    return write
+
+
+def test_hit_after_first_load(models):
+    loader = Loader()
+    cache = ModelCache(loader=loader)
+    path = models("a.ubj", "A")
+
+    assert cache.get(path) == "A"
+    assert cache.get(path) == "A"
+    assert loader.loaded == ["a.ubj"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used_by_count(models):
+    loader = Loader()
+    cache = ModelCache(max_count=2, loader=loader)
+    a, b, c = models("a.ubj"), models("b.ubj"), models("c.ubj")
+
+    cache.get(a)
+    cache.get(b)
+    cache.get(a)
+    cache.get(c)
+
+    assert [os.path.basename(p) for p in cache.stats()["models"]] == ["a.ubj", "c.ubj"]
+    cache.get(b)
+    assert loader.loaded == ["a.ubj", "b.ubj", "c.ubj", "b.ubj"]
+
+
+def test_evicts_by_bytes_but_keeps_newest(models):
+    cache = ModelCache(max_count=10, max_bytes=150, loader=Loader())
+    a, b = models("a.ubj", size=100), models("b.ubj", size=100)
+    big = models("big.ubj", size=500)
+
+    cache.get(a)
+    cache.get(b)
+    assert [os.path.basename(p) for p in cache.stats()["models"]] == ["b.ubj"]
+    # 超过上限的单个模型仍然缓存
+    cache.get(big)
+    assert cache.stats()["count"] == 1
+    assert cache.stats()["bytes"] == 500
+
+
+def test_overwritten_file_is_reloaded(models):
+    cache = ModelCache(loader=Loader())
+    path = models("a.ubj", "old")
+    assert cache.get(path) == "old"
+
+    models("a.ubj", "new")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+
+    assert cache.get(path) == "new"
+    assert cache.stats()["count"] == 1
+
+
+def test_invalidate(models):
+    cache = ModelCache(loader=Loader())
+    a, b = models("a.ubj"), models("b.ubj")
+    cache.get(a)
+    cache.get(b)
+
+    cache.invalidate(a)
+    assert [os.path.basename(p) for p in cache.stats()["models"]] == ["b.ubj"]
+    cache.invalidate()
+    assert cache.stats()["count"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_concurrent_gets_load_once(models):
+    loader = Loader(delay=0.1)
+    cache = ModelCache(loader=loader)
+    path = models("a.ubj")
+    threads = [threading.Thread(target=cache.get, args=(path,)) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.loaded == ["a.ubj"]
+    assert cache._load_locks == {}
+
+
+def test_load_locks_do_not_outlive_loads(models):
+    cache = ModelCache(max_count=2, loader=Loader())
+    for i in range(20):
+        cache.get(models("m%d.ubj" % i))
+
+    def broken(path):
+        raise ValueError("bad model")
+
+    cache.loader = broken
+    with pytest.raises(ValueError):
+        cache.get(models("bad.ubj"))
+
+    # 加载结束或失败后移除锁，不随模型文件数增长
+    assert cache._load_locks == {}
+    assert cache.stats()["count"] == 2
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ModelCache(loader=Loader()).get(str(tmp_path / "missing.ubj"))
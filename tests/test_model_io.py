@@ -0,0 +1,64 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+xgb = pytest.importorskip("xgboost")
+
+import model_io  # noqa: E402
+import model_meta  # noqa: E402
+
+
+@pytest.fixture
+def regressor():
+    rng = np.random.default_rng(5)
+    feature = rng.random((60, 3), dtype=np.float32)
+    model = xgb.XGBRegressor(n_estimators=5, max_depth=2)
+    model.fit(feature, feature.sum(axis=1))
+    return model, feature
+
+
+def test_native_round_trip(tmp_path, regressor):
+    model, feature = regressor
+    path = model_io.save_model(model, str(tmp_path / "m.ubj"))
+
+    booster = model_io.load_model(path)
+
+    assert isinstance(booster, xgb.Booster)
+    np.testing.assert_allclose(booster.inplace_predict(feature), model.predict(feature), rtol=1e-6)
+    assert os.listdir(tmp_path) == ["m.ubj"]
+
+
+def test_unknown_suffix(tmp_path):
+    with pytest.raises(ValueError, match="不支持的模型格式"):
+        model_io.load_model(str(tmp_path / "m.bin"))
+
+
+def test_migrate_pickle(tmp_path, regressor):
+    model, feature = regressor
+    pickle_path = str(tmp_path / "m_acc=0.75.pkl")
+    joblib.dump(model, pickle_path)
+
+    path = model_io.migrate(pickle_path, remove=True)
+
+    assert path == str(tmp_path / "m_acc=0.75.ubj")
+    assert not os.path.exists(pickle_path)
+    np.testing.assert_allclose(model_io.load_model(path).inplace_predict(feature),
+                               model.predict(feature), rtol=1e-6)
+    meta = model_meta.load_meta(path)
+    assert meta["migratedFrom"] == "m_acc=0.75.pkl"
+    assert (meta["accuracy"], meta["features"], meta["rounds"]) == (0.75, 3, 5)
+
+
+def test_migrate_dir_skips_migrated_models(tmp_path, regressor):
+    model, _ = regressor
+    joblib.dump(model, str(tmp_path / "a.pkl"))
+    joblib.dump(model, str(tmp_path / "b.pkl"))
+    model_io.save_model(model, str(tmp_path / "b.ubj"))
+    (tmp_path / "c.pkl").write_bytes(b"not a pickle")
+
+    paths = model_io.migrate_dir(str(tmp_path))
+
+    assert paths == [str(tmp_path / "a.ubj")]
+    assert os.path.exists(str(tmp_path / "a.pkl"))
@@ -0,0 +1,37 @@
+import model_meta
+
+
+def test_lineage_follows_parents(tmp_path):
+    root = str(tmp_path / "a.ubj")
+    child = str(tmp_path / "b.ubj")
+    grandchild = str(tmp_path / "c.ubj")
+    model_meta.save_meta(root, model_meta.build_meta(root, rows=100, features=3, accuracy=0.8, rounds=50))
+    model_meta.save_meta(child, model_meta.build_meta(child, rows=20, features=3, accuracy=0.85,
+                                                      rounds=60, parent_path=root))
+
+    meta = model_meta.build_meta(grandchild, rows=10, features=3, accuracy=0.9, rounds=70,
+                                 parent_path=child, seconds=1.5)
+
+    assert meta["parent"] == "b.ubj"
+    assert meta["lineage"] == ["a.ubj", "b.ubj"]
+    assert (meta["rows"], meta["rowsSeen"]) == (10, 130)
+    assert meta["seconds"] == 1.5
+
+
+def test_parent_without_meta_keeps_known_rows(tmp_path):
+    meta = model_meta.build_meta(str(tmp_path / "b.ubj"), rows=20, features=3, accuracy=0.8,
+                                 rounds=10, parent_path=str(tmp_path / "old.ubj"))
+
+    assert meta["lineage"] == ["old.ubj"]
+    assert meta["rowsSeen"] == 20
+
+
+def test_load_meta_missing_or_broken(tmp_path):
+    path = str(tmp_path / "m.ubj")
+    assert model_meta.load_meta(path) is None
+
+    with open(model_meta.meta_path(path), "w") as f:
+        f.write("{broken")
+
+    assert model_meta.load_meta(path) is None
+    assert model_meta.is_meta_file("m.meta.json")
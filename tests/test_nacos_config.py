@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+import files
+from nacos import DEFAULTS, group_key
+
+DATA_ID = "naas-ai.yaml"
+TENANT = "dipper"
+CONFIG_ROUTE = ("GET", "/nacos/v1/cs/configs")
+
+
+def wait_until(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def client(nacos_client):
+    nacos_client.config_listener.pulling_timeout = 1
+    nacos_client.register_service("10.0.0.1", "naas-ai", 8080)
+    yield nacos_client
+    nacos_client.config_listener.stop()
+    nacos_client.beat_reactor.stop()
+
+
+def subscribed(client) -> bool:
+    return client.config_listener.get(DATA_ID, "DEFAULT_GROUP", TENANT) is not None
+
+
+def test_config_is_fetched_and_followed(fake_nacos, client):
+    fake_nacos.publish_config(DATA_ID, "a: 1", tenant=TENANT)
+    app_config = {}
+
+    client.config(app_config)
+
+    assert app_config == {"a": 1}
+    fake_nacos.publish_config(DATA_ID, "a: 2", tenant=TENANT)
+    assert wait_until(lambda: app_config == {"a": 2})
+    snapshot = files.read_file_str(DEFAULTS["SNAPSHOT_BASE"],
+                                   group_key(DATA_ID, "DEFAULT_GROUP", TENANT) + ".yml")
+    assert "a: 2" in snapshot
+
+
+def test_failed_fetch_is_retried_by_the_listener(fake_nacos, client):
+    fake_nacos.publish_config(DATA_ID, "a: 1", tenant=TENANT)
+    get_config = fake_nacos.routes[CONFIG_ROUTE]
+    fake_nacos.routes[CONFIG_ROUTE] = lambda params, headers: (500, "busy")
+    app_config = {}
+
+    client.config(app_config)
+
+    assert app_config == {}
+    assert subscribed(client)
+    fake_nacos.routes[CONFIG_ROUTE] = get_config
+    assert wait_until(lambda: app_config == {"a": 1})
+
+
+def test_snapshot_start_waits_for_a_missing_config(fake_nacos, client):
+    files.save_file(DEFAULTS["SNAPSHOT_BASE"],
+                    group_key(DATA_ID, "DEFAULT_GROUP", TENANT) + ".yml", {"a": 0})
+    app_config = {}
+
+    client.config(app_config)
+
+    # 本地快照先生效，服务端没有该配置时后台拉取失败但仍加入监听
+    assert app_config == {"a": 0}
+    assert wait_until(lambda: subscribed(client))
+    time.sleep(0.2)
+    assert app_config == {"a": 0}
+    fake_nacos.publish_config(DATA_ID, "a: 1", tenant=TENANT)
+    assert wait_until(lambda: app_config == {"a": 1})
+
+
+def test_deleted_config_is_notified_once(fake_nacos, client):
+    fake_nacos.publish_config(DATA_ID, "a: 1", tenant=TENANT)
+    changes = []
+    client.config({}, callback=changes.append)
+    assert wait_until(lambda: len(changes) == 1)
+
+    fake_nacos.remove_config(DATA_ID, tenant=TENANT)
+
+    assert wait_until(lambda: len(changes) == 2)
+    assert changes[1].config == {}
+    assert changes[1].removed == {"a": 1}
+    sub = client.config_listener.get(DATA_ID, "DEFAULT_GROUP", TENANT)
+    assert (sub.md5, sub.content) == ("", "")
+    fetches = fake_nacos.request_count["/nacos/v1/cs/configs"]
+    time.sleep(0.3)
+    # md5已更新为空，长轮询挂起等待而不是反复拉取
+    assert fake_nacos.request_count["/nacos/v1/cs/configs"] == fetches
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from predict_batcher import PredictBatcher
+
+
+class Recorder:
+    """
+    预测方法：返回每行之和，记录每次调用的行数
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, model, x):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls.append((model, len(x)))
+        return x.sum(axis=1)
+
+
+@pytest.fixture
+def make_batcher():
+    batchers = []
+
+    def make(predict_fn, **kwargs):
+        batcher = PredictBatcher(predict_fn, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield make
+    for batcher in batchers:
+        batcher.stop()
+
+
+def run_sessions(batcher, model, inputs):
+    """
+    每个输入一个线程，在各自的会话中提交一次预测
+    """
+    results = [None] * len(inputs)
+    sessions = [batcher.session(model) for _ in inputs]
+    for session in sessions:
+        session.__enter__()
+
+    def submit(i):
+        try:
+            results[i] = batcher.predict(model, inputs[i])
+        finally:
+            sessions[i].__exit__(None, None, None)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_sessions_are_merged(make_batcher):
+    recorder = Recorder()
+    batcher = make_batcher(recorder, max_latency=5)
+    inputs = [np.full((2, 3), i, dtype=np.float32) for i in range(3)]
+
+    results = run_sessions(batcher, "m", inputs)
+
+    # 3个活跃会话都提交后立即合并执行，不等max_latency
+    assert recorder.calls == [("m", 6)]
+    for i, y in enumerate(results):
+        np.testing.assert_array_equal(y, [3 * i, 3 * i])
+    assert batcher.stats()["avgRequestsPerBatch"] == 3
+
+
+def test_lone_session_does_not_wait(make_batcher):
+    batcher = make_batcher(Recorder(), max_latency=5)
+    start = time.monotonic()
+
+    with batcher.session("m"):
+        for _ in range(3):
+            batcher.predict("m", np.ones((2, 3), dtype=np.float32))
+
+    assert time.monotonic() - start < 1
+
+
+def test_idle_session_delays_at_most_max_latency(make_batcher):
+    batcher = make_batcher(Recorder(), max_latency=0.05)
+    start = time.monotonic()
+
+    with batcher.session("m"), batcher.session("m"):
+        # 另一个会话没有提交，等满max_latency后单独执行
+        y = batcher.predict("m", np.ones((1, 3), dtype=np.float32))
+
+    assert y.tolist() == [3]
+    assert 0.04 <= time.monotonic() - start < 1
+
+
+def test_large_request_bypasses_the_queue(make_batcher):
+    recorder = Recorder()
+    batcher = make_batcher(recorder, max_batch_rows=4)
+
+    batcher.predict("m", np.ones((4, 3), dtype=np.float32))
+
+    assert recorder.calls == [("m", 4)]
+    assert batcher.batches == 0
+
+
+def test_errors_reach_every_request(make_batcher):
+    def broken(model, x):
+        raise ValueError("bad features")
+
+    batcher = make_batcher(broken, max_latency=5)
+    errors = []
+
+    def submit():
+        with pytest.raises(ValueError) as e:
+            batcher.predict("m", np.ones((1, 3), dtype=np.float32))
+        errors.append(e.value)
+
+    with batcher.session("m"), batcher.session("m"):
+        threads = [threading.Thread(target=submit) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+    assert len(errors) == 2
+
+
+def test_batches_of_different_models_overlap(make_batcher):
+    batcher = make_batcher(Recorder(delay=0.3), max_workers=2)
+    threads = [threading.Thread(target=run_sessions,
+                                args=(batcher, model, [np.ones((1, 3), dtype=np.float32)]))
+               for model in ("a", "b")]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert time.monotonic() - start < 0.55
+    assert batcher.batches == 2
+
+
+def test_parked_stream_does_not_delay_other_callers(monkeypatch):
+    xgb = pytest.importorskip("xgboost")
+    import prediction_code
+
+    rng = np.random.default_rng(6)
+    feature = rng.random((50, 3), dtype=np.float32)
+    model = xgb.train({}, xgb.DMatrix(feature, feature.sum(axis=1)), 3)
+    monkeypatch.setattr(prediction_code.predict_batcher, "max_latency", 0.2)
+    batches = ((["k%d" % i], feature[i:i + 1]) for i in range(3))
+    stream = prediction_code.predict_chunks(model, batches, 5, batching=True)
+    # 流式响应发出第一块后，客户端读取慢，生成器挂起
+    next(stream)
+
+    start = time.monotonic()
+    prediction_code.forecast(model, feature[:2], 5, batching=True)
+
+    # 挂起的流不占用合批会话，5步预测不必每步等待max_latency
+    assert time.monotonic() - start < 0.2
+    stream.close()
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+xgb = pytest.importorskip("xgboost")
+
+import prediction_code  # noqa: E402
+
+
+def naive_forecast(predict_fn, feature, num_future_points):
+    """
+    逐步拼接新特征的原始写法，作为对照
+    """
+    feature = feature.copy()
+    predictions = []
+    for _ in range(num_future_points):
+        y = predict_fn(None, feature)
+        predictions.append(y)
+        feature = np.hstack([feature[:, 1:], y.reshape(-1, 1)])
+    return np.column_stack(predictions)
+
+
+def window_mean(model, x):
+    return x.mean(axis=1)
+
+
+@pytest.fixture
+def booster():
+    rng = np.random.default_rng(0)
+    feature = rng.random((200, 4), dtype=np.float32)
+    return xgb.train({"max_depth": 3}, xgb.DMatrix(feature, feature.mean(axis=1)), 10)
+
+
+def test_recursive_forecast_matches_naive_loop():
+    feature = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    result = prediction_code.recursive_forecast(None, feature, 5, predict_fn=window_mean)
+
+    assert result.shape == (3, 5)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, naive_forecast(window_mean, feature, 5), rtol=1e-6)
+
+
+def test_recursive_forecast_passes_window_views():
+    windows = []
+
+    def record(model, x):
+        windows.append(x)
+        return x[:, -1] + 1
+
+    feature = np.zeros((2, 3), dtype=np.float32)
+    result = prediction_code.recursive_forecast(None, feature, 3, predict_fn=record)
+
+    np.testing.assert_array_equal(result, [[1, 2, 3], [1, 2, 3]])
+    # 每一步的特征都是同一块缓冲区上的切片，不复制
+    assert all(w.shape == (2, 3) for w in windows)
+    assert all(w.base is result.base for w in windows)
+
+
+def test_predict_rows_matches_booster_predict(booster):
+    x = np.random.default_rng(1).random((20, 6), dtype=np.float32)[:, 1:5]
+
+    expected = booster.predict(xgb.DMatrix(np.ascontiguousarray(x)))
+
+    np.testing.assert_allclose(prediction_code.predict_rows(booster, x), expected, rtol=1e-6)
+
+
+def test_iter_predictions_chunks_rows(booster):
+    feature = np.random.default_rng(2).random((25, 4), dtype=np.float32)
+    keys = ["k%d" % i for i in range(25)]
+
+    chunks = list(prediction_code.iter_predictions(booster, keys, feature, 3, chunk_rows=10))
+
+    assert [len(df) for df in chunks] == [10, 10, 5]
+    assert list(chunks[0].columns) == ["cgi", "0", "1", "2"]
+    assert list(chunks[2]["cgi"]) == keys[20:]
+    whole = prediction_code.recursive_forecast(booster, feature, 3)
+    np.testing.assert_allclose(np.vstack([df.iloc[:, 1:].to_numpy() for df in chunks]), whole,
+                               rtol=1e-6)
+
+
+def test_read_feature_chunks_reads_float32_blocks(tmp_path):
+    import io
+
+    csv = b"cgi,a,b,c,extra\n" + b"".join(b"k%d,%d,1.5,2,text\n" % (i, i) for i in range(7))
+    source = io.BytesIO(csv)
+
+    batches = list(prediction_code.read_feature_chunks(source, 4, chunk_rows=3, close_source=True))
+
+    assert [len(key) for key, _ in batches] == [3, 3, 1]
+    key, feature = batches[0]
+    assert list(key) == ["k0", "k1", "k2"]
+    # 只读取cgi和特征列，特征直接解析为float32
+    assert feature.dtype == np.float32
+    assert feature.shape == (3, 3)
+    np.testing.assert_array_equal(feature[:, 0], [0, 1, 2])
+    assert source.closed
+
+
+class FakeBuilding:
+    """
+    代替xgb_predict_building，记录并发数，按候选序号返回准确率
+    """
+
+    def __init__(self, delay=0.02, fail_at=None):
+        self.delay = delay
+        self.fail_at = fail_at
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, X_train, X_test, y_train, y_test, i, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if i == self.fail_at:
+                raise RuntimeError("fit failed")
+            # 第3个候选最优
+            return "model-%d" % i, 1.0 if i == 2 else i / 100.0
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def fake_building(monkeypatch):
+    building = FakeBuilding()
+    monkeypatch.setattr(prediction_code, "xgb_predict_building", building)
+    monkeypatch.setattr(prediction_code, "_best_rounds", lambda model: 1)
+    return building
+
+
+@pytest.mark.parametrize("parallel", [1, 3])
+def test_select_model_keeps_the_best_candidate(fake_building, parallel):
+    feature = np.zeros((20, 3), dtype=np.float32)
+    progress = []
+
+    model, acc, stats = prediction_code.select_model(
+        feature, feature[:, 0], n_jobs=6, candidates=8, parallel=parallel,
+        progress=lambda p, msg: progress.append(p))
+
+    assert (model, acc) == ("model-2", 1.0)
+    assert [s["candidate"] for s in stats] == list(range(1, 9))
+    assert fake_building.max_active == parallel
+    assert sorted(progress) == [i / 8.0 for i in range(1, 9)]
+
+
+def test_select_model_generates_splits_lazily(fake_building, monkeypatch):
+    generated = []
+    iter_splits = prediction_code.iter_splits
+
+    def recording(*args, **kwargs):
+        for split in iter_splits(*args, **kwargs):
+            generated.append(fake_building.active)
+            yield split
+
+    monkeypatch.setattr(prediction_code, "iter_splits", recording)
+    feature = np.zeros((20, 3), dtype=np.float32)
+
+    prediction_code.select_model(feature, feature[:, 0], n_jobs=4, candidates=10, parallel=2)
+
+    assert len(generated) == 10
+    # 生成新划分时最多只有parallel个候选在训练
+    assert max(generated) <= 2
+
+
+def test_select_model_uses_one_candidate_per_fold(fake_building):
+    feature = np.zeros((20, 3), dtype=np.float32)
+
+    _, _, stats = prediction_code.select_model(feature, feature[:, 0], n_jobs=4, candidates=10,
+                                               cv_folds=4, parallel=2)
+
+    assert len(stats) == 4
+
+
+def test_select_model_raises_candidate_errors(fake_building):
+    fake_building.fail_at = 1
+    feature = np.zeros((20, 3), dtype=np.float32)
+
+    with pytest.raises(RuntimeError, match="fit failed"):
+        prediction_code.select_model(feature, feature[:, 0], n_jobs=4, candidates=10, parallel=2)
+
+
+def test_early_stopping_limits_rounds():
+    rng = np.random.default_rng(3)
+    feature = rng.random((200, 4), dtype=np.float32)
+    # 标签是噪声，验证集误差很快不再下降
+    label = rng.random(200, dtype=np.float32) + 1
+
+    model, acc, stats = prediction_code.select_model(feature, label, n_jobs=2, candidates=2,
+                                                     n_estimators=300, early_stopping_rounds=5)
+
+    assert 0 <= acc <= 1
+    assert all(s["rounds"] < 300 for s in stats)
+    assert prediction_code._best_rounds(model) < 300
+
+
+def test_warm_start_continues_from_the_base_model(tmp_path, monkeypatch):
+    import model_io
+    import model_meta
+
+    monkeypatch.setattr(prediction_code.requests, "get", lambda url: None)
+    rng = np.random.default_rng(4)
+    feature = rng.random((100, 4), dtype=np.float32)
+    label = feature.sum(axis=1) + 1
+
+    base_path = prediction_code.model_training(feature, label, str(tmp_path / "base"), "http://ai", "p",
+                                               n_jobs=2, candidates=1, n_estimators=20,
+                                               early_stopping_rounds=0)
+    path = prediction_code.model_training(feature, label, str(tmp_path / "next"), "http://ai", "p",
+                                          n_jobs=2, candidates=1, n_estimators=10,
+                                          early_stopping_rounds=0, base_model_path=base_path)
+
+    # 增量训练在基础模型的20轮之后继续迭代10轮
+    assert model_io.load_model(path).num_boosted_rounds() == 30
+    meta = model_meta.load_meta(path)
+    assert meta["parent"] == meta["lineage"][-1] == os.path.basename(base_path)
+    assert meta["rowsSeen"] == 200
+    assert meta["rounds"] == 30
@@ -0,0 +1,110 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import result_stream
+
+
+def chunks(n=3, rows=4):
+    return [pd.DataFrame({"cgi": ["k%d_%d" % (i, j) for j in range(rows)],
+                          "0": [float(i * rows + j) for j in range(rows)]})
+            for i in range(n)]
+
+
+def expected():
+    return pd.concat(chunks(), ignore_index=True)
+
+
+def test_csv_writes_header_once():
+    parts = list(result_stream.encode(chunks(), "csv"))
+
+    assert len(parts) == 3
+    df = pd.read_csv(io.BytesIO(b"".join(parts)), dtype={"cgi": str})
+    pd.testing.assert_frame_equal(df, expected())
+
+
+def test_arrow_stream_sends_one_batch_per_chunk():
+    pyarrow = pytest.importorskip("pyarrow")
+
+    parts = list(result_stream.encode(chunks(), "arrow"))
+
+    reader = pyarrow.ipc.open_stream(b"".join(parts))
+    batches = list(reader)
+    assert [b.num_rows for b in batches] == [4, 4, 4]
+    pd.testing.assert_frame_equal(pyarrow.Table.from_batches(batches).to_pandas(), expected())
+
+
+def test_parquet_writes_one_row_group_per_chunk():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    parts = list(result_stream.encode(chunks(), "parquet"))
+
+    # 每块写完即发送，不是最后一次性输出
+    assert len(parts) > 2
+    parquet = pyarrow.parquet.ParquetFile(io.BytesIO(b"".join(parts)))
+    assert parquet.num_row_groups == 3
+    pd.testing.assert_frame_equal(parquet.read().to_pandas(), expected())
+
+
+@pytest.mark.parametrize("fmt", ["csv", "arrow", "parquet"])
+def test_saved_file_matches_stream(tmp_path, fmt):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / ("result" + result_stream.file_suffix(fmt)))
+
+    body = b"".join(result_stream.encode(chunks(), fmt, save_path=path))
+
+    with open(path, "rb") as f:
+        assert f.read() == body
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_empty_input_yields_nothing():
+    assert list(result_stream.encode([], "csv")) == []
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError, match="不支持的输出格式"):
+        result_stream.check_format("xlsx")
+    assert result_stream.check_format("CSV") == "csv"
+
+
+def failing_chunks():
+    yield chunks(1)[0]
+    raise RuntimeError("predict failed\nat chunk 2")
+
+
+@pytest.mark.parametrize("fmt", ["csv", "arrow", "parquet"])
+def test_error_after_first_chunk_is_marked(tmp_path, fmt):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / "result")
+    parts = []
+
+    with pytest.raises(RuntimeError):
+        for part in result_stream.encode(failing_chunks(), fmt, save_path=path):
+            parts.append(part)
+
+    assert parts[-1] == result_stream.ERROR_MARKER + "predict failed at chunk 2\n".encode("utf-8")
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_marked_arrow_and_parquet_are_not_readable():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    def body(fmt):
+        parts = []
+        with pytest.raises(RuntimeError):
+            for part in result_stream.encode(failing_chunks(), fmt):
+                parts.append(part)
+        return b"".join(parts)
+
+    with pytest.raises(pyarrow.ArrowInvalid):
+        pyarrow.ipc.open_stream(body("arrow")).read_all()
+    with pytest.raises(pyarrow.ArrowInvalid):
+        pyarrow.parquet.read_table(io.BytesIO(body("parquet")))
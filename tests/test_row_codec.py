@@ -0,0 +1,91 @@
+import io
+
+import numpy as np
+import pytest
+
+import row_codec
+
+
+def test_detect_format():
+    assert row_codec.detect_format("application/json; charset=utf-8") == row_codec.JSON
+    assert row_codec.detect_format("application/x-npy") == row_codec.NPY
+    assert row_codec.detect_format("application/vnd.apache.arrow.stream") == row_codec.ARROW
+    with pytest.raises(row_codec.RowDecodeError):
+        row_codec.detect_format("text/csv")
+
+
+def test_json_round_trip():
+    keys, feature, params = row_codec.decode(row_codec.JSON, b"", {
+        "modelPath": "m.ubj", "numFuturePoints": 2, "rows": [[1, 2], [3, 4]], "keys": ["a", "b"]})
+    assert keys == ["a", "b"]
+    assert feature.dtype == np.float32
+    assert feature.tolist() == [[1, 2], [3, 4]]
+    assert params == {"modelPath": "m.ubj", "numFuturePoints": 2}
+
+    result = row_codec.encode(row_codec.JSON, keys, np.array([[0.5], [1.5]], dtype=np.float32))
+    assert result["data"] == {"predictions": [[0.5], [1.5]], "keys": ["a", "b"]}
+
+
+def test_single_row_is_reshaped():
+    _, feature, _ = row_codec.decode(row_codec.JSON, b"", {"rows": [1, 2, 3]})
+    assert feature.shape == (1, 3)
+
+
+@pytest.mark.parametrize("body", [
+    None,
+    {"rows": []},
+    {"rows": [["a", "b"]]},
+    {"rows": [[[1]]]},
+    {"rows": [[1, 2]], "keys": ["a", "b"]},
+])
+def test_invalid_json(body):
+    with pytest.raises(row_codec.RowDecodeError):
+        row_codec.decode(row_codec.JSON, b"", body)
+
+
+def test_npy_round_trip():
+    buffer = io.BytesIO()
+    np.save(buffer, np.arange(6, dtype=np.float64).reshape(2, 3))
+    keys, feature, params = row_codec.decode(row_codec.NPY, buffer.getvalue())
+    assert keys is None and params == {}
+    assert feature.dtype == np.float32
+    assert feature.shape == (2, 3)
+
+    out = np.load(io.BytesIO(row_codec.encode(row_codec.NPY, None, feature[:, :1])))
+    assert out.tolist() == [[0], [3]]
+
+
+@pytest.mark.parametrize("body", [b"", b"not npy"])
+def test_invalid_npy(body):
+    with pytest.raises(row_codec.RowDecodeError):
+        row_codec.decode(row_codec.NPY, body)
+
+
+def test_npy_rejects_pickled_objects():
+    buffer = io.BytesIO()
+    np.save(buffer, np.array([{"a": 1}], dtype=object), allow_pickle=True)
+    with pytest.raises(row_codec.RowDecodeError):
+        row_codec.decode(row_codec.NPY, buffer.getvalue())
+
+
+def test_arrow_round_trip():
+    pyarrow = pytest.importorskip("pyarrow")
+    table = pyarrow.table({"cgi": ["a", "b"], "m1": [1.0, 2.0], "m2": [3, 4]})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    keys, feature, _ = row_codec.decode(row_codec.ARROW, sink.getvalue().to_pybytes())
+    assert keys == ["a", "b"]
+    assert feature.tolist() == [[1, 3], [2, 4]]
+
+    body = row_codec.encode(row_codec.ARROW, keys, np.array([[0.5], [1.5]], dtype=np.float32))
+    result = pyarrow.ipc.open_stream(body).read_all()
+    assert result.column_names == ["cgi", "0"]
+    assert result.column("cgi").to_pylist() == ["a", "b"]
+
+
+def test_invalid_arrow():
+    pytest.importorskip("pyarrow")
+    with pytest.raises(row_codec.RowDecodeError):
+        row_codec.decode(row_codec.ARROW, b"not arrow")
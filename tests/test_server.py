@@ -0,0 +1,325 @@
+import io
+
+import numpy as np
+import pytest
+
+xgb = pytest.importorskip("xgboost")
+
+import model_io  # noqa: E402
+import server  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    工作目录为临时目录，dic/models下有一个3个特征的模型m.ubj
+    """
+    monkeypatch.chdir(tmp_path)
+    for name in ("models", "data", "results"):
+        (tmp_path / "dic" / name).mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    feature = rng.random((50, 3), dtype=np.float32)
+    booster = xgb.train({}, xgb.DMatrix(feature, feature.sum(axis=1)), 3)
+    model_io.save_model(booster, "dic/models/m.ubj")
+    (tmp_path / "dic" / "models" / "m.txt").write_text("not a model")
+    server.model_cache.invalidate()
+    return server.app.test_client()
+
+
+def test_predict_rows(client):
+    resp = client.post("/predict/rows", json={"modelPath": "m.ubj", "numFuturePoints": 2,
+                                              "rows": [[1, 2, 3]], "keys": ["a"]})
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data["data"]["keys"] == ["a"]
+    assert np.asarray(data["data"]["predictions"]).shape == (1, 2)
+
+
+@pytest.mark.parametrize("body, msg", [
+    ({"modelPath": "m.ubj", "numFuturePoints": "abc", "rows": [[1, 2, 3]]}, "numFuturePoints"),
+    ({"modelPath": "m.ubj", "numFuturePoints": 0, "rows": [[1, 2, 3]]}, "numFuturePoints"),
+    ({"modelPath": "m.txt", "rows": [[1, 2, 3]]}, "不支持的模型格式"),
+    ({"modelPath": "m.ubj", "rows": [[1, 2]]}, "特征列数"),
+    ({"rows": [[1, 2, 3]]}, "model_path is empty"),
+])
+def test_predict_rows_bad_request(client, body, msg):
+    resp = client.post("/predict/rows", json=body)
+    assert resp.status_code == 400
+    assert resp.get_json()["code"] == 400
+    assert msg in resp.get_json()["msg"]
+
+
+def test_predict_rows_bad_npy(client):
+    resp = client.post("/predict/rows?modelPath=m.ubj", data=b"",
+                       content_type="application/x-npy")
+    assert resp.status_code == 400
+
+
+def test_predict_rows_missing_model(client):
+    resp = client.post("/predict/rows", json={"modelPath": "missing.ubj", "rows": [[1, 2, 3]]})
+    assert resp.status_code == 404
+
+
+def test_predict_rows_npy(client):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ones((4, 3), dtype=np.float32))
+    resp = client.post("/predict/rows?modelPath=m.ubj&numFuturePoints=3", data=buffer.getvalue(),
+                       content_type="application/x-npy")
+    assert resp.status_code == 200
+    assert np.load(io.BytesIO(resp.get_data())).shape == (4, 3)
+
+
+def assert_profiler_released():
+    import sys
+
+    import profiling
+    assert not profiling._profiler_lock.locked()
+    assert sys.getprofile() is None
+
+
+@pytest.mark.parametrize("data", [
+    {},
+    {"dataIndex": "4", "modelName": "x", "file": (io.BytesIO(b"cgi,a,b,c\n"), "empty.csv")},
+    {"dataIndex": "4", "modelPath": "missing.ubj", "file": (io.BytesIO(b"cgi,a,b,c\n1,1,2,3\n"), "a.csv")},
+])
+def test_predict_early_returns_finish_profile(client, data):
+    resp = client.post("/predict", data=data, headers={"X-Profile": "cprofile"})
+    assert resp.get_json()["code"] == 500
+    assert_profiler_released()
+
+
+def test_predict_stream_finishes_profile(client):
+    import profiling
+
+    data = {"dataIndex": "4", "modelPath": "m.ubj",
+            "file": (io.BytesIO(b"cgi,a,b,c\n1,1,2,3\n2,2,3,4\n"), "a.csv")}
+    resp = client.post("/predict", data=data, headers={"X-Profile": "cprofile"})
+    assert resp.status_code == 200
+    assert resp.get_data().startswith(b"cgi,0\n")
+    resp.close()
+    assert_profiler_released()
+    record = profiling.load(resp.headers["X-Profile-Id"])
+    assert record["mode"] == profiling.CPROFILE
+    assert {"load_model", "predict", "send"} <= set(record["stages"])
+
+
+def test_unread_predict_stream_finishes_profile(client):
+    data = {"dataIndex": "4", "modelPath": "m.ubj",
+            "file": (io.BytesIO(b"cgi,a,b,c\n1,1,2,3\n"), "a.csv")}
+    resp = client.post("/predict", data=data, headers={"X-Profile": "cprofile"}, buffered=False)
+    resp.close()
+    assert_profiler_released()
+
+
+@pytest.mark.parametrize("key, value, expected", [
+    ("predict_batch_rows", "500", 500),
+    ("predict_batch_rows", 500, 500),
+    ("predict_batching", "false", False),
+    ("predict_batching", True, True),
+    ("profile_sample_rate", "0.5", 0.5),
+    ("train_parallel_fits", "", None),
+    ("train_cv_folds", 0, 0),
+])
+def test_parse_setting(key, value, expected):
+    assert server.parse_setting(key, value) == expected
+
+
+@pytest.mark.parametrize("key, value", [
+    ("model_cache_size", -1),
+    ("model_cache_size", None),
+    ("predict_batch_rows", "abc"),
+    ("train_max_rounds", 1.5),
+    ("profile_keep", True),
+    ("profile_sample_rate", 2),
+    ("profile_sample_rate", float("nan")),
+    ("predict_batching", "maybe"),
+    ("predict_chunk_rows", [1]),
+])
+def test_parse_setting_rejects(key, value):
+    with pytest.raises(ValueError):
+        server.parse_setting(key, value)
+
+
+def test_invalid_runtime_setting_keeps_old_value(monkeypatch):
+    from config_dispatcher import ConfigChange
+
+    import nacos_config
+    monkeypatch.setattr(nacos_config, "model_cache_size", 8)
+    monkeypatch.setattr(nacos_config, "predict_batch_rows", 65536)
+
+    server.on_config_change(ConfigChange(("a", "g", "t"), {
+        "model_cache_size": -1, "predict_batch_rows": "500"}, {}))
+
+    assert nacos_config.model_cache_size == 8
+    assert nacos_config.predict_batch_rows == 500
+    assert server.prediction_code.predict_batcher.max_batch_rows == 500
+    monkeypatch.undo()
+    server.apply_runtime_settings()
+
+
+class FakeQueue:
+    """
+    记录提交参数的训练队列，full为True时模拟队列已满
+    """
+
+    def __init__(self, full=False):
+        self.full = full
+        self.submitted = []
+
+    def submit(self, fn, *args, name="", **kwargs):
+        from train_queue import QueueFullError, TrainingJob
+        if self.full:
+            raise QueueFullError("训练队列已满，请稍后重试")
+        self.submitted.append(kwargs)
+        return TrainingJob("job-%d" % len(self.submitted), name)
+
+    def cpu_budget(self):
+        return 1
+
+
+def train_form(**extra):
+    csv = b"cgi,a,b,c,y\n" + b"".join(b"%d,1,2,3,6\n" % i for i in range(5))
+    data = {"dataIndex": "4", "modelName": "t", "file": (io.BytesIO(csv), "train.csv")}
+    data.update(extra)
+    return data
+
+
+@pytest.mark.parametrize("cv_folds, expected", [(None, 0), ("0", 0), ("1", 1), ("5", 5)])
+def test_train_cv_folds(client, monkeypatch, cv_folds, expected):
+    queue = FakeQueue()
+    monkeypatch.setattr(server, "train_queue", queue)
+    data = train_form() if cv_folds is None else train_form(cvFolds=cv_folds)
+
+    resp = client.post("/train", data=data)
+
+    assert resp.get_json()["code"] == 200
+    assert queue.submitted[0]["cv_folds"] == expected
+
+
+@pytest.mark.parametrize("cv_folds, msg", [("abc", "整数"), ("1.5", "整数"), ("-1", "不能小于"),
+                                           ("6", "数据行数")])
+def test_train_rejects_bad_cv_folds(client, monkeypatch, cv_folds, msg):
+    queue = FakeQueue()
+    monkeypatch.setattr(server, "train_queue", queue)
+
+    resp = client.post("/train", data=train_form(cvFolds=cv_folds))
+
+    assert resp.status_code == 400
+    assert resp.get_json()["code"] == 400
+    assert msg in resp.get_json()["msg"]
+    assert queue.submitted == []
+
+
+def test_train_returns_429_when_queue_is_full(client, monkeypatch):
+    monkeypatch.setattr(server, "train_queue", FakeQueue(full=True))
+
+    resp = client.post("/train", data=train_form())
+
+    assert resp.status_code == 429
+    assert resp.get_json()["code"] == 429
+
+
+def test_cancel_unknown_job(client):
+    resp = client.delete("/jobs/missing")
+
+    assert resp.status_code == 404
+
+
+@pytest.mark.parametrize("fmt", ["csv", "arrow", "parquet"])
+def test_predict_output_formats(client, fmt):
+    import pandas as pd
+
+    import result_stream
+    if fmt != "csv":
+        pyarrow = pytest.importorskip("pyarrow")
+        import pyarrow.parquet
+    data = {"dataIndex": "4", "modelPath": "m.ubj", "numFuturePoints": "2", "outputFormat": fmt,
+            "file": (io.BytesIO(b"cgi,a,b,c\n1,1,2,3\n2,2,3,4\n"), "a.csv")}
+
+    resp = client.post("/predict", data=data)
+
+    assert resp.status_code == 200
+    assert resp.mimetype == result_stream.content_type(fmt)
+    body = io.BytesIO(resp.get_data())
+    if fmt == "csv":
+        df = pd.read_csv(body)
+    elif fmt == "arrow":
+        df = pyarrow.ipc.open_stream(body).read_pandas()
+    else:
+        df = pyarrow.parquet.read_table(body).to_pandas()
+    assert list(df.columns) == ["cgi", "0", "1"]
+    assert len(df) == 2
+
+
+def test_metrics_endpoint_reports_predictions(client):
+    import metrics
+
+    name = 'predict_rows_total{model="m.ubj",api="rows"}'
+
+    def rows():
+        for line in client.get("/metrics").get_data(as_text=True).splitlines():
+            if line.startswith(name + " "):
+                return float(line.split()[-1])
+        return 0
+
+    before = rows()
+    client.post("/predict/rows", json={"modelPath": "m.ubj", "rows": [[1, 2, 3], [4, 5, 6]]})
+    client.post("/predict/rows", json={"modelPath": "../../etc/missing.ubj", "rows": [[1, 2, 3]]})
+
+    resp = client.get("/metrics")
+    text = resp.get_data(as_text=True)
+    assert resp.content_type == metrics.CONTENT_TYPE
+    assert rows() == before + 2
+    assert 'predict_duration_seconds_count{model="m.ubj",api="rows"}' in text
+    assert "train_queue_depth " in text
+    # 加载失败的模型路径不产生指标标签
+    assert "missing.ubj" not in text
+
+
+def test_predict_error_mid_stream_aborts_the_response(client, monkeypatch):
+    """
+    在真实的gevent服务器上验证：已开始返回后出错，结果末尾有错误标记且分块传输不完整
+    """
+    import threading
+
+    pywsgi = pytest.importorskip("gevent.pywsgi")
+    import requests
+
+    import prediction_code
+    import result_stream
+
+    forecast = prediction_code.recursive_forecast
+    calls = []
+
+    def fail_second_chunk(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > 1:
+            raise RuntimeError("boom")
+        return forecast(*args, **kwargs)
+
+    monkeypatch.setattr(prediction_code, "predict_chunk_rows", 1)
+    monkeypatch.setattr(prediction_code, "recursive_forecast", fail_second_chunk)
+    started = threading.Event()
+    holder = {}
+
+    def serve():
+        # gevent的hub按线程创建，服务器在后台线程中创建和运行
+        wsgi = pywsgi.WSGIServer(("127.0.0.1", 0), server.app, log=None, error_log=None)
+        wsgi.start()
+        holder["server"] = wsgi
+        started.set()
+        wsgi.serve_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    assert started.wait(5)
+    url = "http://127.0.0.1:%d/predict" % holder["server"].server_port
+    resp = requests.post(url, data={"dataIndex": "4", "modelPath": "m.ubj"},
+                         files={"file": ("a.csv", b"cgi,a,b,c\n1,1,2,3\n2,2,3,4\n")}, stream=True)
+    body = b""
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        for part in resp.iter_content(None):
+            body += part
+
+    assert resp.status_code == 200
+    assert body.startswith(b"cgi,0\n1,")
+    assert body.endswith(result_stream.ERROR_MARKER + b"boom\n")
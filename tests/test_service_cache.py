@@ -0,0 +1,84 @@
+import time
+
+from service_cache import ServiceCache, service_key
+
+SERVICE_NAME = "dipper-gateway"
+INSTANCE_LIST_PATH = "/nacos/v1/ns/instance/list"
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class Fetcher:
+    """
+    按调用次数返回预设的实例列表，error不为空时抛出
+    """
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.error = None
+        self.calls = 0
+
+    def __call__(self, service_name, group_name, cluster_name):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {"hosts": list(self.hosts), "lastRefTime": self.calls, "cacheMillis": 10000}
+
+
+def test_queries_are_served_from_the_cache(fake_nacos, nacos_client):
+    fake_nacos.set_instances(SERVICE_NAME, [{"ip": "10.0.0.1", "port": 80}])
+
+    for _ in range(10):
+        assert nacos_client.get_server_instance(SERVICE_NAME) == "http://10.0.0.1:80"
+
+    assert fake_nacos.request_count[INSTANCE_LIST_PATH] == 1
+
+
+def test_background_refresh_picks_up_changes():
+    fetcher = Fetcher([{"ip": "10.0.0.1", "port": 80}])
+    cache = ServiceCache(fetcher, ttl=0.05, jitter=0, min_ttl=0.05)
+    try:
+        assert cache.get(SERVICE_NAME).hosts[0]["ip"] == "10.0.0.1"
+
+        fetcher.hosts = [{"ip": "10.0.0.2", "port": 80}]
+
+        assert wait_until(lambda: cache.get(SERVICE_NAME).hosts[0]["ip"] == "10.0.0.2")
+        assert cache.get(SERVICE_NAME).version == 2
+    finally:
+        cache.stop()
+
+
+def test_failed_refresh_keeps_the_cached_instances():
+    fetcher = Fetcher([{"ip": "10.0.0.1", "port": 80}])
+    cache = ServiceCache(fetcher, ttl=0.05, jitter=0, min_ttl=0.05)
+    try:
+        cache.get(SERVICE_NAME)
+        fetcher.error = ConnectionError("nacos down")
+        calls = fetcher.calls
+
+        assert wait_until(lambda: fetcher.calls > calls + 1)
+        assert cache.get(SERVICE_NAME).hosts == [{"ip": "10.0.0.1", "port": 80}]
+    finally:
+        cache.stop()
+
+
+def test_snapshot_serves_a_new_cache_before_the_first_fetch(tmp_path):
+    key = service_key(SERVICE_NAME)
+    first = ServiceCache(Fetcher([{"ip": "10.0.0.1", "port": 80}]), snapshot_base=str(tmp_path))
+    first.refresh(key)
+
+    fetcher = Fetcher([])
+    fetcher.error = ConnectionError("nacos down")
+    second = ServiceCache(fetcher, snapshot_base=str(tmp_path))
+    try:
+        assert second.warm_up() == 1
+        assert second.get(SERVICE_NAME).hosts[0]["ip"] == "10.0.0.1"
+    finally:
+        second.stop()
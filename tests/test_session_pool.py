@@ -0,0 +1,143 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import util
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    settings = dict(util.POOL_SETTINGS)
+    util.close_sessions()
+    yield
+    util.POOL_SETTINGS.clear()
+    util.POOL_SETTINGS.update(settings)
+    util.close_sessions()
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    """
+    前fail_times次请求返回503，之后返回200
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self):
+        self.server.hits += 1
+        status = 503 if self.server.hits <= self.server.fail_times else 200
+        body = str(self.server.hits).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+
+@pytest.fixture
+def flaky_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FlakyHandler)
+    server.daemon_threads = True
+    server.hits = 0
+    server.fail_times = 2
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def count_connections(server) -> list:
+    """
+    记录服务端accept的每个连接的客户端地址
+    """
+    accepted = []
+    process_request = server.process_request
+
+    def counting(request, client_address):
+        accepted.append(client_address)
+        process_request(request, client_address)
+
+    server.process_request = counting
+    return accepted
+
+
+def test_one_shared_session_per_host():
+    session = util.get_session("10.0.0.1:8848")
+
+    assert util.get_session("10.0.0.1:8848") is session
+    assert util.session_for_url("http://10.0.0.1:8848/nacos/v1/ns/instance?x=1") is session
+    assert util.get_session("10.0.0.2:8848") is not session
+
+
+def test_requests_to_one_host_reuse_a_keep_alive_connection(fake_nacos):
+    accepted = count_connections(fake_nacos)
+    url = "http://" + fake_nacos.address + "/nacos/v1/ns/instance/list?serviceName=dipper-gateway"
+    for _ in range(20):
+        resp = util.do_request("GET", url, response_type=util.MediaType.ORIGIN_RESPONSE)
+        assert resp.status_code == 200
+
+    assert fake_nacos.request_count["/nacos/v1/ns/instance/list"] == 20
+    assert len(accepted) == 1
+
+
+def test_keep_alive_can_be_turned_off(fake_nacos):
+    accepted = count_connections(fake_nacos)
+    util.configure_session_pool(KEEP_ALIVE=False)
+    url = "http://" + fake_nacos.address + "/nacos/v1/ns/instance/list?serviceName=dipper-gateway"
+    for _ in range(3):
+        util.do_request("GET", url, response_type=util.MediaType.ORIGIN_RESPONSE)
+
+    assert len(accepted) == 3
+
+
+def test_get_is_retried_on_503(flaky_server):
+    util.configure_session_pool(BACKOFF_FACTOR=0)
+    url = "http://127.0.0.1:%d/" % flaky_server.server_address[1]
+
+    resp = util.session_for_url(url).get(url, timeout=2)
+
+    assert resp.status_code == 200
+    assert flaky_server.hits == 3
+
+
+def test_post_is_not_retried(flaky_server):
+    util.configure_session_pool(BACKOFF_FACTOR=0)
+    url = "http://127.0.0.1:%d/" % flaky_server.server_address[1]
+
+    resp = util.session_for_url(url).post(url, timeout=2)
+
+    assert resp.status_code == 503
+    assert flaky_server.hits == 1
+
+
+def test_retries_are_bounded_by_max_retries(flaky_server):
+    util.configure_session_pool(BACKOFF_FACTOR=0, MAX_RETRIES=1)
+    url = "http://127.0.0.1:%d/" % flaky_server.server_address[1]
+
+    resp = util.session_for_url(url).get(url, timeout=2)
+
+    # 重试耗尽后返回最后一次的响应，不抛异常
+    assert resp.status_code == 503
+    assert flaky_server.hits == 2
+
+
+def test_configure_rebuilds_sessions_with_new_settings():
+    session = util.get_session("10.0.0.1:8848")
+
+    util.configure_session_pool(POOL_MAXSIZE=32, MAX_RETRIES=5)
+    rebuilt = util.get_session("10.0.0.1:8848")
+
+    assert rebuilt is not session
+    adapter = rebuilt.get_adapter("http://10.0.0.1:8848/")
+    assert adapter.max_retries.total == 5
+    assert adapter._pool_maxsize == 32
+
+
+def test_configure_rejects_unknown_settings():
+    with pytest.raises(KeyError):
+        util.configure_session_pool(POOL_SIZE=8)
+    assert "POOL_SIZE" not in util.POOL_SETTINGS
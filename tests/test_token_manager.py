@@ -0,0 +1,95 @@
+import threading
+import time
+
+import token_manager
+from token_manager import TokenManager
+from util import HostPool
+
+
+class FakeLogin:
+    def __init__(self, delay=0.0, ttl=18000, fail=False):
+        self.delay = delay
+        self.ttl = ttl
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, host, username="", password=""):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        if self.fail:
+            return None
+        return {"accessToken": "token-%d" % calls, "tokenTtl": self.ttl}
+
+
+def make_manager(monkeypatch, login, **kwargs):
+    monkeypatch.setattr(token_manager.util, "get_access_token", login)
+    return TokenManager(HostPool("127.0.0.1:1"), username="nacos", password="nacos", **kwargs)
+
+
+def run_concurrently(fn, n=20):
+    barrier = threading.Barrier(n)
+    results = []
+
+    def target():
+        barrier.wait()
+        results.append(fn())
+
+    threads = [threading.Thread(target=target) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_disabled_without_credentials():
+    manager = TokenManager(HostPool("127.0.0.1:1"))
+    assert manager.get_token() == ""
+    assert manager.refresh(force=True) == ""
+
+
+def test_concurrent_get_token_logs_in_once(monkeypatch):
+    login = FakeLogin(delay=0.2)
+    manager = make_manager(monkeypatch, login)
+
+    results = run_concurrently(manager.get_token)
+
+    assert login.calls == 1
+    assert set(results) == {"token-1"}
+
+
+def test_concurrent_forced_refresh_logs_in_once(monkeypatch):
+    login = FakeLogin(delay=0.2)
+    manager = make_manager(monkeypatch, login)
+    manager.get_token()
+
+    results = run_concurrently(lambda: manager.refresh(force=True))
+
+    assert login.calls == 2
+    assert set(results) == {"token-2"}
+
+
+def test_expiry_and_refresh_time(monkeypatch):
+    manager = make_manager(monkeypatch, FakeLogin(ttl=100), expire_offset=10)
+    start = time.time()
+    manager.get_token()
+
+    assert start + 89 <= manager.invalid_time <= time.time() + 90
+    # 在最后十分之一到五分之一的有效期内后台刷新
+    assert start + 80 <= manager.refresh_time <= time.time() + 90
+
+
+def test_failed_login_backs_off_and_keeps_old_token(monkeypatch):
+    login = FakeLogin()
+    manager = make_manager(monkeypatch, login, min_backoff=60)
+    assert manager.get_token() == "token-1"
+
+    login.fail = True
+    assert manager.refresh(force=True) == "token-1"
+    assert manager.failure_count == 1
+    # 退避期间不再同步登录
+    assert manager.refresh(force=True) == "token-1"
+    assert login.calls == 2
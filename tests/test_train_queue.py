@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import train_queue
+from train_queue import QueueFullError, TrainingQueue
+
+
+def slow_job(seconds, progress=None):
+    """
+    在子进程中运行，每50ms上报一次进度，取消后在上报时终止
+    """
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        progress(0.5, "working")
+        time.sleep(0.05)
+    return "done"
+
+
+def wait_until(predicate, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = TrainingQueue(max_workers=1, max_queue=1)
+    yield queue
+    queue.shutdown(wait=False)
+
+
+def test_full_queue_rejects_and_jobs_can_be_cancelled(queue):
+    running = queue.submit(slow_job, 30, name="running")
+    queued = queue.submit(slow_job, 30, name="queued")
+
+    with pytest.raises(QueueFullError):
+        queue.submit(slow_job, 30)
+    assert queue.pending() == 2
+
+    # 排队中的任务直接取消，运行中的任务在下一次上报进度时终止
+    assert wait_until(lambda: running.status == train_queue.RUNNING)
+    assert queue.cancel(queued.job_id)
+    assert queue.cancel(running.job_id)
+
+    assert wait_until(lambda: queue.pending() == 0)
+    assert queued.status == train_queue.CANCELLED
+    assert running.status == train_queue.CANCELLED
+    assert running.progress == 0.5
+    assert not queue.cancel(running.job_id)
+
+
+def test_finished_job_reports_result(queue):
+    done = []
+    queue.add_done_callback(done.append)
+
+    job = queue.submit(slow_job, 0, name="quick")
+
+    assert wait_until(lambda: done)
+    assert done[0] is job
+    assert job.to_dict()["status"] == train_queue.SUCCEEDED
+    assert (job.result, job.progress) == ("done", 1.0)
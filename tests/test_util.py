@@ -0,0 +1,75 @@
+import time
+
+import pytest
+from requests.exceptions import ConnectionError as RequestConnectionError
+
+import util
+from exception import ForbiddenException
+
+
+def open_client(**kwargs):
+    client = util.HostClient(trys=1, open_sec=0, **kwargs)
+    with pytest.raises(RequestConnectionError):
+        with client.track():
+            raise RequestConnectionError()
+    assert client.state == util.CIRCUIT_OPEN
+    return client
+
+
+def test_failures_open_the_circuit_after_threshold():
+    client = util.HostClient(trys=2, open_sec=60)
+    for _ in range(2):
+        with pytest.raises(RequestConnectionError):
+            with client.track():
+                raise RequestConnectionError()
+    assert client.state == util.CIRCUIT_OPEN
+    assert not client.can_probe()
+
+
+def test_probe_success_closes_the_circuit():
+    client = open_client()
+    assert client.try_acquire_probe()
+    assert not client.can_probe()
+    with client.track():
+        pass
+    assert client.state == util.CIRCUIT_CLOSED
+    assert client.latency_ewma is not None
+
+
+@pytest.mark.parametrize("error", [ForbiddenException(), ValueError("bad json")])
+def test_other_errors_release_the_probe(error):
+    client = open_client()
+    assert client.try_acquire_probe()
+    with pytest.raises(type(error)):
+        with client.track():
+            raise error
+    # host有响应，视为可用
+    assert client.state == util.CIRCUIT_CLOSED
+    assert client.inflight == 0
+
+
+def test_release_probe_without_request():
+    client = open_client()
+    assert client.try_acquire_probe()
+    client.release_probe()
+    assert client.can_probe()
+
+
+def test_probe_slot_expires():
+    client = open_client(probe_timeout=0.05)
+    assert client.try_acquire_probe()
+    assert not client.can_probe()
+    time.sleep(0.06)
+    assert client.can_probe()
+
+
+def test_pool_skips_open_hosts_and_hands_out_probe():
+    pool = util.HostPool("127.0.0.1:1,127.0.0.1:2", fallback_count=1, fallback_init_sec=60)
+    bad, good = pool.hosts
+    bad.mark_failure()
+    assert all(pool.borrow() is good for _ in range(20))
+
+    bad.open_until = 0
+    assert pool.borrow() is bad
+    # 探测进行中，不再放行第二个
+    assert all(pool.borrow() is good for _ in range(20))
@@ -0,0 +1,168 @@
+"""
+nacos认证token管理，后台提前刷新，并发刷新只发起一次登录.
+"""
+import random
+import threading
+import time
+import typing as t
+
+import metrics
+import util
+from util import HostPool, logger
+
+TOKEN_REFRESHES = metrics.counter(
+    "nacos_token_refresh_total", "nacos登录刷新token次数", ["result"])
+
+
+class TokenManager:
+    """
+    token管理器
+
+    登录成功后在 tokenTtl - tokenTtl/10 时由后台线程提前刷新；
+    多个线程同时发现token失效时只有一个线程登录，其余线程等待并复用结果；
+    登录失败不退出进程，按指数退避重试，期间继续返回旧token
+    """
+
+    def __init__(self, host_pool: HostPool, username="", password="",
+                 min_backoff=1, max_backoff=60, expire_offset=10):
+        """
+        Args:
+          host_pool: 连接池
+          username: 用户名
+          password: 密码
+          min_backoff: 登录失败后的初始重试间隔，单位秒
+          max_backoff: 登录失败后的最大重试间隔，单位秒
+          expire_offset: token失效时间的提前量，单位秒
+        """
+        self.host_pool = host_pool
+        self.username = username
+        self.password = password
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.expire_offset = expire_offset
+        self.access_token = ""
+        # token失效时间
+        self.invalid_time = -1
+        # 后台刷新时间
+        self.refresh_time = -1
+        # 每次登录成功递增，用于合并并发的刷新请求
+        self.generation = 0
+        self.refresh_count = 0
+        self.failure_count = 0
+        self._backoff = min_backoff
+        # 登录失败后，在此时间之前不再同步登录，直接返回旧token
+        self._retry_after = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.username and self.password)
+
+    def get_token(self) -> str:
+        """
+        获取有效token，过期时同步刷新
+        """
+        if not self.enabled:
+            return ""
+        if self.access_token and time.time() < self.invalid_time:
+            return self.access_token
+        return self.refresh()
+
+    def refresh(self, force=False, ignore_backoff=False) -> str:
+        """
+        登录刷新token，同一时刻只有一个线程发起登录
+
+        Args:
+          force: 即使token未过期也刷新，服务端返回403时使用
+          ignore_backoff: 忽略登录失败后的退避时间，后台线程使用
+
+        Returns:
+          刷新后的token，登录失败时返回旧token
+        """
+        if not self.enabled:
+            return ""
+        if not ignore_backoff and time.time() < self._retry_after:
+            return self.access_token
+        generation = self.generation
+        with self._lock:
+            if self.generation != generation:
+                # 等待锁的过程中其他线程已经刷新
+                return self.access_token
+            if not force and self.access_token and time.time() < self.invalid_time:
+                return self.access_token
+            self._login()
+            return self.access_token
+
+    def _login(self) -> bool:
+        login_data = util.get_access_token(
+            host=self.host_pool, username=self.username, password=self.password)
+        if not login_data:
+            TOKEN_REFRESHES.inc(result="failure")
+            self.failure_count += 1
+            self._retry_after = time.time() + self._backoff
+            logger.error("[Nacos] nacos认证失败，请检查账号密码是否正确, %s 秒后重试",
+                         self._backoff)
+            return False
+        ttl = login_data["tokenTtl"]
+        now = time.time()
+        self.access_token = login_data["accessToken"]
+        self.invalid_time = now + ttl - self.expire_offset
+        # 在最后十分之一的有效期内刷新，加入抖动避免多个进程同时登录
+        window = ttl / 10.0
+        self.refresh_time = now + ttl - window * (1 + random.random())
+        self.generation += 1
+        self.refresh_count += 1
+        TOKEN_REFRESHES.inc(result="success")
+        self._backoff = self.min_backoff
+        self._wakeup.set()
+        return True
+
+    def start(self):
+        """
+        启动后台刷新线程
+        """
+        if not self.enabled or (self._running and self._thread is not None
+                                and self._thread.is_alive()):
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="nacos-token-refresher",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def _next_delay(self) -> float:
+        if self.access_token and self.refresh_time > 0:
+            return max(0.0, self.refresh_time - time.time())
+        return 0.0
+
+    def _run(self):
+        while self._running:
+            self._wakeup.clear()
+            delay = self._next_delay()
+            if delay > 0 and self._wakeup.wait(delay):
+                # token被其他线程刷新，重新计算等待时间
+                continue
+            if not self._running:
+                break
+            generation = self.generation
+            self.refresh(force=True, ignore_backoff=True)
+            if self.generation == generation:
+                # 登录失败，退避后重试
+                self._wakeup.wait(self._backoff)
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        return {
+            "enabled": self.enabled,
+            "valid": bool(self.access_token) and time.time() < self.invalid_time,
+            "invalidTime": self.invalid_time,
+            "refreshTime": self.refresh_time,
+            "refreshCount": self.refresh_count,
+            "failureCount": self.failure_count,
+        }
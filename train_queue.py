@@ -0,0 +1,274 @@
+"""
+模型训练任务队列，训练在独立的进程池中执行，不占用推理服务进程的GIL和CPU.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import typing as t
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import common_log
+import metrics
+
+log = common_log.get_log('server.log', 'debug')
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+JOB_SECONDS = metrics.histogram(
+    "train_job_duration_seconds", "训练任务从开始运行到结束的耗时", ["status"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+JOBS = metrics.counter("train_jobs_total", "结束的训练任务数", ["status"])
+
+
+class QueueFullError(Exception):
+    """
+    训练队列已满
+    """
+
+
+class JobCancelled(Exception):
+    """
+    训练任务被取消，由子进程在上报进度时抛出
+    """
+
+
+class TrainingJob:
+    """
+    训练任务状态
+    """
+
+    def __init__(self, job_id, name=""):
+        self.job_id = job_id
+        self.name = name
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def to_dict(self) -> dict:
+        return {
+            "jobId": self.job_id,
+            "name": self.name,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+# 以下变量只在子进程中使用
+_events = None
+_cancelled = None
+_job_id = None
+
+
+def _init_worker(events, cancelled, cpus):
+    global _events, _cancelled
+    _events = events
+    _cancelled = cancelled
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def report_progress(progress: float, message=""):
+    """
+    子进程上报训练进度，任务被取消时抛出JobCancelled
+    """
+    if _job_id is None:
+        return
+    if _cancelled is not None and _job_id in _cancelled:
+        raise JobCancelled()
+    _events.put((_job_id, RUNNING, progress, message))
+
+
+def _run_job(job_id, fn, args, kwargs):
+    global _job_id
+    _job_id = job_id
+    try:
+        if _cancelled is not None and job_id in _cancelled:
+            raise JobCancelled()
+        _events.put((job_id, RUNNING, 0.0, "started"))
+        return fn(*args, progress=report_progress, **kwargs)
+    finally:
+        _job_id = None
+
+
+class TrainingQueue:
+    """
+    有界的训练任务队列
+
+    同时运行max_workers个训练进程，最多再排队max_queue个任务，超出时submit抛出QueueFullError；
+    可以为训练进程绑定CPU，避免和推理请求争抢
+    """
+
+    def __init__(self, max_workers=1, max_queue=4, cpu_affinity=None, keep_finished=100):
+        """
+        Args:
+          max_workers: 同时运行的训练进程数
+          max_queue: 排队等待的最大任务数
+          cpu_affinity: 训练进程可用的CPU编号列表，None表示不限制
+          keep_finished: 保留的已结束任务数，超过后按结束时间淘汰
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity else None
+        self.keep_finished = keep_finished
+        self._jobs: t.Dict[str, TrainingJob] = {}
+        self._lock = threading.Lock()
+        self._callbacks: t.List[t.Callable] = []
+        self._executor = None
+        self._manager = None
+        self._events = None
+        self._cancelled = None
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._executor is not None:
+            return
+        # spawn方式启动，避免fork时复制nacos后台线程持有的锁
+        ctx = multiprocessing.get_context("spawn")
+        self._manager = ctx.Manager()
+        self._events = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=ctx, initializer=_init_worker,
+            initargs=(self._events, self._cancelled, self.cpu_affinity))
+        self._thread = threading.Thread(target=self._drain_events, name="train-queue-events",
+                                        daemon=True)
+        self._thread.start()
+
+    def cpu_budget(self) -> int:
+        """
+        每个训练进程可用的线程数
+        """
+        cpus = len(self.cpu_affinity) if self.cpu_affinity else (os.cpu_count() or 1)
+        return max(1, cpus // self.max_workers)
+
+    def add_done_callback(self, fn):
+        """
+        注册任务结束回调，参数为TrainingJob
+        """
+        self._callbacks.append(fn)
+
+    def pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+
+    def submit(self, fn, *args, name="", **kwargs) -> TrainingJob:
+        """
+        提交训练任务，fn需要接收progress关键字参数用于上报进度
+
+        Returns:
+          TrainingJob
+
+        Raises:
+          QueueFullError: 运行和排队的任务数已达上限
+        """
+        with self._lock:
+            if self.pending() >= self.max_workers + self.max_queue:
+                raise QueueFullError("训练队列已满，请稍后重试")
+            self._ensure_started()
+            job = TrainingJob(uuid.uuid4().hex, name)
+            self._jobs[job.job_id] = job
+            job.future = self._executor.submit(_run_job, job.job_id, fn, args, kwargs)
+        job.future.add_done_callback(lambda f, j=job: self._on_done(j, f))
+        log.info("训练任务已提交: %s, 排队中的任务数: %s", job.job_id, self.pending())
+        return job
+
+    def get(self, job_id) -> t.Optional[TrainingJob]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> t.List[TrainingJob]:
+        return sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+
+    def cancel(self, job_id) -> bool:
+        """
+        取消任务：排队中的任务直接取消，运行中的任务在下一次上报进度时终止
+
+        Returns:
+          是否找到未结束的任务
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return False
+        if job.future is not None and job.future.cancel():
+            return True
+        self._cancelled[job_id] = True
+        job.message = "cancelling"
+        return True
+
+    def _drain_events(self):
+        while True:
+            try:
+                job_id, status, progress, message = self._events.get()
+            except (EOFError, OSError):
+                return
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                continue
+            if job.started is None:
+                job.started = time.time()
+            job.status = status
+            job.progress = progress
+            job.message = message
+
+    def _on_done(self, job: TrainingJob, future):
+        job.finished = time.time()
+        if future.cancelled():
+            job.status = CANCELLED
+        else:
+            e = future.exception()
+            if e is None:
+                job.status = SUCCEEDED
+                job.progress = 1.0
+                job.result = future.result()
+            elif isinstance(e, JobCancelled):
+                job.status = CANCELLED
+            else:
+                job.status = FAILED
+                job.error = str(e)
+                log.error("训练任务失败: %s, %s", job.job_id, e)
+        if self._cancelled is not None:
+            self._cancelled.pop(job.job_id, None)
+        log.info("训练任务结束: %s, 状态: %s", job.job_id, job.status)
+        JOBS.inc(status=job.status)
+        # 排队中被取消的任务没有运行时间
+        if job.started is not None or job.status != CANCELLED:
+            JOB_SECONDS.observe(job.finished - (job.started or job.created), status=job.status)
+        for fn in self._callbacks:
+            try:
+                fn(job)
+            except Exception:
+                log.exception("训练任务回调执行失败", exc_info=True)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+            if len(finished) <= self.keep_finished:
+                return
+            finished.sort(key=lambda j: j.finished or 0)
+            for job in finished[:len(finished) - self.keep_finished]:
+                self._jobs.pop(job.job_id, None)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
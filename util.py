@@ -1,9 +1,16 @@
 """
 nacos operate foundation utils.
 """
+import itertools
+import random
 import socket
+import threading
 import requests
-from requests.exceptions import ConnectionError as RequestConnectionError
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestConnectionError, Timeout
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
 import logging
 import time as dt
 import common_log
@@ -22,6 +29,90 @@ logger = common_log.get_log('server.log', 'debug')
 # 默认请求超时时间 5秒
 DEFAULT_TIMEOUT = 5
 
+# 连接池配置，每个host对应一个Session，Session内部维护keep-alive连接
+POOL_SETTINGS = {
+    "POOL_CONNECTIONS": 4,  # 每个Session缓存的连接池个数
+    "POOL_MAXSIZE": 16,  # 每个连接池保持的最大连接数，需大于并发的心跳、监听线程数
+    "MAX_RETRIES": 2,  # 连接失败时的重试次数，读超时不重试（长轮询会主动挂起）
+    "BACKOFF_FACTOR": 0.2,  # 重试退避系数，单位秒
+    "KEEP_ALIVE": True,  # 是否复用连接
+}
+# host和Session映射
+_session_dict = {}
+_session_lock = threading.Lock()
+
+
+def _new_session() -> requests.Session:
+    retry = Retry(total=POOL_SETTINGS["MAX_RETRIES"],
+                  connect=POOL_SETTINGS["MAX_RETRIES"],
+                  read=0,
+                  backoff_factor=POOL_SETTINGS["BACKOFF_FACTOR"],
+                  status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset(["GET", "PUT", "DELETE", "HEAD"]),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=POOL_SETTINGS["POOL_CONNECTIONS"],
+                          pool_maxsize=POOL_SETTINGS["POOL_MAXSIZE"],
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = ("keep-alive" if POOL_SETTINGS["KEEP_ALIVE"]
+                                     else "close")
+    return session
+
+
+def get_session(host: str) -> requests.Session:
+    """
+    获取host对应的共享Session，同一个host的所有请求复用同一个连接池
+
+    Args:
+      host: ip:端口
+
+    Returns:
+      requests.Session对象
+    """
+    session = _session_dict.get(host)
+    if session is not None:
+        return session
+    with _session_lock:
+        session = _session_dict.get(host)
+        if session is None:
+            session = _new_session()
+            _session_dict[host] = session
+        return session
+
+
+def session_for_url(url: str) -> requests.Session:
+    """
+    根据完整url获取对应host的共享Session
+    """
+    return get_session(urlsplit(url).netloc)
+
+
+def configure_session_pool(**kwargs):
+    """
+    修改连接池配置，已创建的Session会被关闭，下次请求时按新配置重建
+
+    Examples:
+      configure_session_pool(POOL_MAXSIZE=32, MAX_RETRIES=3)
+    """
+    for key in kwargs:
+        if key not in POOL_SETTINGS:
+            raise KeyError("未知的连接池配置项：%s" % key)
+    POOL_SETTINGS.update(kwargs)
+    close_sessions()
+
+
+def close_sessions():
+    """
+    关闭所有host的Session，释放keep-alive连接
+    """
+    with _session_lock:
+        sessions = list(_session_dict.values())
+        _session_dict.clear()
+    for session in sessions:
+        session.close()
+
 
 class MediaType:
     """
@@ -48,6 +139,7 @@ def do_request(method, url, *args,
     logger.debug("[nacos] 请求 - [%s] - %s", method, url)
     if "timeout" not in kwargs:
         kwargs["timeout"] = DEFAULT_TIMEOUT
+    session = session_for_url(url)
     if method == "GET":
         url = url + "/"
         for item in args:
@@ -59,11 +151,13 @@ def do_request(method, url, *args,
                 url = url + str(item) + "=" + str(kwargs[item]) + "&"
             url = url[:-1]
         logger.debug("请求接口 %s", url)
-        resp = requests.get(url, *args, **kwargs)
+        resp = session.get(url, *args, **kwargs)
     if method == "POST":
-        resp = requests.post(url, *args, **kwargs)
+        resp = session.post(url, *args, **kwargs)
     if method == "PUT":
-        return requests.put(url, *args, **kwargs)
+        return session.put(url, *args, **kwargs)
+    if method == "DELETE":
+        resp = session.delete(url, *args, **kwargs)
     if resp is None:
         return "Request Error"
     elif resp:
@@ -88,22 +182,171 @@ def do_request(method, url, *args,
             raise InternalException()
 
 
+# 熔断器状态
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
 class HostClient:
     """
     nacos连接客户端，提供基本的操作方法，每个客户端对应一个host地址
+
+    每个客户端维护自己的熔断器和延迟统计：
+    连续失败failure_threshold次后熔断，熔断open_sec*系数秒后进入半开状态放行一个探测请求，
+    探测成功则恢复并重置系数，失败则系数加一后继续熔断
     """
-    host = ""
-    protocol = "http"
-    # 失败尝试次数
-    trys = 5
-    is_valid = True
-    # 是否健康，上次请求成功则标记健康
-    is_health = True
-
-    def __init__(self, host="127.0.0.1:8848", protocol="http", trys=5):
+    # 计为host故障的异常，其余异常(如403、404、返回内容解析失败)说明host可以响应
+    FAILURES = (RequestConnectionError, Timeout, InternalException)
+
+    def __init__(self, host="127.0.0.1:8848", protocol="http", trys=5,
+                 open_sec=600, max_open_factor=6, ewma_alpha=0.3, probe_timeout=60):
         self.host = host
-        self.trys = trys
         self.protocol = protocol
+        # 连续失败多少次后熔断
+        self.failure_threshold = trys
+        self.open_sec = open_sec
+        self.max_open_factor = max_open_factor
+        self.ewma_alpha = ewma_alpha
+        # 探测名额超过多少秒没有记录结果时自动释放，避免借出后未发出请求导致host永远不可用
+        self.probe_timeout = probe_timeout
+        # 是否健康，上次请求成功则标记健康
+        self.is_health = True
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.open_factor = 1
+        self.open_until = 0.0
+        self._probing = False
+        self._probe_since = 0.0
+        # 请求延迟的指数加权移动平均，单位秒，None表示还没有样本
+        self.latency_ewma = None
+        self.inflight = 0
+        self.success_count = 0
+        self.failure_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_valid(self):
+        return self.state == CIRCUIT_CLOSED
+
+    def can_probe(self, now=None) -> bool:
+        """
+        熔断时间已到且没有探测请求在进行中，或进行中的探测已超时
+        """
+        now = now or dt.time()
+        if self.state == CIRCUIT_CLOSED or now < self.open_until:
+            return False
+        return not self._probing or now - self._probe_since >= self.probe_timeout
+
+    def try_acquire_probe(self) -> bool:
+        """
+        进入半开状态并占用唯一的探测名额
+        """
+        with self._lock:
+            if not self.can_probe():
+                return False
+            self.state = CIRCUIT_HALF_OPEN
+            self._probing = True
+            self._probe_since = dt.time()
+            return True
+
+    def release_probe(self):
+        """
+        归还探测名额，借出客户端后没有发出请求(如获取token失败)时调用
+        """
+        with self._lock:
+            self._probing = False
+
+    def score(self) -> float:
+        """
+        选择权重，越小越优先：平均延迟 * (进行中请求数 + 1)
+        """
+        return (self.latency_ewma or 0.0) * (self.inflight + 1)
+
+    def mark_success(self, latency=None):
+        with self._lock:
+            self.is_health = True
+            self.success_count += 1
+            self.consecutive_failures = 0
+            if self.state != CIRCUIT_CLOSED:
+                logger.info("[Nacos] host [%s] 恢复可用", self.host)
+            self.state = CIRCUIT_CLOSED
+            self._probing = False
+            self.open_factor = 1
+            if latency is not None:
+                self.latency_ewma = (latency if self.latency_ewma is None else
+                                     self.ewma_alpha * latency +
+                                     (1 - self.ewma_alpha) * self.latency_ewma)
+
+    def mark_failure(self):
+        with self._lock:
+            self.is_health = False
+            self.failure_count += 1
+            self.consecutive_failures += 1
+            if self.state == CIRCUIT_HALF_OPEN:
+                # 探测失败，延长熔断时间
+                self.open_factor = min(self.open_factor + 1, self.max_open_factor)
+                self._open()
+            elif (self.state == CIRCUIT_CLOSED
+                  and self.consecutive_failures >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        self.state = CIRCUIT_OPEN
+        self._probing = False
+        self.open_until = dt.time() + self.open_sec * self.open_factor
+        logger.warning("[Nacos] host [%s] 熔断 %s 秒", self.host,
+                       self.open_sec * self.open_factor)
+
+    @contextmanager
+    def track(self, record_latency=True, failures=None):
+        """
+        记录一次请求的结果和耗时，连接失败或超时计为失败，其余视为host可用
+
+        Args:
+          record_latency: 是否记录延迟，长轮询等主动挂起的请求不记录
+          failures: 计为失败的异常类型，默认FAILURES
+
+        Examples:
+          with client.track():
+              session.get(url)
+        """
+        with self._lock:
+            self.inflight += 1
+        start = dt.time()
+        try:
+            yield self
+        except failures or self.FAILURES:
+            self.mark_failure()
+            raise
+        except Exception:
+            # host有响应，只是结果不符合预期，同样要释放探测名额
+            self.mark_success()
+            raise
+        except BaseException:
+            self.release_probe()
+            raise
+        else:
+            self.mark_success(dt.time() - start if record_latency else None)
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def stats(self) -> dict:
+        """
+        客户端状态，用于排查问题
+        """
+        return {
+            "host": self.host,
+            "state": self.state,
+            "latencyEwmaMs": (None if self.latency_ewma is None
+                              else round(self.latency_ewma * 1000, 3)),
+            "inflight": self.inflight,
+            "consecutiveFailures": self.consecutive_failures,
+            "successCount": self.success_count,
+            "failureCount": self.failure_count,
+            "openUntil": self.open_until if self.state != CIRCUIT_CLOSED else None,
+        }
 
     def __get_prefix_uri(self):
         return f"{self.protocol}://{self.host}/nacos/v1"
@@ -121,18 +364,15 @@ class HostClient:
           response_type: 返回结果格式，用于对返回结果自动处理，默认json
 
         Returns:
-          根据返回结果类型处理过的接口调用结果，或者请求失败返回None
+          根据返回结果类型处理过的接口调用结果，或者请求失败返回None
         """
         url = self.__get_prefix_uri() + uri
         try:
-            result = do_request(method=method, url=url,
-                                data=data, response_type=response_type, *args, **kwargs)
-            self.is_health = True
-            return result
-        except RequestConnectionError as e:
-            self.trys = self.trys - 1
+            with self.track():
+                return do_request(method=method, url=url,
+                                  data=data, response_type=response_type, *args, **kwargs)
+        except (RequestConnectionError, Timeout) as e:
             logger.warning("[Nacos] URL [%s] 请求失败：%s", url, str(e))
-            self.is_health = False
 
     def login(self, username: str, password: str) -> Any:
         """
@@ -174,6 +414,21 @@ class HostClient:
                                access_token, "post", response_type=MediaType.TEXT_PLAIN_VALUE,
                                params=params or {}) or "请求失败")
 
+    def deregister_service(self, access_token="", params=None):
+        """
+        注销服务
+
+        Args:
+            access_token: token，通过登录获取
+            params: 注销服务用到的参数
+
+        Returns:
+            注销结果
+        """
+        return (self.__request("/ns/instance?accessToken=" +
+                               access_token, "delete", response_type=MediaType.TEXT_PLAIN_VALUE,
+                               params=params or {}) or "请求失败")
+
     def beat(self, access_token="", params=None) -> Response:
         """
         维持心跳
@@ -196,35 +451,39 @@ class HostClient:
 
 class HostPool:
     """
-    host管理器，后续继承接口请求，并对请求错误做标记
+    host管理器，负责在一组nacos地址中选择客户端
 
-    一组ip每次获取下一个，如果网络请求失败会标记次数，次数到了阈值会临时移除，并在一点时间后重新加入
+    熔断中的host不会被选中；熔断到期的host优先放行一个探测请求；
+    其余host按round_robin轮询，或按p2c随机取两个比较 平均延迟*(进行中请求数+1) 选择较小者
     """
-    idx = 0
-    hosts: List[HostClient] = []
-
-    # 失败次数，到达次数后会将ip移动到失败数据中，并且标记失败时间
-    _fallback_count = 5
-    # 失败后将host放回的间隔
-    _fallback_init_sec = 600
-    # host和上次失败时间映射
-    _fallback_time_dict = {}
-    # host和失败次数映射
-    _fallback_count_dict = {}
-    # 失败恢复时间系数
-    _fallback_factor_dict = {}
-
-    def __init__(self, host="127.0.0.1:8848"):
+    ROUND_ROBIN = "round_robin"
+    P2C = "p2c"
+
+    def __init__(self, host="127.0.0.1:8848", strategy=P2C,
+                 fallback_count=5, fallback_init_sec=600, explore_ratio=0.05):
+        """
+        Args:
+          host: nacos地址，多个用逗号分隔
+          strategy: 选择策略，p2c 或 round_robin
+          fallback_count: 连续失败多少次后熔断
+          fallback_init_sec: 熔断的初始时长，单位秒，每次探测失败后按倍数增加
+          explore_ratio: p2c策略下随机选择的比例，避免慢节点恢复后一直拿不到请求、延迟无法更新
+        """
         ar = [str.strip(x) for x in host.split(",")]
         hosts = [x if ":" in x else f"{x}:8848" for x in ar]
-        self.hosts = [HostClient(host=x, trys=self._fallback_count)
-                      for x in hosts]
+        self.hosts: List[HostClient] = [
+            HostClient(host=x, trys=fallback_count, open_sec=fallback_init_sec)
+            for x in hosts]
         self.size = len(self.hosts)
+        self.strategy = strategy
+        self.explore_ratio = explore_ratio
+        # itertools.count的next是原子操作，轮询无需加锁
+        self._counter = itertools.count()
 
     def borrow(self) -> HostClient:
         """
         获取一个客户端，客户端包含对nacos的各种操作，每个client都是无状态的服务，绑定一个固定的host.
-        如果由于连接超时等多次链接失败会将该host的client暂时移除，无法获取，在等待一段时候后恢复可用.
+        如果由于连接超时等多次链接失败会将该host的client熔断，无法获取，在等待一段时候后放行探测请求.
 
         Returns:
         获取一个连接对象
@@ -233,32 +492,31 @@ class HostPool:
         HostPool(host="127.0.0.1:8848").borrow()
         """
         now = dt.time()
-        hosts = []
         for h in self.hosts:
-            if h.is_valid and h.trys <= 0:
-                h.is_valid = False
-                self._fallback_time_dict[h.host] = now
-            elif not h.is_valid:
-                fac = dict.get(self._fallback_factor_dict, h.host, 1)
-                if (now - dict.get(self._fallback_time_dict, h.host, 0)
-                ) > fac * self._fallback_init_sec:
-                    h.is_valid = True
-                    # 恢复的时候把时间系数加一
-                    self._fallback_factor_dict[h.host] = dict.get(
-                        self._fallback_factor_dict, h.host, 1) + 1
-            else:
-                hosts.append(h)
-
+            if h.can_probe(now) and h.try_acquire_probe():
+                logger.debug("[Nacos] Borrow Client : 探测 [%s]", h.host)
+                return h
+        hosts = [h for h in self.hosts if h.state == CIRCUIT_CLOSED]
         size = len(hosts)
         if not size:
             raise Exception("[Nacos] 没有可用的服务地址")
-        i = min(self.idx, size - 1)
-        logger.debug("[Nacos] Borrow Client : Total [%s], Now [%s]",
-                     size, self.idx)
-        try:
-            return hosts[i]
-        finally:
-            self.idx = (i + 1) % size
+        if size == 1:
+            return hosts[0]
+        if self.strategy == self.ROUND_ROBIN:
+            return hosts[next(self._counter) % size]
+        if random.random() < self.explore_ratio:
+            return random.choice(hosts)
+        a, b = random.sample(hosts, 2)
+        return a if a.score() <= b.score() else b
+
+    def stats(self) -> List[dict]:
+        """
+        所有host的状态
+
+        Returns:
+          [{"host": ..., "state": ..., "latencyEwmaMs": ..., ...}]
+        """
+        return [h.stats() for h in self.hosts]
 
 
 def get_host_ip():
@@ -293,9 +551,10 @@ def get_access_token(host: HostPool, username="", password="") -> Any:
     """
     data = None
     try:
-        while True:
+        # 每个host最多尝试一次，失败的host会被熔断器记录
+        for _ in range(host.size):
             h = host.borrow()
-            if not h or not h.is_health:
+            if not h:
                 return data
             data = h.login(username=username, password=password)
             if data: